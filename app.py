@@ -3,4 +3,9 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
+    from app import migrations
+
+    # The development server creates and upgrades its own database; deployments run `flask db upgrade`
+    with app.app_context():
+        migrations.upgrade(echo=print)
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -3,22 +3,36 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 import os
 
+from app import database, money
+
 db = SQLAlchemy()
 login_manager = LoginManager()
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, template_folder='../templates', static_folder='../static')
+    app.json = money.JSONProvider(app)
     
     # Set locale to ensure USD formatting
     app.config['BABEL_DEFAULT_LOCALE'] = 'en_US'
     app.config['BABEL_DEFAULT_TIMEZONE'] = 'UTC'
     
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///finance.db'
+    app.config.update(database.settings_from_env())
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = 'uploads'
     
+    from app import instrumentation, jobs, response_cache
+    app.config.update(jobs.settings_from_env())
+    app.config.update(response_cache.settings_from_env())
+    app.config.update(instrumentation.settings_from_env())
+    
+    if test_config:
+        app.config.update(test_config)
+    
+    database.configure(app)
     db.init_app(app)
+    with app.app_context():
+        database.init_engine(app, db.engine)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
@@ -29,6 +43,7 @@ def create_app():
     from app.routes.categories import categories_bp
     from app.routes.api import api_bp
     from app.routes.settings import settings_bp
+    from app.routes.jobs import jobs_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(main_bp)
@@ -36,9 +51,21 @@ def create_app():
     app.register_blueprint(categories_bp, url_prefix='/categories')
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(settings_bp, url_prefix='/settings')
+    app.register_blueprint(jobs_bp, url_prefix='/jobs')
     
-    with app.app_context():
-        from app.models import User, Expense, Category, Subcategory
-        db.create_all()
+    instrumentation.init_app(app)
+    response_cache.init_app(app)
+    
+    from app.cli import register_commands
+    register_commands(app)
+    
+    # Their session hooks keep derived data current, whichever routes are imported
+    from app import data_version, rollups
+    
+    if app.config['SCHEMA_AUTO_UPGRADE']:
+        # Normally done once per deploy by `flask db upgrade` instead of by every worker
+        from app import migrations
+        with app.app_context():
+            migrations.upgrade()
     
     return app
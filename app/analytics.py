@@ -0,0 +1,346 @@
+"""Columnar in-memory analytics over a user's expenses.
+
+A user's expenses are loaded once into an ``ExpenseFrame``, parallel NumPy
+arrays of day numbers, integer amounts and category ids, and kept in a
+bounded process cache. ``AnalyticsQuery`` answers group-by, time bucket and
+filter queries against it with vectorized operations, so a new chart needs
+no new SQL. ``GET /api/analytics`` exposes it.
+
+Each frame is cached with the user's data version (see ``app.data_version``)
+and reloaded once the version has moved on, so every worker sees committed
+changes on its next query.
+"""
+from datetime import date
+
+import numpy as np
+from sqlalchemy import BigInteger, select, type_coerce
+
+from app import data_version, db, money
+from app.cache import TTLCache
+from app.models import Category, Expense, Subcategory
+
+CACHE_SIZE = 256
+CACHE_TTL = 600  # only bounds memory held for idle users; staleness is caught by the version
+
+# Day numbers count from 1970-01-01, a Thursday
+EPOCH = date(1970, 1, 1).toordinal()
+EPOCH_WEEKDAY = 3
+
+DIMENSIONS = ('category', 'subcategory', 'year', 'month', 'week', 'day', 'weekday')
+METRICS = ('total', 'count', 'average', 'min', 'max')
+DEFAULT_METRICS = ('total', 'count')
+MAX_LIMIT = 10000
+
+_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+
+class ExpenseFrame:
+    """One user's expenses as parallel arrays, ordered by date."""
+
+    __slots__ = ('day', 'amount', 'category_id', 'subcategory_id')
+
+    def __init__(self, day, amount, category_id, subcategory_id):
+        self.day = day                        # int32 days since 1970-01-01
+        self.amount = amount                  # int64 minor units, see app.money
+        self.category_id = category_id        # int32
+        self.subcategory_id = subcategory_id  # int32, 0 for no subcategory
+
+    @classmethod
+    def load(cls, user_id):
+        # Raw minor units; converting every row to Decimal would cost more than the query
+        rows = db.session.execute(
+            select(Expense.date, type_coerce(Expense.amount, BigInteger),
+                   Expense.category_id, Expense.subcategory_id)
+            .where(Expense.user_id == user_id)
+            .order_by(Expense.date)
+        ).all()
+        count = len(rows)
+        return cls(
+            np.fromiter((row[0].toordinal() - EPOCH for row in rows), dtype=np.int32, count=count),
+            np.fromiter((row[1] for row in rows), dtype=np.int64, count=count),
+            np.fromiter((row[2] for row in rows), dtype=np.int32, count=count),
+            np.fromiter((row[3] or 0 for row in rows), dtype=np.int32, count=count),
+        )
+
+    def __len__(self):
+        return len(self.day)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, column).nbytes for column in self.__slots__)
+
+
+def get_frame(user_id):
+    # Read the version first: a frame loaded after a concurrent commit is then
+    # newer than its version, which only costs an extra reload
+    version = data_version.current(user_id)
+    cached = _cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    frame = ExpenseFrame.load(user_id)
+    _cache.set(user_id, (version, frame))
+    return frame
+
+
+def invalidate(user_id):
+    _cache.invalidate(user_id)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value).toordinal() - EPOCH
+    except ValueError:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format') from None
+
+
+def _parse_list(args, name, choices):
+    values = [value.strip() for raw in args.getlist(name) for value in raw.split(',') if value.strip()]
+    unknown = [value for value in values if value not in choices]
+    if unknown:
+        raise ValueError(f'Unknown {name} {unknown[0]!r}; choose from {", ".join(choices)}')
+    if len(set(values)) != len(values):
+        raise ValueError(f'{name} lists a value twice')
+    return values
+
+
+def _parse_amount(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    amount = money.parse(value)
+    if amount is None:
+        raise ValueError(f'{name} must be a number')
+    if abs(amount) > money.MAX_AMOUNT:
+        raise ValueError(f'{name} is too large')
+    return money.to_minor(amount)
+
+
+def _parse_ids(args, name):
+    try:
+        return [int(value) for raw in args.getlist(name) for value in raw.split(',') if value.strip()]
+    except ValueError:
+        raise ValueError(f'{name} must be a list of ids') from None
+
+
+class AnalyticsQuery:
+    """A group-by query over one user's expenses, built from request arguments.
+
+    ``group_by`` takes any of ``DIMENSIONS`` and ``metrics`` any of
+    ``METRICS`` (comma separated or repeated). Rows are filtered by
+    ``date_from``/``date_to``, ``category_id``/``subcategory_id`` (several
+    allowed; ``subcategory_id=0`` matches expenses without one) and
+    ``amount_min``/``amount_max``. ``order`` names a dimension or metric,
+    with a leading ``-`` for descending, and ``limit`` caps the rows returned.
+    """
+
+    def __init__(self, group_by=(), metrics=DEFAULT_METRICS, date_from=None, date_to=None,
+                 category_ids=(), subcategory_ids=(), amount_min=None, amount_max=None,
+                 order=None, limit=None):
+        self.group_by = list(group_by)
+        self.metrics = list(metrics)
+        self.date_from = date_from
+        self.date_to = date_to
+        self.category_ids = list(category_ids)
+        self.subcategory_ids = list(subcategory_ids)
+        self.amount_min = amount_min
+        self.amount_max = amount_max
+        self.order = order
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, args):
+        """Parse request arguments; raises ``ValueError`` with a message for the client."""
+        if args.get('description_search'):
+            raise ValueError('description_search is not supported here; use /api/expenses/search')
+
+        order = args.get('order') or None
+        if order is not None and order.lstrip('-') not in DIMENSIONS + METRICS:
+            raise ValueError(f'Cannot order by {order!r}')
+
+        limit = args.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise ValueError('limit must be a whole number') from None
+            if not 1 <= limit <= MAX_LIMIT:
+                raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+
+        group_by = _parse_list(args, 'group_by', DIMENSIONS)
+        if order is not None and order.lstrip('-') in DIMENSIONS and order.lstrip('-') not in group_by:
+            raise ValueError(f'Cannot order by {order.lstrip("-")!r} without grouping by it')
+
+        return cls(
+            group_by=group_by,
+            metrics=_parse_list(args, 'metrics', METRICS) or DEFAULT_METRICS,
+            date_from=_parse_date(args['date_from'], 'date_from') if args.get('date_from') else None,
+            date_to=_parse_date(args['date_to'], 'date_to') if args.get('date_to') else None,
+            category_ids=_parse_ids(args, 'category_id'),
+            subcategory_ids=_parse_ids(args, 'subcategory_id'),
+            amount_min=_parse_amount(args, 'amount_min'),
+            amount_max=_parse_amount(args, 'amount_max'),
+            order=order,
+            limit=limit,
+        )
+
+    def _mask(self, frame):
+        mask = np.zeros(len(frame), dtype=bool)
+        # Days are sorted, so the date range is a slice
+        start = 0 if self.date_from is None else np.searchsorted(frame.day, self.date_from, 'left')
+        stop = len(frame) if self.date_to is None else np.searchsorted(frame.day, self.date_to, 'right')
+        mask[start:stop] = True
+        if self.category_ids:
+            mask &= np.isin(frame.category_id, self.category_ids)
+        if self.subcategory_ids:
+            mask &= np.isin(frame.subcategory_id, self.subcategory_ids)
+        if self.amount_min is not None:
+            mask &= frame.amount >= self.amount_min
+        if self.amount_max is not None:
+            mask &= frame.amount <= self.amount_max
+        return mask
+
+    @staticmethod
+    def _keys(frame, mask, dimension):
+        if dimension == 'category':
+            return frame.category_id[mask]
+        if dimension == 'subcategory':
+            return frame.subcategory_id[mask]
+
+        day = frame.day[mask]
+        if dimension == 'day':
+            return day
+        weekday = (day + EPOCH_WEEKDAY) % 7  # Monday is 0, as in date.weekday()
+        if dimension == 'weekday':
+            return weekday
+        if dimension == 'week':
+            return day - weekday  # the week's Monday
+        days = day.astype('datetime64[D]')
+        if dimension == 'month':
+            return days.astype('datetime64[M]').astype(np.int32)  # months since January 1970
+        return days.astype('datetime64[Y]').astype(np.int32) + 1970
+
+    def aggregate(self, frame):
+        """Group the matching expenses.
+
+        Returns ``(keys, metrics, matched)``: one array per dimension in
+        ``group_by`` and one per metric (``total``, ``count``, ``min`` and
+        ``max`` in minor units), with an entry per group, and the number of
+        expenses that matched the filters.
+        """
+        mask = self._mask(frame)
+        amounts = frame.amount[mask]
+        matched = len(amounts)
+        keys = [self._keys(frame, mask, dimension) for dimension in self.group_by]
+
+        if keys and not matched:
+            empty = np.zeros(0, dtype=np.int64)
+            return keys, {'total': empty, 'count': empty, 'min': empty, 'max': empty}, 0
+        if keys:
+            # Sort rows by group, so every group is a run of equal keys
+            order = np.lexsort(keys[::-1])
+            keys = [key[order] for key in keys]
+            amounts = amounts[order]
+            boundary = np.zeros(matched, dtype=bool)
+            boundary[0] = True
+            for key in keys:
+                boundary[1:] |= key[1:] != key[:-1]
+            starts = np.flatnonzero(boundary)
+            keys = [key[starts] for key in keys]
+        else:
+            # A single group, which reads as zero when nothing matched
+            starts = np.zeros(1, dtype=np.intp)
+            if not matched:
+                amounts = np.zeros(1, dtype=np.int64)
+
+        # Integer sums stay exact; np.bincount would go through float64
+        return keys, {
+            'total': np.add.reduceat(amounts, starts),
+            'count': np.diff(np.append(starts, matched)),
+            'min': np.minimum.reduceat(amounts, starts),
+            'max': np.maximum.reduceat(amounts, starts),
+        }, matched
+
+    def _row_order(self, keys, metrics):
+        if self.order is None:
+            # Time series read in time order, category breakdowns largest first
+            if set(self.group_by) <= {'category', 'subcategory'}:
+                return np.argsort(-metrics['total'], kind='stable')
+            return np.arange(len(metrics['count']))
+
+        name = self.order.lstrip('-')
+        if name in self.group_by:
+            values = keys[self.group_by.index(name)]
+        elif name == 'average':
+            values = metrics['total'] / np.maximum(metrics['count'], 1)
+        else:
+            values = metrics[name]
+        order = np.argsort(values, kind='stable')
+        return order[::-1] if self.order.startswith('-') else order
+
+    def run(self, user_id):
+        frame = get_frame(user_id)
+        keys, metrics, matched = self.aggregate(frame)
+        order = self._row_order(keys, metrics)
+        groups = len(order)
+        if self.limit is not None:
+            order = order[:self.limit]
+
+        labels = _labels(user_id, self.group_by)
+        rows = []
+        for index in order:
+            row = {}
+            for dimension, key in zip(self.group_by, keys):
+                row.update(_dimension_values(dimension, int(key[index]), labels))
+            for metric in self.metrics:
+                row[metric] = _metric_value(metric, metrics, index)
+            rows.append(row)
+
+        return {
+            'group_by': self.group_by,
+            'metrics': self.metrics,
+            'expenses': matched,
+            'groups': groups,
+            'rows': rows,
+        }
+
+
+def _labels(user_id, group_by):
+    labels = {}
+    if 'category' in group_by:
+        labels['category'] = dict(db.session.query(Category.id, Category.name)
+                                  .filter(Category.user_id == user_id))
+    if 'subcategory' in group_by:
+        labels['subcategory'] = dict(db.session.query(Subcategory.id, Subcategory.name)
+                                     .join(Category, Subcategory.category_id == Category.id)
+                                     .filter(Category.user_id == user_id))
+    return labels
+
+
+def _dimension_values(dimension, key, labels):
+    if dimension in ('category', 'subcategory'):
+        if dimension == 'subcategory' and key == 0:
+            return {'subcategory_id': None, 'subcategory': None}
+        return {f'{dimension}_id': key, dimension: labels[dimension].get(key)}
+    if dimension in ('day', 'week'):
+        return {dimension: date.fromordinal(key + EPOCH).isoformat()}
+    if dimension == 'month':
+        year, month = divmod(key, 12)
+        return {'month': f'{1970 + year}-{month + 1:02d}'}
+    return {dimension: key}
+
+
+def _metric_value(metric, metrics, index):
+    count = int(metrics['count'][index])
+    if metric == 'count':
+        return count
+    if metric == 'total':
+        return money.from_minor(int(metrics['total'][index]))
+    if not count:
+        return None
+    if metric == 'average':
+        return money.to_decimal(money.from_minor(int(metrics['total'][index])) / count)
+    return money.from_minor(int(metrics[metric][index]))
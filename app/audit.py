@@ -0,0 +1,271 @@
+"""EXPLAIN QUERY PLAN audit of the queries issued by the routes.
+
+A throwaway SQLite database is seeded with synthetic data, every route is
+driven through the Flask test client while SQL statements are recorded, and
+each recorded statement is explained. Any plan step that scans a whole table
+is reported as a violation, as is any request that executes more statements
+than the per-request budget (usually an N+1 lazy load).
+"""
+import io
+import os
+import re
+import tempfile
+from datetime import date
+
+from sqlalchemy import event
+
+from app import db, jobs
+from app.instrumentation import HEADER as QUERY_COUNT_HEADER
+from app.models import Category, Subcategory, Expense
+from app.pagination import encode_cursor
+
+SCAN_PATTERN = re.compile(r'^SCAN (\w+)')
+MAX_QUERIES = 15
+
+# Routes that are not part of the audited surface
+SKIPPED_ENDPOINTS = {
+    'api.debug_expenses',  # deliberately unscoped debugging aid
+    'settings.preview_theme',  # issues no queries of its own
+    'metrics',  # token protected, issues no queries
+    'static',
+}
+
+# Requests that must be refused rather than merely not fail
+EXPECTED_STATUS = {
+    'GET /api/analytics?amount_min=1e30': 400,
+}
+
+
+class StatementRecorder:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = {}
+        self.current = None
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if executemany or not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT INTO EXPENSE_ROLLUP')):
+            return
+        self.statements.setdefault(statement, (parameters, self.current))
+
+
+def _requests(ids):
+    today = date.today().isoformat()
+    category_id, other_category_id, empty_category_id = ids['categories']
+    subcategory_id, other_subcategory_id = ids['subcategories']
+    expense_id = ids['expense']
+    cursor = ids['cursor']
+    job_id = ids['job']
+    expense_form = {
+        'description': 'Audit expense',
+        'amount': '12.50',
+        'date': today,
+        'category_id': str(category_id),
+        'subcategory_id': str(subcategory_id),
+        'notes': 'audit',
+    }
+    upload = 'description,amount,date,category,subcategory,notes\nAudit import,3.25,2024-01-15,Audit,Imported,\n'
+
+    return [
+        ('GET', '/', None),
+        ('GET', '/dashboard', None),
+        ('GET', '/expenses/', None),
+        ('GET', f'/expenses/?after={cursor}&category_id={category_id}&subcategory_id={subcategory_id}', None),
+        ('GET', f'/expenses/?before={cursor}', None),
+        ('GET', '/expenses/?amount_min=5&amount_max=50&date_from=2024-01-01&date_to=2024-12-31'
+                '&description_search=coffee', None),
+        # Amount bounds far outside the column's range
+        ('GET', '/expenses/?amount_min=1e30', None),
+        ('GET', '/expenses/?amount_max=-1e30', None),
+        ('GET', '/expenses/add', None),
+        ('POST', '/expenses/add', expense_form),
+        ('GET', f'/expenses/edit/{expense_id}', None),
+        ('POST', f'/expenses/edit/{expense_id}', dict(expense_form, amount='15.00')),
+        ('GET', f'/expenses/delete/{expense_id}', None),
+        ('GET', '/expenses/import', None),
+        ('POST', '/expenses/import', {'file': (io.BytesIO(upload.encode()), 'audit.csv')}),
+        ('GET', '/expenses/export', None),
+        ('GET', f'/expenses/export?format=csv.gz&category_id={category_id}', None),
+        ('GET', '/expenses/export?format=xlsx&date_from=2024-01-01', None),
+        ('GET', '/expenses/export?amount_min=1e30', None),
+        ('POST', '/expenses/export', {'format': 'csv.gz', 'category_id': str(category_id)}),
+        ('GET', '/jobs/', None),
+        ('GET', f'/jobs/{job_id}', None),
+        ('GET', f'/jobs/{job_id}/download', None),
+        ('POST', f'/jobs/{job_id}/cancel', None),
+        ('POST', f'/jobs/{job_id}/resume', None),
+        ('GET', '/api/jobs', None),
+        ('GET', f'/api/jobs/{job_id}', None),
+        ('POST', f'/api/jobs/{job_id}/cancel', None),
+        ('POST', f'/api/jobs/{job_id}/resume', None),
+        ('GET', '/categories/', None),
+        ('GET', '/categories/add', None),
+        ('POST', '/categories/add', {'name': 'Audit category', 'description': ''}),
+        ('GET', f'/categories/edit/{category_id}', None),
+        ('POST', f'/categories/edit/{category_id}', {'name': 'Audit renamed', 'description': ''}),
+        ('GET', f'/categories/delete/{category_id}', None),
+        ('GET', f'/categories/delete/{empty_category_id}', None),
+        ('GET', f'/categories/{category_id}/subcategories', None),
+        ('GET', f'/categories/{category_id}/subcategories/add', None),
+        ('POST', f'/categories/{category_id}/subcategories/add', {'name': 'Audit subcategory'}),
+        ('GET', f'/categories/subcategories/edit/{subcategory_id}', None),
+        ('POST', f'/categories/subcategories/edit/{subcategory_id}', {'name': 'Audit sub renamed'}),
+        ('GET', f'/categories/{category_id}/subcategories/json', None),
+        ('GET', f'/categories/subcategories/merge/{category_id}', None),
+        ('POST', f'/categories/subcategories/merge/{category_id}',
+         {'source_subcategory': str(other_subcategory_id), 'target_subcategory': str(subcategory_id)}),
+        ('GET', '/categories/merge', None),
+        ('POST', '/categories/merge',
+         {'source_category': str(other_category_id), 'target_category': str(category_id)}),
+        ('GET', f'/categories/subcategories/delete/{subcategory_id}', None),
+        ('GET', '/api/dashboard/summary', None),
+        ('GET', '/api/dashboard/stats', None),
+        ('GET', f'/api/expenses?after={cursor}&per_page=50', None),
+        ('GET', '/api/expenses?description_search=coffee&with_total=1', None),
+        ('GET', '/api/expenses?amount_min=1e30', None),
+        ('GET', '/api/expenses/search?q=coff', None),
+        ('GET', '/api/analytics?group_by=category,subcategory,month&metrics=total,count,average', None),
+        ('GET', f'/api/analytics?group_by=week&category_id={category_id}&date_from=2024-01-01&order=-total', None),
+        ('GET', '/api/analytics?amount_min=1e30', None),
+        ('GET', '/api/expenses/test-data', None),
+        ('GET', '/api/expenses/custom-range', None),
+        ('GET', '/api/expenses/custom-range?date_from=2024-01-01&date_to=2024-06-30', None),
+        ('GET', '/api/expenses/monthly-trend', None),
+        ('GET', '/api/expenses/category-comparison', None),
+        ('GET', '/settings/settings', None),
+        ('GET', '/settings/settings/reset', None),
+        ('GET', '/create-sample-data', None),
+        ('GET', '/expenses/delete-all', None),
+        ('GET', '/auth/logout', None),
+        ('GET', '/auth/register', None),
+        ('POST', '/auth/register', {'username': 'audit2', 'email': 'audit2@example.com',
+                                    'password': 'password', 'password2': 'password'}),
+        ('GET', '/auth/login', None),
+    ]
+
+
+def _seed(expenses, users):
+    from app.sampledata import create_user, seed_user
+
+    # Other users make user_id selective, as it is in a real install
+    for n in range(users - 1):
+        other = create_user(f'other{n}')
+        seed_user(other.id, expenses=expenses, seed=n + 1)
+
+    user = create_user('audit')
+    tree = seed_user(user.id, expenses=expenses)
+    empty = Category(name='Audit empty', user_id=user.id)
+    db.session.add(empty)
+    db.session.commit()
+
+    category_ids = sorted(tree)
+    category_id = category_ids[0]
+    other_category_id = category_ids[1]
+    subcategory_ids = Subcategory.query.filter_by(category_id=category_id).order_by(Subcategory.id).all()
+    expense = Expense.query.filter_by(user_id=user.id, category_id=category_id).first()
+
+    # A finished export, for the job status and download routes
+    job = jobs.submit(user.id, 'export', {'export_format': 'csv', 'filters': {}})
+
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    return {
+        'job': job.id,
+        'categories': (category_id, other_category_id, empty.id),
+        'subcategories': (subcategory_ids[0].id, subcategory_ids[1].id),
+        'expense': expense.id,
+        'cursor': encode_cursor(expense),
+    }
+
+
+def explain(connection, statement, parameters):
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan, tables):
+    scans = []
+    for detail in plan:
+        match = SCAN_PATTERN.match(detail)
+        if match and match.group(1) in tables:
+            scans.append(detail)
+    return scans
+
+
+def run_audit(expenses=5000, users=4, max_queries=MAX_QUERIES, database_url=None, echo=print):
+    """Run the audit and return ``(scans, heavy, errors)``.
+
+    ``scans`` lists ``(route, statement, plan)`` for statements that scan a
+    whole table, ``heavy`` lists ``(route, count)`` for requests that
+    executed more than ``max_queries`` statements and ``errors`` lists
+    ``(route, status)`` for requests that failed with a server error.
+
+    ``database_url`` runs the routes against an empty, throwaway database on
+    another backend instead of a temporary SQLite file; query plans are only
+    checked on SQLite.
+    """
+    from app import create_app
+
+    workdir = tempfile.mkdtemp(prefix='query-audit-')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url or 'sqlite:///' + os.path.join(workdir, 'audit.db'),
+        'UPLOAD_FOLDER': workdir,
+        'TESTING': True,
+        'PROPAGATE_EXCEPTIONS': False,
+        'WTF_CSRF_ENABLED': False,
+        'JOBS_EAGER': True,
+        'SCHEMA_AUTO_UPGRADE': True,
+    })
+    tables = set(db.metadata.tables)
+
+    with app.app_context():
+        ids = _seed(expenses, users)
+        engine = db.engine
+
+    audited = {rule.endpoint for rule in app.url_map.iter_rules()} - SKIPPED_ENDPOINTS
+    exercised = set()
+    heavy = []
+    errors = []
+    client = app.test_client()
+
+    with StatementRecorder(engine) as recorder:
+        recorder.current = 'POST /auth/login'
+        client.post('/auth/login', data={'username': 'audit', 'password': 'password'})
+        for method, url, data in _requests(ids):
+            recorder.current = f'{method} {url}'
+            adapter = app.url_map.bind('localhost')
+            endpoint, _ = adapter.match(url.split('?')[0], method=method)
+            exercised.add(endpoint)
+            response = client.open(url, method=method, data=data,
+                                   content_type='multipart/form-data' if data else None)
+            response.get_data()
+            expected = EXPECTED_STATUS.get(f'{method} {url}')
+            if response.status_code >= 500 or expected is not None and response.status_code != expected:
+                errors.append((f'{method} {url}', response.status_code))
+            count = int(response.headers.get(QUERY_COUNT_HEADER, 0))
+            if count > max_queries:
+                heavy.append((f'{method} {url}', count))
+
+    for endpoint in sorted(audited - exercised):
+        echo(f'warning: {endpoint} was not exercised')
+
+    scans = []
+    if engine.dialect.name != 'sqlite':
+        echo(f'Drove {len(exercised)} routes; query plans are not checked on {engine.dialect.name}.')
+        return scans, heavy, errors
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            for statement, (parameters, route) in recorder.statements.items():
+                plan = explain(connection, statement, parameters)
+                if full_scans(plan, tables):
+                    scans.append((route, statement, plan))
+
+    echo(f'Explained {len(recorder.statements)} distinct statements from {len(exercised)} routes.')
+    return scans, heavy, errors
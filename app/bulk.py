@@ -0,0 +1,131 @@
+"""Set-based deletes and merges.
+
+Each operation is a fixed handful of bulk statements on the session's
+connection, however many expenses it touches, and leaves committing to the
+caller so the whole operation lands in one transaction. The statements
+bypass the ORM flush hooks, so rollups are deleted or rebuilt here; the
+full-text index follows along through its triggers, and the user's data
+version is bumped. The bump comes first: it locks the user's row, which the
+ORM flush hooks also lock before any expense or rollup row, so concurrent
+writers for one user always take their locks in the same order.
+
+Every operation returns a summary dict of what it changed. Merges and
+delete-all run as background jobs (see ``app.jobs``) that store it as their
+result; subcategory deletes return it as JSON to ``?format=json`` /
+``Accept: application/json`` requests.
+"""
+import time
+
+from flask import request
+from sqlalchemy import bindparam, select
+
+from app import data_version, db, rollups
+from app.models import Category, Expense, ExpenseRollup, Subcategory
+
+
+def wants_json():
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def _summary(operation, started, **counts):
+    return {'operation': operation, **counts,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+
+def delete_all_expenses(user_id):
+    started = time.perf_counter()
+    connection = db.session.connection()
+    data_version.bump(user_id)
+    expense = Expense.__table__
+    rollup = ExpenseRollup.__table__
+
+    deleted = connection.execute(expense.delete().where(expense.c.user_id == user_id)).rowcount
+    connection.execute(rollup.delete().where(rollup.c.user_id == user_id))
+    return _summary('delete_all_expenses', started, expenses_deleted=deleted)
+
+
+def delete_subcategory(user_id, subcategory):
+    """Delete ``subcategory``, leaving its expenses in the parent category."""
+    started = time.perf_counter()
+    connection = db.session.connection()
+    data_version.bump(user_id)
+    expense = Expense.__table__
+
+    detached = connection.execute(
+        expense.update()
+        .where(expense.c.subcategory_id == subcategory.id)
+        .values(subcategory_id=None)
+    ).rowcount
+    connection.execute(Subcategory.__table__.delete().where(Subcategory.__table__.c.id == subcategory.id))
+    rollups.rebuild(connection, user_id=user_id, category_ids=[subcategory.category_id])
+    return _summary('delete_subcategory', started, subcategory_id=subcategory.id,
+                    expenses_updated=detached)
+
+
+def merge_subcategories(user_id, source, target):
+    """Move ``source``'s expenses to ``target`` (same category) and delete ``source``."""
+    started = time.perf_counter()
+    connection = db.session.connection()
+    data_version.bump(user_id)
+    expense = Expense.__table__
+
+    moved = connection.execute(
+        expense.update()
+        .where(expense.c.subcategory_id == source.id, expense.c.user_id == user_id)
+        .values(subcategory_id=target.id)
+    ).rowcount
+    connection.execute(Subcategory.__table__.delete().where(Subcategory.__table__.c.id == source.id))
+    rollups.rebuild(connection, user_id=user_id, category_ids=[target.category_id])
+    return _summary('merge_subcategories', started, source_id=source.id, target_id=target.id,
+                    expenses_moved=moved)
+
+
+def _merged_names(source_name, names, taken):
+    # Same naming as before: "<name> (from <source>)", numbered on collision
+    taken = set(taken)
+    renamed = []
+    for name in names:
+        new_name = f'{name} (from {source_name})'
+        counter = 1
+        while new_name in taken:
+            new_name = f'{name} (from {source_name}) {counter}'
+            counter += 1
+        taken.add(new_name)
+        renamed.append(new_name)
+    return renamed
+
+
+def merge_categories(user_id, source, target):
+    """Move ``source``'s subcategories and expenses to ``target`` and delete ``source``."""
+    started = time.perf_counter()
+    connection = db.session.connection()
+    data_version.bump(user_id)
+    expense = Expense.__table__
+    subcategory = Subcategory.__table__
+
+    taken = connection.execute(
+        select(subcategory.c.name).where(subcategory.c.category_id == target.id)
+    ).scalars().all()
+    moving = connection.execute(
+        select(subcategory.c.id, subcategory.c.name).where(subcategory.c.category_id == source.id)
+    ).all()
+    if moving:
+        names = _merged_names(source.name, [name for _, name in moving], taken)
+        connection.execute(
+            subcategory.update()
+            .where(subcategory.c.id == bindparam('moving_id'))
+            .values(name=bindparam('new_name'), category_id=target.id),
+            [{'moving_id': id, 'new_name': name} for (id, _), name in zip(moving, names)]
+        )
+
+    moved = connection.execute(
+        expense.update()
+        .where(expense.c.category_id == source.id, expense.c.user_id == user_id)
+        .values(category_id=target.id)
+    ).rowcount
+    connection.execute(Category.__table__.delete().where(Category.__table__.c.id == source.id))
+    rollups.rebuild(connection, user_id=user_id, category_ids=[source.id, target.id])
+    return _summary('merge_categories', started, source_id=source.id, target_id=target.id,
+                    expenses_moved=moved, subcategories_moved=len(moving))
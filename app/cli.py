@@ -0,0 +1,139 @@
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db, jobs, migrations, rollups, search
+
+db_cli = AppGroup('db', help='Create and upgrade the database schema.')
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, help='Stop after this migration version.')
+def upgrade_database(target):
+    """Apply pending migrations; run once per deploy."""
+    started = time.perf_counter()
+    applied = migrations.upgrade(target=target, echo=click.echo)
+    click.echo(f'{len(applied)} migration(s) applied; '
+               f'database schema is up to date ({time.perf_counter() - started:.1f}s).')
+
+
+@db_cli.command('status')
+def database_status():
+    """List applied and pending migrations."""
+    pending = 0
+    for migration, applied in migrations.status():
+        if applied is None:
+            pending += 1
+            click.echo(f'{migration.version:04d} {migration.name:<24} pending')
+        else:
+            click.echo(f'{migration.version:04d} {migration.name:<24} '
+                       f'applied {applied.applied_at:%Y-%m-%d %H:%M} ({applied.duration:.1f}s)')
+    if pending:
+        click.echo(f'{pending} pending; run `flask db upgrade`.')
+    for table, column in migrations.missing_columns():
+        # The models have moved ahead of the migrations: someone forgot to write one
+        click.echo(f'warning: {table}.{column} is in the models but not the database' if column
+                   else f'warning: table {table} is in the models but not the database', err=True)
+
+
+rollups_cli = AppGroup('rollups', help='Maintain the precomputed expense rollups.')
+
+
+@rollups_cli.command('rebuild')
+@click.option('--user-id', type=int, help='Only rebuild rollups for this user.')
+def rebuild_rollups(user_id):
+    """Recompute rollups from the expense table."""
+    rollups.rebuild(db.session.connection(), user_id=user_id)
+    db.session.commit()
+    click.echo('Rollups rebuilt.')
+
+
+@rollups_cli.command('check')
+@click.option('--user-id', type=int, help='Only check rollups for this user.')
+def check_rollups(user_id):
+    """Compare rollups against the expense table."""
+    mismatches = rollups.check(db.session.connection(), user_id=user_id)
+    for key, expected, actual in mismatches:
+        user, day, category_id, subcategory_id = key
+        click.echo(f'user={user} day={day} category={category_id} subcategory={subcategory_id}: '
+                   f'expected {expected[0]:.2f}/{expected[1]}, found {actual[0]:.2f}/{actual[1]}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} rollup buckets are out of date; '
+                                   'run "flask rollups rebuild" to fix them.')
+    click.echo('Rollups are consistent.')
+
+
+search_cli = AppGroup('search', help='Maintain the expense full-text search index.')
+
+
+@search_cli.command('rebuild')
+def rebuild_search():
+    """Reindex every expense description and note."""
+    if not search.install(db.session.connection()):
+        raise click.ClickException('This database does not support FTS5; searches use ILIKE.')
+    search.rebuild(db.session.connection())
+    db.session.commit()
+    click.echo('Search index rebuilt.')
+
+
+jobs_cli = AppGroup('jobs', help='Run and clean up background jobs.')
+
+
+@jobs_cli.command('run')
+@click.option('--forever', is_flag=True, help='Keep polling for new jobs instead of exiting when the queue is empty.')
+@click.option('--interval', default=2.0, show_default=True, help='Seconds between polls with --forever.')
+def run_jobs(forever, interval):
+    """Run queued jobs in this process (e.g. with JOB_WORKERS=0 on the web workers)."""
+    app = current_app._get_current_object()
+    while True:
+        ran = jobs.run_pending(app)
+        if ran:
+            click.echo(f'Ran {ran} jobs.')
+        if not forever:
+            break
+        time.sleep(interval)
+
+
+@jobs_cli.command('purge')
+@click.option('--days', type=int, help='Age of finished jobs to delete (default: JOB_RETENTION_DAYS).')
+def purge_jobs(days):
+    """Delete finished jobs and their files."""
+    if days is None:
+        days = current_app.config['JOB_RETENTION_DAYS']
+    click.echo(f'Deleted {jobs.purge(days)} jobs.')
+
+
+@click.command('audit-queries')
+@click.option('--expenses', default=5000, show_default=True, help='Synthetic expenses per user.')
+@click.option('--users', default=4, show_default=True, help='Synthetic users to seed.')
+@click.option('--max-queries', default=15, show_default=True, help='Statements allowed per request.')
+@click.option('--database-url', help='Empty throwaway database to run against instead of a temporary SQLite file.')
+def audit_queries(expenses, users, max_queries, database_url):
+    """Fail if a route errors, does a full table scan or runs too many queries."""
+    from app.audit import run_audit
+
+    scans, heavy, errors = run_audit(expenses=expenses, users=users, max_queries=max_queries,
+                                     database_url=database_url, echo=click.echo)
+    for route, statement, plan in scans:
+        click.echo(f'\n{route}\n{statement}')
+        for detail in plan:
+            click.echo(f'    {detail}')
+    for route, count in heavy:
+        click.echo(f'\n{route} executed {count} statements')
+    for route, status in errors:
+        click.echo(f'\n{route} returned {status}')
+    if scans or heavy or errors:
+        raise click.ClickException(f'{len(scans)} statements do a full table scan, '
+                                   f'{len(heavy)} requests exceed {max_queries} statements, '
+                                   f'{len(errors)} requests failed.')
+    click.echo('No failing routes, full table scans or query-heavy requests found.')
+
+
+def register_commands(app):
+    app.cli.add_command(db_cli)
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(audit_queries)
@@ -0,0 +1,94 @@
+"""Per-user data versions and the conditional GETs built on them.
+
+``User.data_version`` is incremented in the same transaction as every change
+to a user's expenses, categories, subcategories or settings: ORM writes
+through a flush hook, bulk statements by calling ``bump()``. Everything the
+JSON APIs return for a user is derived from that data, so the version makes
+a strong ETag. ``conditional_get`` compares it with ``If-None-Match`` and
+answers ``304 Not Modified`` after a single primary key lookup, before the
+view runs any of its queries.
+"""
+from datetime import date
+from functools import wraps
+from itertools import chain
+
+from flask import current_app, g, make_response, request
+from flask_login import current_user
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Category, Expense, Subcategory, User, UserSettings
+
+
+def current(user_id):
+    """``user_id``'s data version, read at most once per request."""
+    versions = g.setdefault('data_versions', {})
+    if user_id not in versions:
+        versions[user_id] = db.session.query(User.data_version).filter(User.id == user_id).scalar() or 0
+    return versions[user_id]
+
+
+def remember(user_id, version):
+    """Record ``user_id``'s data version, already read by this request."""
+    g.setdefault('data_versions', {})[user_id] = version or 0
+
+
+def bump(user_id, connection=None):
+    """Increment ``user_id``'s data version; call before bulk statements that change their data.
+
+    The update locks the user's row until the transaction ends. The flush
+    hook below runs first among the session hooks, so every writer locks the
+    user before their expenses or rollups, and bulk statements must too.
+    """
+    connection = connection or db.session.connection()
+    connection.execute(update(User).where(User.id == user_id)
+                       .values(data_version=User.data_version + 1))
+    g.get('data_versions', {}).pop(user_id, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_users(session, flush_context):
+    user_ids = set()
+    category_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, (Expense, Category, UserSettings)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Subcategory):
+            category_ids.add(obj.category_id)
+
+    connection = session.connection()
+    if category_ids:
+        user_ids.update(connection.execute(
+            select(Category.user_id).where(Category.id.in_(category_ids))
+        ).scalars())
+    user_ids.discard(None)
+    for user_id in sorted(user_ids):
+        bump(user_id, connection)
+
+
+def etag(user_id):
+    # Dashboard figures are relative to today, so the date is part of the version
+    return f'{user_id}-{current(user_id)}-{date.today():%Y%m%d}'
+
+
+def conditional_get(view):
+    """Give the current user's JSON ``view`` a data-version ETag and answer 304 when it matches."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        tag = etag(current_user.id)
+        if request.if_none_match.contains_weak(tag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(tag)
+        # Browsers may keep the response but must revalidate it; shared caches may not keep it
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+    return wrapper
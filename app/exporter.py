@@ -0,0 +1,112 @@
+import csv
+import os
+import tempfile
+import zlib
+from io import StringIO
+
+from app import db
+from app.models import Expense, Category, Subcategory
+
+EXPORT_COLUMNS = ['description', 'amount', 'date', 'category', 'subcategory', 'notes']
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'expenses.csv'),
+    'csv.gz': ('application/gzip', 'expenses.csv.gz'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'expenses.xlsx'),
+}
+
+# Rows fetched per round trip from the server-side cursor
+FETCH_SIZE = 1000
+
+# Bytes per chunk when streaming a finished file
+BLOCK_SIZE = 64 * 1024
+
+
+def export_query(user_id, filters=None):
+    query = db.session.query(
+        Expense.description,
+        Expense.amount,
+        Expense.date,
+        Category.name,
+        Subcategory.name,
+        Expense.notes
+    ).join(Category, Expense.category_id == Category.id)\
+        .outerjoin(Subcategory, Expense.subcategory_id == Subcategory.id)\
+        .filter(Expense.user_id == user_id)
+
+    if filters is not None:
+        query = filters.apply(query)
+
+    return query.order_by(Expense.date.desc(), Expense.id.desc()).yield_per(FETCH_SIZE)
+
+
+def iter_rows(query):
+    for description, amount, date, category, subcategory, notes in query:
+        # 12.5 rather than the stored precision's 12.5000
+        yield [description, float(amount), date, category, subcategory or '', notes or '']
+
+
+def generate_csv(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % FETCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def generate_csv_gz(rows):
+    # wbits=31 selects the gzip container
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in generate_csv(rows):
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def generate_xlsx(rows):
+    from openpyxl import Workbook
+
+    # Write-only workbooks spool rows to disk instead of keeping cells in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Expenses')
+    sheet.append(EXPORT_COLUMNS)
+    try:
+        for row in rows:
+            sheet.append(row)
+    except BaseException:
+        # Abandoned (cancelled job, client gone): close and drop the sheet's spool file
+        sheet.close()
+        os.remove(sheet._writer.out)
+        raise
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as handle:
+            while True:
+                block = handle.read(BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+
+GENERATORS = {
+    'csv': generate_csv,
+    'csv.gz': generate_csv_gz,
+    'xlsx': generate_xlsx,
+}
+
+
+def generate_export(user_id, export_format, filters=None):
+    return GENERATORS[export_format](iter_rows(export_query(user_id, filters)))
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app import db, money, search
+from app.models import Expense, ExpenseRollup
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _parse_amount(value):
+    amount = money.parse(value)
+    if amount is None:
+        return None
+    # No stored amount lies beyond MAX_AMOUNT, so a bound just outside it matches the same rows and still
+    # fits the integer column
+    limit = money.MAX_AMOUNT + 1
+    return min(max(amount, -limit), limit)
+
+
+class ExpenseFilters:
+    """Filter parameters shared by the expense list and export views."""
+
+    def __init__(self, args):
+        self.category_id = args.get('category_id', type=int)
+        self.subcategory_id = args.get('subcategory_id', type=int)
+        self.amount_min = args.get('amount_min', type=_parse_amount)
+        self.amount_max = args.get('amount_max', type=_parse_amount)
+        self.date_from = args.get('date_from')
+        self.date_to = args.get('date_to')
+        self.description_search = args.get('description_search', '')
+
+    def apply(self, query):
+        # Category filter
+        if self.category_id:
+            query = query.filter(Expense.category_id == self.category_id)
+
+        # Subcategory filter (within category)
+        if self.subcategory_id:
+            query = query.filter(Expense.subcategory_id == self.subcategory_id)
+
+        # Amount filters
+        if self.amount_min is not None:
+            query = query.filter(Expense.amount >= self.amount_min)
+        if self.amount_max is not None:
+            query = query.filter(Expense.amount <= self.amount_max)
+
+        # Date filters
+        date_from = _parse_date(self.date_from)
+        if date_from:
+            query = query.filter(Expense.date >= date_from)
+
+        date_to = _parse_date(self.date_to)
+        if date_to:
+            query = query.filter(Expense.date <= date_to)
+
+        # Full-text search over description and notes
+        if self.description_search:
+            query = search.filter_expenses(query, self.description_search)
+
+        return query
+
+    def total_count(self, user_id):
+        """Count matching expenses from the rollups, or None if the filters need the raw table."""
+        if self.amount_min is not None or self.amount_max is not None or self.description_search:
+            return None
+
+        query = db.session.query(func.sum(ExpenseRollup.count)).filter(ExpenseRollup.user_id == user_id)
+        if self.category_id:
+            query = query.filter(ExpenseRollup.category_id == self.category_id)
+        if self.subcategory_id:
+            query = query.filter(ExpenseRollup.subcategory_id == self.subcategory_id)
+
+        date_from = _parse_date(self.date_from)
+        if date_from:
+            query = query.filter(ExpenseRollup.day >= date_from)
+        date_to = _parse_date(self.date_to)
+        if date_to:
+            query = query.filter(ExpenseRollup.day <= date_to)
+
+        return query.scalar() or 0
+
+    def to_args(self):
+        # Non-empty filters, suitable for passing to url_for
+        args = {
+            'category_id': self.category_id,
+            'subcategory_id': self.subcategory_id,
+            'amount_min': self.amount_min,
+            'amount_max': self.amount_max,
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'description_search': self.description_search,
+        }
+        return {key: value for key, value in args.items() if value not in (None, '')}
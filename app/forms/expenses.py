@@ -1,11 +1,12 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, FloatField, DateField, SelectField, TextAreaField, SubmitField, FileField
+from wtforms import StringField, DecimalField, DateField, SelectField, TextAreaField, SubmitField, FileField
 from wtforms.validators import DataRequired, NumberRange, Length
 from datetime import date
+from app.money import MAX_AMOUNT
 
 class ExpenseForm(FlaskForm):
     description = StringField('Description', validators=[DataRequired(), Length(max=200)])
-    amount = FloatField('Amount', validators=[DataRequired(), NumberRange(min=0.01)])
+    amount = DecimalField('Amount', places=None, validators=[DataRequired(), NumberRange(min=0.01, max=MAX_AMOUNT)])
     date = DateField('Date', validators=[DataRequired()], default=date.today)
     category_id = SelectField('Category', coerce=int, validators=[DataRequired()])
     subcategory_id = SelectField('Subcategory', coerce=int, default=0)
@@ -0,0 +1,101 @@
+"""Cached identity for Flask-Login's user loader.
+
+``load_user`` runs on every authenticated request, so the logged-in user is
+served from a bounded LRU/TTL process cache as a ``CachedUser`` snapshot
+rather than loaded each time. Query ``User`` when the ORM row is needed.
+
+The session stores ``"<id>:<session_version>"``. ``User.set_password``
+increments the version, so sessions issued before a password change stop
+matching. The cache is per process, so the version is read from the
+database on every request, in every worker: a single primary key lookup
+that also reads the user's data version for ``app.data_version``, which
+would otherwise query it for ETags and cached responses.
+"""
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import data_version, db
+from app.cache import TTLCache
+from app.models import User
+
+CACHE_SIZE = 4096
+CACHE_TTL = 300
+
+_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+
+class CachedUser(UserMixin):
+    def __init__(self, id, username, email, session_version):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.session_version = session_version
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.session_version or 0)
+
+    def get_id(self):
+        return f'{self.id}:{self.session_version}'
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+def _parse_token(token):
+    user_id, _, version = str(token).partition(':')
+    try:
+        # Sessions from before versioning only hold the id
+        return int(user_id), int(version or 0)
+    except ValueError:
+        return None, None
+
+
+def _load(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    cached = CachedUser.from_user(user)
+    _cache.set(user_id, cached)
+    return cached
+
+
+def _current_version(user_id):
+    row = db.session.execute(
+        select(User.session_version, User.data_version).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    data_version.remember(user_id, row.data_version)
+    return row.session_version or 0
+
+
+def load_user(token):
+    user_id, version = _parse_token(token)
+    if user_id is None:
+        return None
+
+    # Another worker may have changed the password since this one cached the user
+    current = _current_version(user_id)
+    if current != version:
+        return None
+    cached = _cache.get(user_id)
+    if cached is None or cached.session_version != current:
+        cached = _load(user_id)
+    return cached
+
+
+def invalidate(user_id):
+    _cache.invalidate(user_id)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_changed_users(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            invalidate(obj.id)
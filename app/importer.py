@@ -0,0 +1,260 @@
+import time
+
+from app import data_version, db, rollups
+from app.models import Expense, Category, Subcategory
+from app.money import MAX_AMOUNT, round_to_places
+from app.user_settings import get_settings
+
+REQUIRED_COLUMNS = ['description', 'amount', 'date', 'category']
+
+IMPORT_EXTENSIONS = ('.csv', '.xlsx')
+
+# Rows read, inserted and committed together when importing a file (and per executemany batch)
+CHUNK_SIZE = 5000
+# Bytes read at a time when counting the lines of a CSV file
+_COUNT_BLOCK_SIZE = 1 << 20
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []  # (line number, message) pairs
+        self.categories_created = 0
+        self.subcategories_created = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        if not self.elapsed:
+            return float(self.imported)
+        return self.imported / self.elapsed
+
+
+def _open_sheet(path):
+    # pandas and openpyxl take a while to import, so only imports load them
+    import openpyxl
+
+    # Read-only workbooks stream rows from the file instead of loading the sheet
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    return workbook, workbook.worksheets[0]
+
+
+def _sheet_columns(sheet):
+    header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+    # Named the way pandas.read_excel names them
+    return [str(value) if value is not None else f'Unnamed: {n}' for n, value in enumerate(header)]
+
+
+def read_columns(path):
+    """The column names in the header of the file at ``path``."""
+    import pandas as pd
+
+    if path.endswith('.csv'):
+        return list(pd.read_csv(path, nrows=0).columns)
+    workbook, sheet = _open_sheet(path)
+    try:
+        return _sheet_columns(sheet)
+    finally:
+        workbook.close()
+
+
+def estimate_rows(path):
+    """Roughly how many data rows the file at ``path`` has, for reporting progress; 0 if unknown.
+
+    CSV files are counted by line (a quoted value spanning lines counts
+    more than once); spreadsheets report their own size.
+    """
+    if path.endswith('.csv'):
+        lines = 0
+        last = b'\n'
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(_COUNT_BLOCK_SIZE), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            lines += 1
+        return max(lines - 1, 0)
+    workbook, sheet = _open_sheet(path)
+    try:
+        return max((sheet.max_row or 1) - 1, 0)
+    finally:
+        workbook.close()
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, skip=0):
+    """Yield ``(rows read, frame)`` for consecutive chunks of the file at ``path``.
+
+    Only one chunk is in memory at a time. Frames are indexed by data row
+    (0 for the row after the header), and ``rows read`` counts the data rows
+    up to the end of the chunk, so passing it back as ``skip`` resumes
+    reading after that chunk. Blank spreadsheet rows are left out.
+    """
+    import pandas as pd
+
+    if path.endswith('.csv'):
+        # Skipped rows are parsed again but not kept: counting rows by line
+        # would not match pandas for blank lines and quoted line breaks
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            rows_read = int(chunk.index[-1]) + 1
+            if rows_read <= skip:
+                continue
+            yield rows_read, chunk[chunk.index >= skip]
+        return
+
+    workbook, sheet = _open_sheet(path)
+    try:
+        columns = _sheet_columns(sheet)
+        rows, index = [], []
+        position = skip
+        for position, values in enumerate(sheet.iter_rows(min_row=skip + 2, values_only=True), skip + 1):
+            if all(value is None for value in values):
+                continue
+            values = tuple(values[:len(columns)])
+            rows.append(values + (None,) * (len(columns) - len(values)))
+            index.append(position - 1)
+            if len(rows) == chunk_size:
+                yield position, pd.DataFrame(rows, columns=columns, index=index)
+                rows, index = [], []
+        if rows:
+            yield position, pd.DataFrame(rows, columns=columns, index=index)
+    finally:
+        workbook.close()
+
+
+def _text_column(df, name):
+    import pandas as pd
+
+    if name not in df.columns:
+        return pd.Series([None] * len(df), index=df.index, dtype=object)
+    column = df[name].astype(object).where(df[name].notna(), None)
+    column = column.map(lambda value: str(value).strip() if value is not None else None)
+    return column.where(column != '', None)
+
+
+def validate_frame(df):
+    """Coerce the frame column-wise and return (clean frame, error list).
+
+    Rows with any invalid value are dropped from the clean frame and reported
+    by their line number in the source file (header is line 1), taken from
+    the frame's index of data rows.
+    """
+    import pandas as pd
+
+    clean = pd.DataFrame(index=df.index)
+    clean['description'] = _text_column(df, 'description')
+    clean['category'] = _text_column(df, 'category')
+    clean['subcategory'] = _text_column(df, 'subcategory')
+    clean['notes'] = _text_column(df, 'notes')
+    clean['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    clean['date'] = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+
+    checks = [
+        (clean['description'].isna(), 'description is required'),
+        (clean['description'].str.len() > 200, 'description is longer than 200 characters'),
+        (clean['amount'].isna(), 'amount is not a number'),
+        (clean['amount'].abs() > MAX_AMOUNT, 'amount is too large'),
+        (clean['date'].isna(), 'date could not be parsed'),
+        (clean['category'].isna(), 'category is required'),
+        (clean['category'].str.len() > 100, 'category is longer than 100 characters'),
+        (clean['subcategory'].str.len() > 100, 'subcategory is longer than 100 characters'),
+    ]
+
+    messages = {}
+    invalid = pd.Series(False, index=df.index)
+    for mask, message in checks:
+        mask = mask.fillna(False).astype(bool)
+        invalid |= mask
+        for position in mask.to_numpy().nonzero()[0]:
+            messages.setdefault(position, []).append(message)
+
+    errors = [(int(df.index[position]) + 2, '; '.join(found)) for position, found in sorted(messages.items())]
+    return clean[~invalid], errors
+
+
+def _resolve_categories(user_id, names, result):
+    categories = {
+        c.name: c.id for c in Category.query.filter(
+            Category.user_id == user_id, Category.name.in_(names)
+        )
+    }
+
+    missing = [Category(name=name, user_id=user_id) for name in names if name not in categories]
+    if missing:
+        db.session.add_all(missing)
+        db.session.flush()
+        categories.update((c.name, c.id) for c in missing)
+        result.categories_created = len(missing)
+
+    return categories
+
+
+def _resolve_subcategories(pairs, result):
+    category_ids = {category_id for category_id, _ in pairs}
+    subcategories = {
+        (s.category_id, s.name): s.id for s in Subcategory.query.filter(
+            Subcategory.category_id.in_(category_ids)
+        )
+    }
+
+    missing = [Subcategory(name=name, category_id=category_id)
+               for category_id, name in pairs if (category_id, name) not in subcategories]
+    if missing:
+        db.session.add_all(missing)
+        db.session.flush()
+        subcategories.update(((s.category_id, s.name), s.id) for s in missing)
+        result.subcategories_created = len(missing)
+
+    return subcategories
+
+
+def import_dataframe(df, user_id, chunk_size=CHUNK_SIZE, on_chunk=None):
+    """Validate ``df`` and bulk insert its valid rows as expenses for ``user_id``.
+
+    The caller owns the transaction and is expected to commit on success.
+    ``on_chunk(inserted, total)`` is called after each batch is inserted.
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+
+    clean, result.errors = validate_frame(df)
+    if clean.empty:
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    categories = _resolve_categories(user_id, sorted(clean['category'].unique()), result)
+    clean['category_id'] = clean['category'].map(categories)
+
+    with_subcategory = clean[clean['subcategory'].notna()]
+    subcategories = {}
+    if not with_subcategory.empty:
+        pairs = set(zip(with_subcategory['category_id'], with_subcategory['subcategory']))
+        subcategories = _resolve_subcategories(sorted(pairs), result)
+
+    dates = clean['date'].dt.date
+    decimal_places = get_settings(user_id).decimal_places
+    rows = [
+        {
+            'description': description,
+            'amount': round_to_places(amount, decimal_places),
+            'date': day,
+            'category_id': int(category_id),
+            'subcategory_id': subcategories.get((category_id, subcategory)) if subcategory else None,
+            'user_id': user_id,
+            'notes': notes,
+        }
+        for description, amount, day, category_id, subcategory, notes in zip(
+            clean['description'], clean['amount'], dates,
+            clean['category_id'], clean['subcategory'], clean['notes'])
+    ]
+
+    # Before the inserts, so the user's row is locked first, as by every other writer
+    data_version.bump(user_id)
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(Expense.__table__.insert(), rows[start:start + chunk_size])
+        if on_chunk is not None:
+            on_chunk(min(start + chunk_size, len(rows)), len(rows))
+    rollups.apply_rows(db.session.connection(), rows)
+
+    result.imported = len(rows)
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,296 @@
+"""Per-request timing, SQL and template instrumentation, and the metrics endpoint.
+
+Every statement executed while a request is handled is counted and timed on
+``flask.g``, as is every template rendered. When ``QUERY_COUNT_HEADER`` is
+enabled (the default in debug and testing) the count is returned in an
+``X-Query-Count`` response header, so N+1 regressions show up as a count
+that grows with the number of rows rendered, and a ``Server-Timing`` header
+breaks the request's time down for the browser's developer tools.
+
+Statements slower than ``SLOW_QUERY_MS`` are logged with their parameters.
+With ``PROFILE_SLOW_REQUESTS_MS`` set, every request is sampled by
+``app.profiler`` and the stacks of those that took longer are written to
+``PROFILE_DIR`` as folded stack files.
+
+Request counts and durations, SQL and template time per endpoint and the
+cache statistics are served in the Prometheus text format at ``/metrics``,
+to clients that send ``Authorization: Bearer <METRICS_TOKEN>``; without a
+token the endpoint doesn't exist. Figures are per process, so with several
+gunicorn workers each scrape sees the worker that answered it.
+"""
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import before_render_template, current_app, g, has_app_context, has_request_context, request, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import profiler
+
+HEADER = 'X-Query-Count'
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Longest parameter list written to the slow query log
+MAX_LOGGED_PARAMETERS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def settings_from_env(environ=os.environ):
+    """Instrumentation settings for ``app.config``, overridable through environment variables."""
+    return {
+        'METRICS_TOKEN': environ.get('METRICS_TOKEN', ''),
+        'SLOW_QUERY_MS': float(environ.get('SLOW_QUERY_MS', 200)),
+        'PROFILE_SLOW_REQUESTS_MS': float(environ.get('PROFILE_SLOW_REQUESTS_MS', 0)),  # 0 disables profiling
+        'PROFILE_INTERVAL_MS': float(environ.get('PROFILE_INTERVAL_MS', 5)),
+        'PROFILE_DIR': environ.get('PROFILE_DIR', ''),  # defaults to instance/profiles
+    }
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+
+class Metrics:
+    """Request, SQL and template figures of this process."""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.durations = {}
+        self.statements = Counter()
+        self.db_seconds = Counter()
+        self.templates = Counter()
+        self.template_seconds = Counter()
+        self.slow_queries = 0
+        self.profiles = 0
+        self._lock = threading.Lock()
+
+    def observe_request(self, endpoint, method, status, seconds, statements, db_seconds, templates):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            buckets = self.durations.setdefault(endpoint, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for n, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[n] += 1
+            buckets[-2] += seconds
+            buckets[-1] += 1
+            self.statements[endpoint] += statements
+            self.db_seconds[endpoint] += db_seconds
+            for name, elapsed in templates:
+                self.templates[name] += 1
+                self.template_seconds[name] += elapsed
+
+    def count_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def count_profile(self):
+        with self._lock:
+            self.profiles += 1
+
+    def render(self, caches):
+        """The figures, plus ``caches`` (as returned by ``cache_stats``), in Prometheus text format."""
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+                lines.append(f'{name}{suffix}{{{label_text}}} {value}' if labels else f'{name}{suffix} {value}')
+
+        with self._lock:
+            metric('finance_requests_total', 'counter', 'Requests handled.',
+                   [('', [('endpoint', endpoint), ('method', method), ('status', status)], count)
+                    for (endpoint, method, status), count in sorted(self.requests.items())])
+            samples = []
+            for endpoint, buckets in sorted(self.durations.items()):
+                # observe_request counts a request in every bucket it fits, so counts are cumulative
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    samples.append(('_bucket', [('endpoint', endpoint), ('le', bound)], count))
+                samples.append(('_bucket', [('endpoint', endpoint), ('le', '+Inf')], buckets[-1]))
+                samples.append(('_sum', [('endpoint', endpoint)], round(buckets[-2], 6)))
+                samples.append(('_count', [('endpoint', endpoint)], buckets[-1]))
+            metric('finance_request_duration_seconds', 'histogram', 'Time to handle a request, including streaming.',
+                   samples)
+            metric('finance_request_sql_statements_total', 'counter', 'SQL statements executed by requests.',
+                   [('', [('endpoint', endpoint)], count) for endpoint, count in sorted(self.statements.items())])
+            metric('finance_request_db_seconds_total', 'counter', 'Time requests spent executing SQL.',
+                   [('', [('endpoint', endpoint)], round(seconds, 6))
+                    for endpoint, seconds in sorted(self.db_seconds.items())])
+            metric('finance_template_renders_total', 'counter', 'Templates rendered.',
+                   [('', [('template', name)], count) for name, count in sorted(self.templates.items())])
+            metric('finance_template_render_seconds_total', 'counter', 'Time spent rendering templates.',
+                   [('', [('template', name)], round(seconds, 6))
+                    for name, seconds in sorted(self.template_seconds.items())])
+            metric('finance_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_MS.',
+                   [('', [], self.slow_queries)])
+            metric('finance_profiles_written_total', 'counter', 'Profiles written for slow requests.',
+                   [('', [], self.profiles)])
+
+        caches = {name: stats for name, stats in caches.items() if stats is not None}
+        metric('finance_cache_entries', 'gauge', 'Entries in the in-memory caches.',
+               [('', [('cache', name)], stats.get('size', stats.get('entries', 0)))
+                for name, stats in sorted(caches.items())])
+        metric('finance_cache_hits_total', 'counter', 'In-memory cache hits.',
+               [('', [('cache', name)], stats['hits']) for name, stats in sorted(caches.items())])
+        metric('finance_cache_misses_total', 'counter', 'In-memory cache misses.',
+               [('', [('cache', name)], stats['misses']) for name, stats in sorted(caches.items())])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_counters = []
+
+
+def _metrics():
+    return current_app.extensions.get('metrics') if has_app_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+    for counter in _counters:
+        counter.count += 1
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+    if has_request_context():
+        g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+
+    metrics = _metrics()
+    if metrics is not None and elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        metrics.count_slow_query()
+        logged = repr(parameters)
+        if len(logged) > MAX_LOGGED_PARAMETERS:
+            logged = logged[:MAX_LOGGED_PARAMETERS] + '...'
+        logger.warning('Slow query (%.1f ms): %s; parameters: %s', elapsed * 1000, ' '.join(statement.split()), logged)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_statement(context):
+    if context.connection is not None and context.connection.info.get('statement_started'):
+        context.connection.info['statement_started'].pop()
+
+
+def query_count():
+    """Statements executed so far by the current request."""
+    return g.get('query_count', 0)
+
+
+@contextmanager
+def count_queries():
+    """Count the statements executed inside the block, in or out of a request."""
+    counter = QueryCounter()
+    _counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _counters.remove(counter)
+
+
+def _start_template(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('templates_started', []).append(time.perf_counter())
+
+
+def _end_template(sender, template, context, **extra):
+    started = g.get('templates_started') if has_request_context() else None
+    if started:
+        g.setdefault('templates', []).append((template.name, time.perf_counter() - started.pop()))
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    sampler = current_app.extensions.get('profiler')
+    if sampler is not None:
+        sampler.start()
+
+
+def _add_headers(response):
+    g.status = response.status_code
+    if current_app.config.get('QUERY_COUNT_HEADER', current_app.debug or current_app.testing):
+        response.headers[HEADER] = str(query_count())
+        # Rendering happens before this point, streaming after it
+        elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+        template_seconds = sum(seconds for _, seconds in g.get('templates', ()))
+        response.headers['Server-Timing'] = (f'db;dur={g.get("db_seconds", 0.0) * 1000:.1f}, '
+                                             f'tpl;dur={template_seconds * 1000:.1f}, app;dur={elapsed * 1000:.1f}')
+    return response
+
+
+def _finish_request(exception):
+    if 'request_started' not in g:
+        return
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    current_app.extensions['metrics'].observe_request(
+        endpoint, request.method, g.get('status', 500), elapsed,
+        query_count(), g.get('db_seconds', 0.0), g.get('templates', ()),
+    )
+
+    sampler = current_app.extensions.get('profiler')
+    if sampler is None:
+        return
+    stacks = sampler.stop()
+    if elapsed * 1000 >= current_app.config['PROFILE_SLOW_REQUESTS_MS'] and stacks:
+        name = f'{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{elapsed * 1000:.0f}ms.folded'
+        path = os.path.join(current_app.config['PROFILE_DIR'] or os.path.join(current_app.instance_path, 'profiles'),
+                            name)
+        profiler.write_folded(path, stacks)
+        current_app.extensions['metrics'].count_profile()
+        logger.info('%s %s took %.0f ms; profile written to %s', request.method, request.path, elapsed * 1000, path)
+
+
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        return 'Not Found', 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return 'Unauthorized', 401, {'WWW-Authenticate': 'Bearer'}
+    body = current_app.extensions['metrics'].render(cache_stats())
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def cache_stats():
+    """Size and hit/miss counters of this process's in-memory caches."""
+    from app import identity, response_cache, user_settings
+
+    # The analytics engine is imported by its first query; until then it has nothing cached
+    analytics = sys.modules.get('app.analytics')
+    responses = response_cache.get_cache()
+    return {
+        'users': identity.cache_stats(),
+        'user_settings': user_settings.cache_stats(),
+        'analytics': analytics.cache_stats() if analytics is not None else None,
+        'responses': responses.stats() if responses is not None else None,
+    }
+
+
+def init_app(app):
+    app.extensions['metrics'] = Metrics()
+    if app.config['PROFILE_SLOW_REQUESTS_MS'] > 0:
+        app.extensions['profiler'] = profiler.Sampler(app.config['PROFILE_INTERVAL_MS'] / 1000)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_end_template, app)
+    app.before_request(_start_request)
+    app.after_request(_add_headers)
+    app.teardown_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,477 @@
+"""Background jobs for imports, exports and bulk edits.
+
+Requests that would otherwise hold a worker for minutes queue a row in the
+``job`` table and return at once. A small thread pool in the worker that
+accepted the job runs it. The queue lives in the database, so any worker,
+or ``flask jobs run``, can pick up jobs another process left behind, and no
+broker is needed. Clients poll ``/api/jobs/<id>`` for status and progress.
+Files a job produces are kept in ``UPLOAD_FOLDER/jobs/<id>/`` until
+``flask jobs purge`` removes them.
+
+A handler runs in its own app context and session, and the session is
+committed once after the handler returns. A failed or cancelled job
+therefore leaves no partial changes. Job status and cancellation requests
+go through separate short connections. Progress writes are best-effort,
+because SQLite cannot take them while the handler holds the write lock.
+
+Resumable handlers (imports) instead commit their work in chunks with
+``context.commit(checkpoint)``, which stores the checkpoint in the same
+transaction. The chunks committed before a failure or cancellation stay,
+and ``resume`` queues the job again to carry on from its last checkpoint.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+from werkzeug.datastructures import MultiDict
+from werkzeug.utils import secure_filename
+
+from app import db, bulk, database
+from app.exporter import EXPORT_FORMATS, FETCH_SIZE, GENERATORS, export_query, iter_rows
+from app.filters import ExpenseFilters
+from app.importer import REQUIRED_COLUMNS, estimate_rows, import_dataframe, read_chunks, read_columns
+from app.models import Category, Expense, Job, Subcategory
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Seconds between progress writes (and cancellation checks) of a running job
+PROGRESS_INTERVAL = 0.5
+# Skipped rows an import reports by line number
+MAX_REPORTED_ERRORS = 100
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_resumable = set()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def settings_from_env(environ=os.environ):
+    """Job settings for ``app.config``, overridable through environment variables."""
+    return {
+        'JOB_WORKERS': int(environ.get('JOB_WORKERS', 2)),  # threads per process, 0 to leave jobs to "flask jobs run"
+        'JOB_STALE_AFTER': int(environ.get('JOB_STALE_AFTER', 600)),  # seconds without progress before a job is failed
+        'JOB_RETENTION_DAYS': int(environ.get('JOB_RETENTION_DAYS', 7)),
+        'JOBS_EAGER': False,  # run jobs inside the submitting request, for tests and the query audit
+    }
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def handler(kind, resumable=False):
+    """Register ``func(context, **params)`` to run jobs of ``kind``; its return value is the job result.
+
+    A ``resumable`` handler commits as it goes with ``context.commit`` and
+    picks up from ``context.checkpoint`` when its job is resumed.
+    """
+    def decorate(func):
+        _handlers[kind] = func
+        if resumable:
+            _resumable.add(kind)
+        return func
+    return decorate
+
+
+def job_folder(job_id):
+    return os.path.join(os.path.abspath(current_app.config['UPLOAD_FOLDER']), 'jobs', str(job_id))
+
+
+def artifact_path(job):
+    return os.path.join(job_folder(job.id), job.artifact)
+
+
+class JobContext:
+    """Handed to handlers to report progress, notice cancellation and place files."""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.folder = job_folder(job.id)
+        self.artifact = None  # set to a file name in the job folder to offer it for download
+        self.checkpoint = json.loads(job.checkpoint) if job.checkpoint else None
+        self._last_report = None
+        self._progress_writable = True
+
+    def path(self, filename):
+        os.makedirs(self.folder, exist_ok=True)
+        return os.path.join(self.folder, filename)
+
+    @contextmanager
+    def _status_connection(self):
+        if database.is_sqlite_memory(db.engine.url):
+            # Every handle shares the one in-memory connection, so ending a
+            # separate transaction would end the handler's too
+            yield db.session.connection()
+            return
+        with db.engine.begin() as connection:
+            yield connection
+
+    def check_cancelled(self):
+        with self._status_connection() as connection:
+            requested = connection.execute(
+                select(Job.cancel_requested).where(Job.id == self.job_id)
+            ).scalar()
+        if requested:
+            raise JobCancelled()
+
+    def progress(self, fraction, message=None, force=False):
+        """Record ``fraction`` (0-1) of the work as done; raises ``JobCancelled`` if asked to stop.
+
+        Calls closer together than ``PROGRESS_INTERVAL`` are ignored unless ``force`` is set.
+        """
+        now = time.monotonic()
+        if not force and self._last_report is not None and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+
+        if self._progress_writable:
+            values = {'progress': round(min(max(fraction, 0.0), 1.0) * 100, 1),
+                      'heartbeat_at': datetime.utcnow()}
+            if message is not None:
+                values['message'] = message
+            try:
+                with self._status_connection() as connection:
+                    connection.execute(update(Job).where(Job.id == self.job_id).values(**values))
+            except OperationalError:
+                # SQLite: the handler's own transaction holds a lock this write needs
+                logger.warning('Progress of job %s could not be recorded; continuing without it', self.job_id)
+                self._progress_writable = False
+        self.check_cancelled()
+
+    def commit(self, checkpoint, fraction, message=None):
+        """Commit the handler's work so far together with ``checkpoint`` and its progress.
+
+        ``checkpoint`` (JSON-serializable) is handed back as
+        ``context.checkpoint`` if the job is resumed. Raises ``JobCancelled``
+        if asked to stop, leaving the committed work in place.
+        """
+        values = {'checkpoint': json.dumps(checkpoint),
+                  'progress': round(min(max(fraction, 0.0), 1.0) * 100, 1),
+                  'heartbeat_at': datetime.utcnow()}
+        if message is not None:
+            values['message'] = message
+        db.session.execute(update(Job).where(Job.id == self.job_id).values(**values))
+        db.session.commit()
+        self.checkpoint = checkpoint
+        self._last_report = time.monotonic()
+        self.check_cancelled()
+
+
+def submit(user_id, kind, params=None, upload=None):
+    """Queue a ``kind`` job for ``user_id`` and start it in the background.
+
+    ``upload`` (a ``FileStorage``) is saved to the job folder and its file
+    name passed to the handler as the ``upload`` parameter. Returns the job.
+    """
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    params = dict(params or {})
+
+    job = Job(user_id=user_id, kind=kind, status=QUEUED, progress=0)
+    db.session.add(job)
+    db.session.flush()
+    if upload is not None:
+        folder = job_folder(job.id)
+        os.makedirs(folder, exist_ok=True)
+        filename = secure_filename(upload.filename) or 'upload'
+        upload.save(os.path.join(folder, filename))
+        params['upload'] = filename
+    job.params = json.dumps(params)
+    db.session.commit()
+
+    _dispatch(current_app._get_current_object())
+    return job
+
+
+def cancel(job_id, user_id):
+    """Cancel a queued job, or ask a running one to stop at its next progress report.
+
+    Returns False when the job has already finished.
+    """
+    cancelled = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.user_id == user_id, Job.status == QUEUED)
+        .values(status=CANCELLED, message='Cancelled', finished_at=datetime.utcnow())
+    ).rowcount
+    if not cancelled:
+        cancelled = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.user_id == user_id, Job.status == RUNNING)
+            .values(cancel_requested=True)
+        ).rowcount
+    db.session.commit()
+    return bool(cancelled)
+
+
+def is_resumable(job):
+    return job.status in (FAILED, CANCELLED) and job.kind in _resumable
+
+
+def resume(job_id, user_id):
+    """Queue a failed or cancelled resumable job again, to carry on from its last checkpoint.
+
+    Returns False when the job isn't resumable.
+    """
+    resumed = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.user_id == user_id, Job.status.in_((FAILED, CANCELLED)),
+               Job.kind.in_(sorted(_resumable)))
+        .values(status=QUEUED, message='Resuming', error=None, cancel_requested=False,
+                finished_at=None)
+    ).rowcount
+    db.session.commit()
+    if resumed:
+        _dispatch(current_app._get_current_object())
+    return bool(resumed)
+
+
+def to_dict(job):
+    def timestamp(value):
+        return value.isoformat() if value else None
+
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'cancel_requested': job.cancel_requested,
+        'artifact': job.artifact,
+        'checkpoint': json.loads(job.checkpoint) if job.checkpoint else None,
+        'created_at': timestamp(job.created_at),
+        'started_at': timestamp(job.started_at),
+        'finished_at': timestamp(job.finished_at),
+    }
+
+
+def _executor_for(workers):
+    global _executor, _executor_pid
+    with _executor_lock:
+        # Threads do not survive a fork, so each worker process starts its own pool
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _dispatch(app):
+    if app.config['JOBS_EAGER']:
+        run_pending(app)
+    elif app.config['JOB_WORKERS'] > 0:
+        _executor_for(app.config['JOB_WORKERS']).submit(_run_pending_logged, app)
+
+
+def _finish(job_id, status, **values):
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(Job).where(Job.id == job_id)
+            .values(status=status, finished_at=now, heartbeat_at=now, **values)
+        )
+
+
+def _fail_stale(connection, stale_after):
+    # Jobs whose worker exited mid-run; they never heartbeat again
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    connection.execute(
+        update(Job)
+        .where(Job.status == RUNNING, Job.heartbeat_at < cutoff)
+        .values(status=FAILED, error='The worker running this job stopped before it finished.',
+                finished_at=datetime.utcnow())
+    )
+
+
+def _claim_next():
+    while True:
+        with db.engine.begin() as connection:
+            job_id = connection.execute(
+                select(Job.id).where(Job.status == QUEUED).order_by(Job.id).limit(1)
+            ).scalar()
+            if job_id is None:
+                return None
+            now = datetime.utcnow()
+            claimed = connection.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == QUEUED)
+                .values(status=RUNNING, started_at=now, heartbeat_at=now)
+            ).rowcount
+        if claimed:
+            return job_id
+
+
+def run_job(job_id):
+    """Run a claimed job in the current app context and record how it ended."""
+    job = db.session.get(Job, job_id)
+    context = JobContext(job)
+    kind = job.kind
+    params = json.loads(job.params or '{}')
+    # Don't hold a read transaction open while progress is written from another connection
+    db.session.rollback()
+
+    try:
+        result = _handlers[kind](context, **params)
+        db.session.commit()
+    except JobCancelled:
+        db.session.rollback()
+        _finish(job_id, CANCELLED, message='Cancelled')
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception('Job %s (%s) failed', job_id, kind)
+        _finish(job_id, FAILED, error=str(exc) or exc.__class__.__name__)
+    else:
+        _finish(job_id, SUCCEEDED, progress=100, message='Done',
+                result=json.dumps(result, default=str), artifact=context.artifact)
+
+
+def run_pending(app):
+    """Run queued jobs until the queue is empty; returns how many ran."""
+    with app.app_context():
+        with db.engine.begin() as connection:
+            _fail_stale(connection, app.config['JOB_STALE_AFTER'])
+
+        ran = 0
+        while True:
+            job_id = _claim_next()
+            if job_id is None:
+                return ran
+            # A fresh app context gives every job its own session
+            with app.app_context():
+                run_job(job_id)
+            ran += 1
+
+
+def _run_pending_logged(app):
+    try:
+        run_pending(app)
+    except Exception:
+        logger.exception('Job runner stopped')
+
+
+def purge(older_than_days):
+    """Delete finished jobs (and their files) older than ``older_than_days``; returns the count."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    job_ids = db.session.execute(
+        select(Job.id).where(Job.status.in_(FINISHED), Job.finished_at < cutoff)
+    ).scalars().all()
+    for job_id in job_ids:
+        shutil.rmtree(job_folder(job_id), ignore_errors=True)
+    if job_ids:
+        db.session.execute(Job.__table__.delete().where(Job.__table__.c.id.in_(job_ids)))
+        db.session.commit()
+    return len(job_ids)
+
+
+@handler('import', resumable=True)
+def _import_expenses(context, upload):
+    # The upload is kept until the import succeeds, so a failed one can be resumed
+    path = context.path(upload)
+    state = context.checkpoint or {'rows': 0, 'imported': 0, 'skipped': 0, 'errors': [],
+                                   'categories_created': 0, 'subcategories_created': 0, 'elapsed': 0.0}
+    context.progress(0, 'Reading file' if not state['rows'] else f'Resuming after row {state["rows"]:,}',
+                     force=True)
+    missing = [column for column in REQUIRED_COLUMNS if column not in read_columns(path)]
+    if missing:
+        raise ValueError('File must contain columns: description, amount, date, category')
+
+    total = estimate_rows(path)
+    # One chunk in memory and one transaction per chunk; the checkpoint commits with the chunk's rows
+    for rows_read, chunk in read_chunks(path, skip=state['rows']):
+        result = import_dataframe(chunk, context.user_id)
+        state['rows'] = rows_read
+        state['imported'] += result.imported
+        state['skipped'] += len(result.errors)
+        state['errors'].extend(result.errors[:MAX_REPORTED_ERRORS - len(state['errors'])])
+        state['categories_created'] += result.categories_created
+        state['subcategories_created'] += result.subcategories_created
+        state['elapsed'] += result.elapsed
+        context.commit(state, rows_read / total if total else 0,
+                       f'Imported {state["imported"]:,} rows ({rows_read:,} of about {max(total, rows_read):,} read)')
+    os.remove(path)
+
+    return {
+        'imported': state['imported'],
+        'skipped': state['skipped'],
+        'errors': state['errors'],
+        'categories_created': state['categories_created'],
+        'subcategories_created': state['subcategories_created'],
+        'elapsed': round(state['elapsed'], 3),
+        'rows_per_second': round(state['imported'] / state['elapsed']) if state['elapsed'] else state['imported'],
+    }
+
+
+def _reporting(rows, context, total):
+    for count, row in enumerate(rows, 1):
+        if count % FETCH_SIZE == 0:
+            context.progress(count / total if total else 0, f'Exported {count:,} of {total:,} rows')
+        yield row
+
+
+@handler('export')
+def _export_expenses(context, export_format, filters):
+    filters = ExpenseFilters(MultiDict(filters))
+    total = filters.total_count(context.user_id)
+    if total is None:
+        total = filters.apply(Expense.query.filter_by(user_id=context.user_id)).count()
+    context.progress(0, f'Exporting {total:,} rows', force=True)
+
+    _, filename = EXPORT_FORMATS[export_format]
+    path = context.path(filename)
+    rows = _reporting(iter_rows(export_query(context.user_id, filters)), context, total)
+    try:
+        with open(path, 'wb') as handle:
+            for chunk in GENERATORS[export_format](rows):
+                handle.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    except BaseException:
+        # Don't leave a truncated file behind a cancelled or failed export
+        os.remove(path)
+        raise
+
+    context.artifact = filename
+    return {'format': export_format, 'rows': total, 'bytes': os.path.getsize(path)}
+
+
+@handler('merge_categories')
+def _merge_categories(context, source_id, target_id):
+    context.progress(0, force=True)
+    source = Category.query.filter_by(id=source_id, user_id=context.user_id).first()
+    target = Category.query.filter_by(id=target_id, user_id=context.user_id).first()
+    if source is None or target is None:
+        raise ValueError('Category not found.')
+    return bulk.merge_categories(context.user_id, source, target)
+
+
+@handler('merge_subcategories')
+def _merge_subcategories(context, category_id, source_id, target_id):
+    context.progress(0, force=True)
+    category = Category.query.filter_by(id=category_id, user_id=context.user_id).first()
+    source = Subcategory.query.filter_by(id=source_id, category_id=category_id).first()
+    target = Subcategory.query.filter_by(id=target_id, category_id=category_id).first()
+    if category is None or source is None or target is None:
+        raise ValueError('Subcategory not found.')
+    return bulk.merge_subcategories(context.user_id, source, target)
+
+
+@handler('delete_all_expenses')
+def _delete_all_expenses(context):
+    context.progress(0, force=True)
+    return bulk.delete_all_expenses(context.user_id)
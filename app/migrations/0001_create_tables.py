@@ -0,0 +1,12 @@
+"""Create the tables that don't exist yet.
+
+On a fresh database this creates the whole schema from the models, and the
+later migrations find nothing left to do. On databases created by older
+versions it only adds tables introduced since.
+"""
+from app import db
+from app import models  # noqa: F401  (registers the tables)
+
+
+def upgrade(context):
+    db.metadata.create_all(context.connection)
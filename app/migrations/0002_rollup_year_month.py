@@ -0,0 +1,12 @@
+"""Add expense_rollup.year_month and fill it in for existing rollups."""
+from app.models import ExpenseRollup
+
+TRANSACTIONAL = False
+
+
+def upgrade(context):
+    from app.rollups import month_bucket_expression
+
+    table = ExpenseRollup.__table__
+    context.add_column(table, 'year_month')
+    context.backfill(table, {'year_month': month_bucket_expression(table.c.day)}, table.c.year_month.is_(None))
@@ -0,0 +1,6 @@
+"""Create the FTS5 index over expense descriptions and notes (SQLite only)."""
+from app import search
+
+
+def upgrade(context):
+    search.install(context.connection)
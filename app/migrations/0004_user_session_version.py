@@ -0,0 +1,10 @@
+"""Add user.session_version, used to invalidate sessions on password changes."""
+from app.models import User
+
+TRANSACTIONAL = False
+
+
+def upgrade(context):
+    table = User.__table__
+    context.add_column(table, 'session_version')
+    context.backfill(table, {'session_version': 0}, table.c.session_version.is_(None))
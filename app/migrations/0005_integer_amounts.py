@@ -0,0 +1,39 @@
+"""Store expense amounts as integer minor units instead of floats (see app.money).
+
+The floats are copied into a new BIGINT column in batches rather than by
+rewriting the table in one statement, and the rollups, which are derived
+data, are then recreated with integer totals.
+"""
+from sqlalchemy import BigInteger, Float, cast, column, func, table
+
+from app.models import ExpenseRollup
+from app.money import SCALE
+
+TRANSACTIONAL = False
+
+
+def upgrade(context):
+    columns = context.columns('expense')
+    # amount_float is left behind by an interrupted run
+    if 'amount_float' not in columns:
+        if not isinstance(columns.get('amount'), Float):
+            return
+        with context.begin() as connection:
+            connection.exec_driver_sql('ALTER TABLE expense RENAME COLUMN amount TO amount_float')
+            connection.exec_driver_sql('ALTER TABLE expense ADD COLUMN amount BIGINT')
+
+    expense = table('expense', column('id'), column('amount'), column('amount_float'))
+    context.backfill(expense, {'amount': cast(func.round(expense.c.amount_float * SCALE), BigInteger)},
+                     expense.c.amount.is_(None), key=expense.c.id)
+
+    with context.begin() as connection:
+        # DROP COLUMN needs SQLite 3.35; SQLite can't add NOT NULL to an existing column
+        connection.exec_driver_sql('ALTER TABLE expense DROP COLUMN amount_float')
+        if context.dialect == 'postgresql':
+            connection.exec_driver_sql('ALTER TABLE expense ALTER COLUMN amount SET NOT NULL')
+
+    from app import rollups
+    with context.begin() as connection:
+        ExpenseRollup.__table__.drop(connection)
+        ExpenseRollup.__table__.create(connection)
+        rollups.rebuild(connection)
@@ -0,0 +1,13 @@
+"""Compute rollups for databases created before the rollup table existed."""
+from sqlalchemy import select
+
+from app.models import Expense, ExpenseRollup
+
+
+def upgrade(context):
+    from app import rollups
+
+    connection = context.connection
+    if connection.execute(select(ExpenseRollup.id).limit(1)).first() is None \
+            and connection.execute(select(Expense.id).limit(1)).first() is not None:
+        rollups.rebuild(connection)
@@ -0,0 +1,10 @@
+"""Add user.data_version, the per-user version behind ETags and cached responses."""
+from app.models import User
+
+TRANSACTIONAL = False
+
+
+def upgrade(context):
+    table = User.__table__
+    context.add_column(table, 'data_version')
+    context.backfill(table, {'data_version': 0}, table.c.data_version.is_(None))
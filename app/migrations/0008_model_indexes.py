@@ -0,0 +1,12 @@
+"""Create the models' indexes that tables created by older versions lack."""
+from app import db
+
+TRANSACTIONAL = False
+
+
+def upgrade(context):
+    for model_table in db.metadata.sorted_tables:
+        for index in sorted(model_table.indexes, key=lambda index: index.name):
+            # Built by 0010, once duplicate buckets are merged
+            if index.name != 'ux_rollup_bucket':
+                context.create_index(index)
@@ -0,0 +1,6 @@
+"""Add job.checkpoint, from which a failed import resumes."""
+from app.models import Job
+
+
+def upgrade(context):
+    context.add_column(Job.__table__, 'checkpoint')
@@ -0,0 +1,42 @@
+"""Allow a single rollup bucket per day and category without a subcategory.
+
+The unique constraint on (user_id, day, category_id, subcategory_id) treats
+NULL subcategories as distinct, so PostgreSQL could store two buckets for
+the same day and category when concurrent imports created them. This merges
+such duplicates by rebuilding their users' rollups, then replaces the
+constraint with the ``ux_rollup_bucket`` index on ``coalesce(subcategory_id,
+0)``. SQLite can't drop a table's constraints, so it keeps the old one
+alongside; it is implied by the index.
+
+If a duplicate appears while the index is built, the build fails; running
+the upgrade again merges it and builds the index again.
+"""
+from sqlalchemy import func, select
+
+from app.models import ExpenseRollup
+
+TRANSACTIONAL = False
+
+
+def upgrade(context):
+    from app import rollups
+
+    table = ExpenseRollup.__table__
+    with context.begin() as connection:
+        user_ids = sorted(set(connection.execute(
+            select(table.c.user_id)
+            .where(table.c.subcategory_id.is_(None))
+            .group_by(table.c.user_id, table.c.day, table.c.category_id)
+            .having(func.count() > 1)
+        ).scalars()))
+    for user_id in user_ids:
+        with context.begin() as connection:
+            rollups.rebuild(connection, user_id=user_id)
+    if user_ids:
+        context.progress(f'{table.name}: rebuilt for {len(user_ids)} users with duplicate buckets')
+
+    index, = [index for index in table.indexes if index.name == 'ux_rollup_bucket']
+    context.create_index(index)
+    if context.dialect == 'postgresql':
+        with context.begin() as connection:
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} DROP CONSTRAINT IF EXISTS unique_rollup_bucket')
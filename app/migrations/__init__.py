@@ -0,0 +1,262 @@
+"""Versioned schema migrations.
+
+Migrations are the modules in this package named ``NNNN_description.py``,
+applied in version order by ``flask db upgrade`` and recorded in the
+``schema_migrations`` table. Each defines ``upgrade(context)`` and may set
+``TRANSACTIONAL = False``:
+
+- Transactional migrations run in a single transaction, together with the
+  row recording them, so they either apply completely or not at all.
+- Non-transactional migrations open short transactions of their own through
+  ``context.begin()``, which lets them backfill a large table in batches
+  (``context.backfill``) and build indexes without blocking writers on
+  PostgreSQL (``context.create_index``). They are only recorded once they
+  finish, so they must be safe to run again after being interrupted.
+
+Databases created before migrations existed have no ``schema_migrations``
+table, and may have been created by any earlier version of the app, so
+every migration checks for what it is about to change (``add_column`` and
+``create_index`` already do) and does nothing if it is there.
+"""
+import importlib
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, func, inspect, select
+from sqlalchemy.schema import CreateIndex
+
+from app import db
+
+MIGRATIONS_TABLE = 'schema_migrations'
+# Rows updated per transaction by ``MigrationContext.backfill``
+BACKFILL_BATCH_SIZE = 10000
+# Seconds between two progress messages of a long backfill
+PROGRESS_INTERVAL = 2.0
+# Held by the migrating connection so concurrent upgrades on PostgreSQL queue up
+ADVISORY_LOCK_ID = 0x66696e
+
+_MODULE_PATTERN = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+logger = logging.getLogger(__name__)
+
+applied_table = Table(
+    MIGRATIONS_TABLE, MetaData(),
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+    Column('duration', Float, nullable=False),  # seconds
+)
+
+
+class Migration:
+    def __init__(self, version, name, module):
+        self.version = version
+        self.name = name
+        self.module = module
+        self.transactional = getattr(module, 'TRANSACTIONAL', True)
+
+    @property
+    def description(self):
+        return (self.module.__doc__ or self.name).strip().splitlines()[0]
+
+
+def discover():
+    """Every migration in this package, in version order."""
+    found = []
+    for filename in os.listdir(os.path.dirname(__file__)):
+        match = _MODULE_PATTERN.match(filename)
+        if match:
+            module = importlib.import_module(f'{__name__}.{filename[:-3]}')
+            found.append(Migration(int(match.group(1)), match.group(2), module))
+    found.sort(key=lambda migration: migration.version)
+    versions = [migration.version for migration in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f'Two migrations share a version number: {versions}')
+    return found
+
+
+class MigrationContext:
+    """What a migration's ``upgrade()`` works with."""
+
+    def __init__(self, engine, connection=None, echo=logger.info):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.connection = connection
+        self.echo = echo
+
+    @contextmanager
+    def begin(self):
+        """A connection in a transaction: the migration's own, or a new one committed on exit."""
+        if self.connection is not None:
+            yield self.connection
+        else:
+            with self.engine.begin() as connection:
+                yield connection
+
+    def columns(self, table_name):
+        """``{name: type}`` of ``table_name``'s columns in the database, empty if it doesn't exist."""
+        with self.begin() as connection:
+            inspector = inspect(connection)
+            if not inspector.has_table(table_name):
+                return {}
+            return {column['name']: column['type'] for column in inspector.get_columns(table_name)}
+
+    def add_column(self, table, column_name):
+        """Add the model column ``table.c[column_name]`` if it is missing; return whether it was added.
+
+        Added columns are nullable, so existing rows stay valid; backfill them
+        afterwards.
+        """
+        if column_name in self.columns(table.name):
+            return False
+        with self.begin() as connection:
+            quote = connection.dialect.identifier_preparer.quote
+            column_type = table.c[column_name].type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column_name)} {column_type}'
+            )
+        return True
+
+    def create_index(self, index):
+        """Create ``index`` if it doesn't exist.
+
+        On PostgreSQL, outside a transactional migration, the index is built
+        with ``CREATE INDEX CONCURRENTLY``, so writes carry on while it is
+        built; an invalid index left by an interrupted build is dropped and
+        built again. SQLite has no concurrent builds and blocks writers
+        while the index is built.
+        """
+        if self.dialect != 'postgresql' or self.connection is not None:
+            with self.begin() as connection:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+            return
+
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            valid = connection.exec_driver_sql(
+                'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s',
+                (index.name,)
+            ).scalar()
+            if valid is True:
+                return
+            quote = connection.dialect.identifier_preparer.quote
+            if valid is False:
+                connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY {quote(index.name)}')
+            options = index.dialect_options['postgresql']
+            previous = options['concurrently']
+            options['concurrently'] = True
+            try:
+                connection.execute(CreateIndex(index))
+            finally:
+                options['concurrently'] = previous
+
+    def backfill(self, table, values, where, key=None, batch_size=BACKFILL_BATCH_SIZE):
+        """``UPDATE table SET values WHERE where``, one range of ``key`` values per transaction.
+
+        ``key`` is an integer column, the primary key by default. ``where``
+        must stop matching rows once they are updated (typically ``column IS
+        NULL``), so an interrupted backfill resumes where it stopped. Returns
+        the number of rows updated.
+        """
+        if key is None:
+            key = table.primary_key.columns.values()[0]
+        with self.begin() as connection:
+            low, high, total = connection.execute(
+                select(func.min(key), func.max(key), func.count()).select_from(table).where(where)
+            ).one()
+        if not total:
+            return 0
+
+        done = 0
+        reported = time.monotonic()
+        for start in range(low, high + 1, batch_size):
+            with self.begin() as connection:
+                done += connection.execute(
+                    table.update().where(key >= start, key < start + batch_size, where).values(values)
+                ).rowcount
+            if time.monotonic() - reported >= PROGRESS_INTERVAL:
+                self.progress(f'{table.name}: {done:,} of {total:,} rows ({done / total:.0%})')
+                reported = time.monotonic()
+        self.progress(f'{table.name}: {done:,} rows updated')
+        return done
+
+    def progress(self, message):
+        self.echo(f'  {message}')
+
+
+def _applied(connection):
+    applied_table.create(connection, checkfirst=True)
+    return {row.version: row for row in connection.execute(select(applied_table))}
+
+
+@contextmanager
+def _lock(engine):
+    # SQLite serializes writers itself, but PostgreSQL would let two upgrades run side by side
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+    # A session lock taken outside any transaction: CREATE INDEX CONCURRENTLY waits for open transactions
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('SELECT pg_advisory_lock(%s)', (ADVISORY_LOCK_ID,))
+        try:
+            yield
+        finally:
+            connection.exec_driver_sql('SELECT pg_advisory_unlock(%s)', (ADVISORY_LOCK_ID,))
+
+
+def status(engine=None):
+    """``[(migration, applied row or None), ...]`` for every migration."""
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        applied = _applied(connection)
+    return [(migration, applied.get(migration.version)) for migration in discover()]
+
+
+def upgrade(engine=None, target=None, echo=logger.info):
+    """Apply pending migrations up to ``target`` (default: all); return the ones applied."""
+    engine = engine or db.engine
+    migrations = [migration for migration in discover() if target is None or migration.version <= target]
+    done = []
+    with _lock(engine):
+        with engine.begin() as connection:
+            applied = _applied(connection)
+        for migration in migrations:
+            if migration.version in applied:
+                continue
+            echo(f'Applying {migration.version:04d} {migration.name}: {migration.description}')
+            started = time.perf_counter()
+            if migration.transactional:
+                with engine.begin() as connection:
+                    migration.module.upgrade(MigrationContext(engine, connection, echo))
+                    _record(connection, migration, started)
+            else:
+                migration.module.upgrade(MigrationContext(engine, None, echo))
+                with engine.begin() as connection:
+                    _record(connection, migration, started)
+            done.append(migration)
+    return done
+
+
+def _record(connection, migration, started):
+    connection.execute(applied_table.insert().values(
+        version=migration.version, name=migration.name,
+        applied_at=datetime.utcnow(), duration=round(time.perf_counter() - started, 3),
+    ))
+
+
+def missing_columns(engine=None):
+    """``(table, column)`` pairs the models define but the database lacks, i.e. a migration is missing."""
+    engine = engine or db.engine
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        missing = []
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                missing.append((table.name, None))
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing.extend((table.name, column.name) for column in table.columns if column.name not in existing)
+    return missing
@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from app.money import Money
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,11 +11,18 @@ class User(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    session_version = db.Column(db.Integer, default=0)  # bumped to invalidate existing sessions
+    data_version = db.Column(db.Integer, default=0)  # bumped on every data change, see app.data_version
     
     expenses = db.relationship('Expense', backref='user', lazy=True, cascade='all, delete-orphan')
     
+    def get_id(self):
+        # Stored in the session; see app.identity
+        return f'{self.id}:{self.session_version or 0}'
+    
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
+        self.session_version = (self.session_version or 0) + 1
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -29,7 +37,10 @@ class Category(db.Model):
     subcategories = db.relationship('Subcategory', backref='category', lazy=True, cascade='all, delete-orphan')
     expenses = db.relationship('Expense', backref='category_obj', lazy=True)
     
-    __table_args__ = (db.UniqueConstraint('name', 'user_id', name='unique_category_user'),)
+    __table_args__ = (
+        db.UniqueConstraint('name', 'user_id', name='unique_category_user'),
+        db.Index('ix_category_user_name', 'user_id', 'name'),
+    )
 
 class Subcategory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -39,12 +50,15 @@ class Subcategory(db.Model):
     
     expenses = db.relationship('Expense', backref='subcategory_obj', lazy=True)
     
-    __table_args__ = (db.UniqueConstraint('name', 'category_id', name='unique_subcategory_category'),)
+    __table_args__ = (
+        db.UniqueConstraint('name', 'category_id', name='unique_subcategory_category'),
+        db.Index('ix_subcategory_category_name', 'category_id', 'name'),
+    )
 
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(200), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)  # stored as integer minor units, see app.money
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date())
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     subcategory_id = db.Column(db.Integer, db.ForeignKey('subcategory.id'))
@@ -52,10 +66,18 @@ class Expense(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Category and subcategory ids are unique across users, so indexes leading
+    # with them serve both user-scoped filters and relationship loads
+    __table_args__ = (
+        db.Index('ix_expense_user_date', 'user_id', 'date'),
+        db.Index('ix_expense_category_date', 'category_id', 'date'),
+        db.Index('ix_expense_subcategory_date', 'subcategory_id', 'date'),
+    )
 
 class UserSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
     # Currency settings
     currency_symbol = db.Column(db.String(10), default='₹')
@@ -87,3 +109,57 @@ class UserSettings(db.Model):
     
     def __repr__(self):
         return f'<UserSettings {self.user_id}>'
+
+class ExpenseRollup(db.Model):
+    # Per user x day x category x subcategory sums, maintained by app.rollups.
+    # No foreign keys: buckets are moved after the flush that deletes or merges
+    # their category, which databases enforcing constraints would reject.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    year_month = db.Column(db.Integer)  # e.g. 202401, so month filters are index range scans
+    category_id = db.Column(db.Integer, nullable=False)
+    subcategory_id = db.Column(db.Integer)
+    total = db.Column(Money, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        # One bucket per key, including a NULL subcategory, which a plain unique
+        # constraint would let PostgreSQL store any number of times
+        db.Index('ux_rollup_bucket', 'user_id', 'day', 'category_id',
+                 db.func.coalesce(subcategory_id, db.literal_column('0')), unique=True),
+        db.Index('ix_rollup_user_month', 'user_id', 'year_month'),
+        # Covers the per-category and per-subcategory stats without touching the table
+        db.Index('ix_rollup_user_category', 'user_id', 'category_id', 'subcategory_id', 'day', 'total', 'count'),
+    )
+    
+    def __repr__(self):
+        return f'<ExpenseRollup {self.user_id} {self.day} {self.category_id}/{self.subcategory_id}>'
+
+class Job(db.Model):
+    # Background import/export/bulk edit, run by app.jobs
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Float, nullable=False, default=0)  # 0-100
+    message = db.Column(db.String(200))
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    artifact = db.Column(db.String(255))  # file name in the job's folder under UPLOAD_FOLDER
+    checkpoint = db.Column(db.Text)  # JSON, committed with each chunk of a resumable job's work
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_job_user_created', 'user_id', 'created_at'),
+        db.Index('ix_job_status', 'status', 'id'),
+        db.Index('ix_job_status_heartbeat', 'status', 'heartbeat_at'),
+    )
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
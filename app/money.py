@@ -0,0 +1,80 @@
+"""Money amounts stored as integer minor units.
+
+``Expense.amount`` and ``ExpenseRollup.total`` are ``Money`` columns. The
+database holds a whole number of ten-thousandths of the currency unit,
+which is the finest precision ``UserSettings.decimal_places`` allows, so
+``SUM`` and amount comparisons are exact integer operations in SQL. The
+column type converts at the boundary: Python code reads and writes
+``Decimal`` amounts in currency units. JSON responses render them as
+numbers through ``JSONProvider``.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+DECIMAL_PLACES = 4
+SCALE = 10 ** DECIMAL_PLACES
+
+# Largest single amount accepted, leaving room for sums in a signed 64-bit integer
+MAX_AMOUNT = 10 ** 12
+
+
+def to_decimal(value, places=DECIMAL_PLACES):
+    """``value`` (Decimal, float, int or numeric string) rounded half-up to ``places`` decimals."""
+    if isinstance(value, float):
+        # Shortest repr, so 0.1 is 0.1 rather than its binary expansion
+        value = repr(value)
+    return Decimal(value).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def round_to_places(value, decimal_places):
+    """A user-entered amount rounded to their ``decimal_places`` setting."""
+    if decimal_places is None:
+        decimal_places = DECIMAL_PLACES
+    return to_decimal(value, min(max(decimal_places, 0), DECIMAL_PLACES))
+
+
+def parse(value):
+    """Amount typed by a user, or None if it isn't a finite number."""
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    return amount if amount.is_finite() else None
+
+
+def to_minor(value):
+    return int(to_decimal(value).scaleb(DECIMAL_PLACES))
+
+
+def from_minor(value):
+    return Decimal(value).scaleb(-DECIMAL_PLACES)
+
+
+class Money(TypeDecorator):
+    """Integer minor units in the database, ``Decimal`` currency units in Python."""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_minor(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else from_minor(value)
+
+    def coerce_compared_value(self, op, value):
+        # Literals compared with or added to amounts are amounts too
+        return self
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with ``Decimal`` amounts as numbers instead of strings."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return DefaultJSONProvider.default(o)
@@ -0,0 +1,76 @@
+"""Keyset (cursor) pagination over expenses ordered by ``(date, id)`` descending.
+
+Each page is a single index range scan starting from the cursor, so page N
+costs the same as page 1 and no COUNT(*) is needed to render it.
+"""
+import base64
+import binascii
+from datetime import date
+
+from sqlalchemy import and_, or_
+
+from app.models import Expense
+
+
+def encode_cursor(expense):
+    raw = f'{expense.date.isoformat()}:{expense.id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        day, expense_id = raw.split(':')
+        return date.fromisoformat(day), int(expense_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, has_next, has_prev, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.items[-1]) if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self.items[0]) if self.has_prev and self.items else None
+
+
+def keyset_paginate(query, per_page, after=None, before=None, total=None):
+    """Return the page of ``query`` after (older than) or before (newer than) a cursor."""
+    after = decode_cursor(after)
+    before = decode_cursor(before) if not after else None
+
+    if before:
+        day, expense_id = before
+        # Bounding on date alone keeps the predicate an index range
+        query = query.filter(
+            Expense.date >= day,
+            or_(Expense.date > day, and_(Expense.date == day, Expense.id > expense_id))
+        ).order_by(Expense.date.asc(), Expense.id.asc())
+    else:
+        if after:
+            day, expense_id = after
+            query = query.filter(
+                Expense.date <= day,
+                or_(Expense.date < day, and_(Expense.date == day, Expense.id < expense_id))
+            )
+        query = query.order_by(Expense.date.desc(), Expense.id.desc())
+
+    rows = query.limit(per_page + 1).all()
+    extra = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if before:
+        rows.reverse()
+        return KeysetPage(rows, per_page, has_next=True, has_prev=extra, total=total)
+    return KeysetPage(rows, per_page, has_next=extra, has_prev=after is not None, total=total)
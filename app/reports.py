@@ -0,0 +1,108 @@
+"""Dashboard and category figures computed from grouped rollup queries."""
+import calendar
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import case, func
+
+from app import db
+from app.models import Category, Subcategory, ExpenseRollup
+from app.rollups import month_bucket, add_months
+
+RECENT_DAYS = 30
+TREND_MONTHS = 12
+
+
+def dashboard_summary(user_id, today=None):
+    today = today or datetime.now().date()
+    since = today - timedelta(days=RECENT_DAYS)
+    current_month = month_bucket(today)
+    first_month = month_bucket(add_months(today.replace(day=1), -(TREND_MONTHS - 1)))
+
+    # Days older than the trailing window collapse into one group per month
+    recent_day = case((ExpenseRollup.day >= since, ExpenseRollup.day), else_=None).label('recent_day')
+    rows = db.session.query(
+        Category.name,
+        ExpenseRollup.year_month,
+        recent_day,
+        func.sum(ExpenseRollup.total),
+        func.sum(ExpenseRollup.count)
+    ).join(Category, ExpenseRollup.category_id == Category.id).filter(
+        ExpenseRollup.user_id == user_id
+    ).group_by(Category.name, ExpenseRollup.year_month, recent_day).all()
+
+    # Sums are exact Decimals (see app.money)
+    all_time_total = recent_total = monthly_total = Decimal(0)
+    expense_count = 0
+    by_category = defaultdict(lambda: [Decimal(0), 0])
+    month_by_category = defaultdict(Decimal)
+    by_day = defaultdict(Decimal)
+    by_month = defaultdict(Decimal)
+
+    for name, year_month, day, total, count in rows:
+        all_time_total += total
+        expense_count += count
+        by_category[name][0] += total
+        by_category[name][1] += count
+        if day is not None:
+            recent_total += total
+            by_day[day] += total
+        if year_month == current_month:
+            monthly_total += total
+            month_by_category[name] += total
+        if year_month >= first_month:
+            by_month[year_month] += total
+
+    def month_label(year_month):
+        year, month = divmod(year_month, 100)
+        return f'{calendar.month_name[month]} {year}'
+
+    return {
+        'all_time_total': all_time_total,
+        'recent_total': recent_total,
+        'monthly_total': monthly_total,
+        'expense_count': expense_count,
+        'category_breakdown': [{'name': name, 'total': total, 'count': count}
+                               for name, (total, count) in sorted(by_category.items())],
+        'month_category_breakdown': [{'name': name, 'total': total}
+                                     for name, total in sorted(month_by_category.items())],
+        'daily_expenses': [{'date': day.isoformat(), 'total': total}
+                           for day, total in sorted(by_day.items())],
+        'monthly_trend': [{'month': month_label(year_month), 'total': total}
+                          for year_month, total in sorted(by_month.items())],
+    }
+
+
+def _spend_stats(group_column, *criteria):
+    rows = db.session.query(
+        group_column,
+        func.sum(ExpenseRollup.count),
+        func.sum(ExpenseRollup.total),
+        func.max(ExpenseRollup.day)
+    ).filter(*criteria).group_by(group_column).all()
+    return {key: {'expenses': count, 'total': total, 'last_date': last_date}
+            for key, count, total, last_date in rows}
+
+
+def category_stats(user_id):
+    """Expense count, total spend, last expense date and subcategory count per category id."""
+    stats = _spend_stats(ExpenseRollup.category_id, ExpenseRollup.user_id == user_id)
+    subcategory_counts = db.session.query(
+        Subcategory.category_id,
+        func.count(Subcategory.id)
+    ).join(Category, Subcategory.category_id == Category.id).filter(
+        Category.user_id == user_id
+    ).group_by(Subcategory.category_id).all()
+
+    for category_id, count in subcategory_counts:
+        stats.setdefault(category_id, {'expenses': 0, 'total': Decimal(0), 'last_date': None})
+        stats[category_id]['subcategories'] = count
+    return stats
+
+
+def subcategory_stats(user_id, category_id):
+    """Expense count, total spend and last expense date per subcategory id."""
+    return _spend_stats(ExpenseRollup.subcategory_id,
+                        ExpenseRollup.user_id == user_id,
+                        ExpenseRollup.category_id == category_id)
@@ -0,0 +1,313 @@
+"""Server-side cache for aggregate responses.
+
+``cached_response`` stores the JSON body an aggregate API view returns, keyed
+by user, endpoint and normalized query string, and ``remember`` does the same
+for data a page computes (the dashboard summary). Entries are tagged with the
+user's data version (see ``app.data_version``), so a change to the user's
+expenses, categories or settings makes them all miss at once, in every
+worker, without other users' entries being touched.
+
+Each worker keeps a bounded LRU in memory, capped both by entry count and by
+the total size of the stored bodies. With ``RESPONSE_CACHE_DIR`` set, entries
+are also written to files there, so workers and restarts share them; the
+directory is pruned back under ``RESPONSE_CACHE_DIR_MAX_BYTES`` from time to
+time. Entries are JSON (``remember`` tags the ``Decimal`` and ``date`` values
+JSON lacks), so reading a file never runs code. ``RESPONSE_CACHE_MAX_BYTES=0``
+turns the cache off.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from functools import wraps
+
+from flask import current_app, make_response, request
+from flask_login import current_user
+
+from app import data_version
+
+# Directory writes between two prunes of the file store
+PRUNE_EVERY = 200
+
+
+def settings_from_env(environ=os.environ):
+    """Response cache settings for ``app.config``, overridable through environment variables."""
+    return {
+        'RESPONSE_CACHE_MAX_BYTES': int(environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        'RESPONSE_CACHE_MAX_ENTRIES': int(environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000)),
+        'RESPONSE_CACHE_DIR': environ.get('RESPONSE_CACHE_DIR', ''),
+        'RESPONSE_CACHE_DIR_MAX_BYTES': int(environ.get('RESPONSE_CACHE_DIR_MAX_BYTES', 256 * 1024 * 1024)),
+    }
+
+
+class FileStore:
+    """Entries as files under ``directory/<user_id>/``, shared by every process using it.
+
+    File names carry the entry's version, so stale files are recognised
+    without being opened, and are written to a temporary name first so
+    readers never see a partial file.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.directory, str(user_id))
+
+    @staticmethod
+    def _name(key, version):
+        digest = hashlib.sha256(repr(key[1:]).encode()).hexdigest()[:32]
+        return f'{digest}.{version}'
+
+    def get(self, key, version):
+        try:
+            with open(os.path.join(self._user_dir(key[0]), self._name(key, version)), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, key, version, value):
+        folder = self._user_dir(key[0])
+        os.makedirs(folder, exist_ok=True)
+        # Files for older versions of this user's data can never be read again
+        suffix = f'.{version}'
+        for name in os.listdir(folder):
+            if not name.endswith(suffix) and not name.startswith('.'):
+                self._remove(os.path.join(folder, name))
+
+        descriptor, temporary = tempfile.mkstemp(dir=folder, prefix='.')
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(value)
+        os.replace(temporary, os.path.join(folder, self._name(key, version)))
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _files(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def prune(self):
+        """Delete the least recently written files until the store fits ``max_bytes``."""
+        files = sorted(self._files())
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            self._remove(path)
+            size -= file_size
+
+    def stats(self):
+        files = self._files()
+        return {'directory': self.directory, 'files': len(files),
+                'bytes': sum(file_size for _, file_size, _ in files), 'max_bytes': self.max_bytes}
+
+
+class ResponseCache:
+    """LRU of ``key -> (version, bytes)`` bounded by entry count and total bytes.
+
+    Keys are tuples starting with the user id. An entry whose version no
+    longer matches is treated as a miss, and the user's other entries from
+    older versions are dropped along with it.
+    """
+
+    def __init__(self, max_bytes, max_entries, store=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop_stale(key[0], version)
+
+        value = self.store.get(key, version) if self.store is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._add(key, version, value)
+        return value
+
+    def set(self, key, version, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._add(key, version, value)
+        if self.store is not None:
+            self.store.set(key, version, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / requests, 3) if requests else None,
+                'evictions': self.evictions,
+            }
+        if self.store is not None:
+            stats['files'] = self.store.stats()
+        return stats
+
+    # The helpers below expect self._lock to be held
+
+    def _add(self, key, version, value):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (version, value)
+        self._keys_by_user.setdefault(key[0], set()).add(key)
+        self._bytes += len(value)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        version, value = self._entries.pop(key)
+        self._bytes -= len(value)
+        keys = self._keys_by_user[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_user[key[0]]
+
+    def _drop_stale(self, user_id, version):
+        for key in list(self._keys_by_user.get(user_id, ())):
+            if self._entries[key][0] != version:
+                self._remove(key)
+
+
+def get_cache():
+    return current_app.extensions.get('response_cache')
+
+
+def _version():
+    # Includes the date, like the ETag, because figures are relative to today
+    return data_version.etag(current_user.id)
+
+
+def _query_key():
+    return tuple(sorted(request.args.items(multi=True)))
+
+
+def cached_response(view):
+    """Serve the current user's JSON ``view`` from the cache while their data is unchanged."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = get_cache()
+        if cache is None:
+            return view(*args, **kwargs)
+
+        key = (current_user.id, request.endpoint, tuple(sorted(kwargs.items())), _query_key())
+        version = _version()
+        body = cache.get(key, version)
+        if body is not None:
+            return current_app.response_class(body, mimetype='application/json')
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.direct_passthrough:
+            cache.set(key, version, response.get_data())
+        return response
+    return wrapper
+
+
+def _encode(value):
+    # The values remember() results hold besides JSON's own types
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} values cannot be cached')
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if '__decimal__' in obj:
+            return Decimal(obj['__decimal__'])
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def remember(name, compute, *params):
+    """``compute()``'s result for the current user, from the cache while their data is unchanged.
+
+    The result must be JSON-serializable apart from ``Decimal``, ``date`` and
+    ``datetime`` values; tuples come back as lists.
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute()
+
+    key = (current_user.id, name, params)
+    version = _version()
+    value = cache.get(key, version)
+    if value is not None:
+        return json.loads(value, object_hook=_decode)
+    result = compute()
+    cache.set(key, version, json.dumps(result, default=_encode, separators=(',', ':')).encode())
+    return result
+
+
+def init_app(app):
+    if app.config['RESPONSE_CACHE_MAX_BYTES'] <= 0:
+        return
+    store = None
+    if app.config['RESPONSE_CACHE_DIR']:
+        store = FileStore(app.config['RESPONSE_CACHE_DIR'], app.config['RESPONSE_CACHE_DIR_MAX_BYTES'])
+    app.extensions['response_cache'] = ResponseCache(
+        app.config['RESPONSE_CACHE_MAX_BYTES'],
+        app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+        store,
+    )
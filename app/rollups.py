@@ -0,0 +1,270 @@
+"""Incrementally maintained expense rollups.
+
+``ExpenseRollup`` holds one row per user x day x category x subcategory with
+the sum and count of the matching expenses. ORM changes to ``Expense`` are
+folded in by a session flush hook; bulk statements that bypass the ORM
+(imports, merges) call ``apply_rows``/``rebuild`` themselves.
+"""
+from collections import defaultdict
+
+from sqlalchemy import bindparam, event, extract, func, inspect, literal_column, select
+from sqlalchemy.orm import Session
+
+from app.models import Expense, ExpenseRollup
+from app.money import to_decimal
+
+KEY_COLUMNS = ('user_id', 'date', 'category_id', 'subcategory_id')
+# Days per query when looking up the buckets a batch of deltas touches
+LOOKUP_BATCH_SIZE = 500
+
+_UNKNOWN = object()
+
+
+def month_bucket(day):
+    return day.year * 100 + day.month
+
+
+def add_months(day, months):
+    # Only used with first-of-month dates, so the day never overflows
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1)
+
+
+def month_bucket_expression(column):
+    # SQL equivalent of month_bucket(), only used for rebuilds and backfills
+    return extract('year', column) * 100 + extract('month', column)
+
+
+def _current(obj):
+    return tuple(getattr(obj, column) for column in KEY_COLUMNS), obj.amount
+
+
+def _committed(obj):
+    # Values as they were before this flush
+    state = inspect(obj)
+    values = []
+    for column in KEY_COLUMNS + ('amount',):
+        history = state.attrs[column].history
+        if history.deleted:
+            values.append(history.deleted[0])
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            # Old value was never loaded, so the bucket has to be recomputed
+            values.append(_UNKNOWN)
+    return tuple(values[:-1]), values[-1]
+
+
+def _existing_buckets(connection, table, keys):
+    # {key: id} of the buckets among ``keys`` that already exist
+    user_ids = sorted({key[0] for key in keys})
+    days = sorted({key[1] for key in keys})
+    existing = {}
+    for start in range(0, len(days), LOOKUP_BATCH_SIZE):
+        rows = connection.execute(
+            select(table.c.id, table.c.user_id, table.c.day, table.c.category_id, table.c.subcategory_id)
+            .where(table.c.user_id.in_(user_ids), table.c.day.in_(days[start:start + LOOKUP_BATCH_SIZE]))
+        )
+        existing.update(((user_id, day, category_id, subcategory_id), bucket_id)
+                        for bucket_id, user_id, day, category_id, subcategory_id in rows)
+    return existing
+
+
+def _upsert(connection, table):
+    # INSERT ... ON CONFLICT adding to the existing bucket, on the backends that have it
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    statement = insert(table)
+    return statement.on_conflict_do_update(
+        # The expressions of the ux_rollup_bucket index
+        index_elements=[table.c.user_id, table.c.day, table.c.category_id,
+                        func.coalesce(table.c.subcategory_id, literal_column('0'))],
+        set_={'total': table.c.total + statement.excluded.total,
+              'count': table.c.count + statement.excluded.count}
+    )
+
+
+def apply_deltas(connection, deltas):
+    """Add ``{(user_id, day, category_id, subcategory_id): [total, count]}`` to the rollups.
+
+    On SQLite and PostgreSQL the buckets are upserted with one executemany, so
+    an import touching thousands of buckets costs a single statement, and a
+    bucket created by a concurrent transaction is added to rather than
+    inserted twice. Other backends look the buckets up first, then update and
+    insert them with one executemany each.
+    """
+    table = ExpenseRollup.__table__
+    deltas = {key: (total, count) for key, (total, count) in deltas.items() if count or total}
+    if not deltas:
+        return
+    emptied_users = {key[0] for key, (total, count) in deltas.items() if count < 0}
+
+    upsert = _upsert(connection, table)
+    if upsert is not None:
+        connection.execute(upsert, [
+            {'user_id': user_id, 'day': day, 'year_month': month_bucket(day),
+             'category_id': category_id, 'subcategory_id': subcategory_id,
+             'total': total, 'count': count}
+            for (user_id, day, category_id, subcategory_id), (total, count) in deltas.items()
+        ])
+    else:
+        _update_or_insert(connection, table, deltas)
+
+    if emptied_users:
+        connection.execute(table.delete().where(
+            table.c.user_id.in_(emptied_users),
+            table.c.count <= 0
+        ))
+
+
+def _update_or_insert(connection, table, deltas):
+    existing = _existing_buckets(connection, table, deltas)
+    updates, inserts = [], []
+    for key, (total, count) in deltas.items():
+        user_id, day, category_id, subcategory_id = key
+        if key in existing:
+            updates.append({'bucket_id': existing[key], 'delta_total': total, 'delta_count': count})
+        else:
+            inserts.append({'user_id': user_id, 'day': day, 'year_month': month_bucket(day),
+                            'category_id': category_id, 'subcategory_id': subcategory_id,
+                            'total': total, 'count': count})
+
+    if updates:
+        connection.execute(
+            table.update().where(table.c.id == bindparam('bucket_id')).values(
+                total=table.c.total + bindparam('delta_total', type_=table.c.total.type),
+                count=table.c.count + bindparam('delta_count')
+            ),
+            updates
+        )
+    if inserts:
+        connection.execute(table.insert(), inserts)
+
+
+def apply_rows(connection, rows):
+    """Fold freshly inserted expense row dicts (as used for bulk inserts) into the rollups."""
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        key = (row['user_id'], row['date'], row['category_id'], row.get('subcategory_id'))
+        deltas[key][0] += to_decimal(row['amount'])
+        deltas[key][1] += 1
+    apply_deltas(connection, deltas)
+
+
+def _aggregate_query(user_id=None, category_ids=None):
+    query = select(
+        Expense.user_id,
+        Expense.date,
+        Expense.category_id,
+        Expense.subcategory_id,
+        func.sum(Expense.amount),
+        func.count(Expense.id),
+        month_bucket_expression(Expense.date)
+    ).group_by(
+        Expense.user_id,
+        Expense.date,
+        Expense.category_id,
+        Expense.subcategory_id
+    )
+    if user_id is not None:
+        query = query.where(Expense.user_id == user_id)
+    if category_ids is not None:
+        query = query.where(Expense.category_id.in_(category_ids))
+    return query
+
+
+def rebuild(connection, user_id=None, category_ids=None):
+    """Recompute rollups from the raw expense table, optionally scoped to a user/categories."""
+    table = ExpenseRollup.__table__
+
+    delete = table.delete()
+    if user_id is not None:
+        delete = delete.where(table.c.user_id == user_id)
+    if category_ids is not None:
+        delete = delete.where(table.c.category_id.in_(category_ids))
+    connection.execute(delete)
+
+    connection.execute(table.insert().from_select(
+        ['user_id', 'day', 'category_id', 'subcategory_id', 'total', 'count', 'year_month'],
+        _aggregate_query(user_id, category_ids)
+    ))
+
+
+def check(connection, user_id=None):
+    """Compare rollups against the raw table and return a list of mismatches.
+
+    Each mismatch is ``(key, (expected_total, expected_count), (rollup_total, rollup_count))``.
+    """
+    expected = {
+        tuple(row[:4]): (row[4], row[5])
+        for row in connection.execute(_aggregate_query(user_id))
+    }
+
+    query = select(
+        ExpenseRollup.user_id,
+        ExpenseRollup.day,
+        ExpenseRollup.category_id,
+        ExpenseRollup.subcategory_id,
+        ExpenseRollup.total,
+        ExpenseRollup.count
+    )
+    if user_id is not None:
+        query = query.where(ExpenseRollup.user_id == user_id)
+    actual = {tuple(row[:4]): (row[4], row[5]) for row in connection.execute(query)}
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=repr):
+        want = expected.get(key, (0, 0))
+        got = actual.get(key, (0, 0))
+        # Amounts are integer minor units in SQL, so totals must match exactly
+        if want != got:
+            mismatches.append((key, want, got))
+    return mismatches
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_expense_changes(session, flush_context):
+    deltas = defaultdict(lambda: [0, 0])
+    rebuild_users = set()
+
+    def add(key, amount, sign):
+        if _UNKNOWN in key or amount is _UNKNOWN:
+            # None rebuilds every user's rollups
+            rebuild_users.add(None if key[0] is _UNKNOWN else key[0])
+            return
+        # Assigned values may still be floats; the database has already rounded them
+        deltas[key][0] += sign * to_decimal(amount)
+        deltas[key][1] += sign
+
+    for obj in session.new:
+        if isinstance(obj, Expense):
+            add(*_current(obj), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Expense):
+            add(*_committed(obj), -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Expense) and session.is_modified(obj, include_collections=False):
+            old_key, old_amount = _committed(obj)
+            new_key, new_amount = _current(obj)
+            if old_key == new_key and old_amount == new_amount:
+                continue
+            add(old_key, old_amount, -1)
+            add(new_key, new_amount, 1)
+
+    if not deltas and not rebuild_users:
+        return
+
+    connection = session.connection()
+    if None in rebuild_users:
+        rebuild(connection)
+        return
+    for user_id in rebuild_users:
+        rebuild(connection, user_id=user_id)
+    apply_deltas(connection, {key: value for key, value in deltas.items()
+                              if key[0] not in rebuild_users})
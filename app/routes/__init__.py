@@ -1 +1 @@
-from . import auth, main, expenses, categories, api, settings
\ No newline at end of file
+from . import auth, main, expenses, categories, api, settings, jobs
\ No newline at end of file
@@ -1,59 +1,167 @@
 from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
-from app import db
-from app.models import Expense, Category, Subcategory
-from sqlalchemy import func, extract
+from app import db, jobs, reports, search
+from app.models import Expense, Category, ExpenseRollup, Job
+from app.data_version import conditional_get
+from app.filters import ExpenseFilters
+from app.response_cache import cached_response
+from app.pagination import keyset_paginate
+from app.routes.jobs import job_json
+from app.user_settings import get_settings
+from app.rollups import month_bucket, add_months
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 import calendar
 
 api_bp = Blueprint('api', __name__)
 
+@api_bp.route('/dashboard/summary')
+@login_required
+@conditional_get
+@cached_response
+def dashboard_summary():
+    # Everything the dashboard page shows, from one grouped query
+    return jsonify(reports.dashboard_summary(current_user.id))
+
+@api_bp.route('/analytics')
+@login_required
+@conditional_get
+@cached_response
+def analytics_query():
+    # Ad hoc group-by/time bucket queries, answered from the user's in-memory expense arrays;
+    # imported here so workers that never serve one don't load numpy
+    from app import analytics
+
+    try:
+        query = analytics.AnalyticsQuery.from_args(request.args)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    return jsonify(query.run(current_user.id))
+
+@api_bp.route('/expenses')
+@login_required
+@conditional_get
+def list_expenses():
+    filters = ExpenseFilters(request.args)
+    
+    per_page = request.args.get('per_page', type=int)
+    if not per_page:
+        per_page = get_settings().items_per_page
+    per_page = max(1, min(per_page, 100))
+    
+    query = filters.apply(Expense.query.filter_by(user_id=current_user.id))\
+        .options(joinedload(Expense.category_obj), joinedload(Expense.subcategory_obj))
+    total = filters.total_count(current_user.id)
+    if total is None and request.args.get('with_total', type=int):
+        total = query.order_by(None).count()
+    
+    page = keyset_paginate(query, per_page,
+                           after=request.args.get('after'),
+                           before=request.args.get('before'),
+                           total=total)
+    
+    return jsonify({
+        'items': [{
+            'id': expense.id,
+            'description': expense.description,
+            'amount': expense.amount,
+            'date': expense.date.isoformat(),
+            'category_id': expense.category_id,
+            'category': expense.category_obj.name,
+            'subcategory_id': expense.subcategory_id,
+            'subcategory': expense.subcategory_obj.name if expense.subcategory_obj else None,
+            'notes': expense.notes
+        } for expense in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'total': page.total
+    })
+
+@api_bp.route('/expenses/search')
+@login_required
+@conditional_get
+def search_expenses():
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    results = search.search(current_user.id, request.args.get('q', ''), limit=limit)
+    return jsonify({'results': results})
+
 @api_bp.route('/dashboard/stats')
 @login_required
+@conditional_get
+@cached_response
 def dashboard_stats():
-    current_month = datetime.now().month
-    current_year = datetime.now().year
+    current_month = month_bucket(datetime.now().date())
     
     # Monthly total
-    monthly_total = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == current_user.id,
-        extract('month', Expense.date) == current_month,
-        extract('year', Expense.date) == current_year
+    monthly_total = db.session.query(func.sum(ExpenseRollup.total)).filter(
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.year_month == current_month
     ).scalar() or 0
     
     # Last 30 days total
     thirty_days_ago = datetime.now().date() - timedelta(days=30)
-    recent_total = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= thirty_days_ago
+    recent_total = db.session.query(func.sum(ExpenseRollup.total)).filter(
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.day >= thirty_days_ago
     ).scalar() or 0
     
     # Category breakdown for current month
     category_breakdown = db.session.query(
         Category.name,
-        func.sum(Expense.amount).label('total')
-    ).join(Expense).filter(
-        Expense.user_id == current_user.id,
-        extract('month', Expense.date) == current_month,
-        extract('year', Expense.date) == current_year
+        func.sum(ExpenseRollup.total).label('total')
+    ).join(ExpenseRollup, ExpenseRollup.category_id == Category.id).filter(
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.year_month == current_month
     ).group_by(Category.name).all()
     
     # Daily expenses for last 30 days
     daily_expenses = db.session.query(
-        Expense.date,
-        func.sum(Expense.amount).label('total')
+        ExpenseRollup.day,
+        func.sum(ExpenseRollup.total).label('total')
     ).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= thirty_days_ago
-    ).group_by(Expense.date).order_by(Expense.date).all()
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.day >= thirty_days_ago
+    ).group_by(ExpenseRollup.day).order_by(ExpenseRollup.day).all()
     
     return jsonify({
-        'monthly_total': float(monthly_total),
-        'recent_total': float(recent_total),
-        'category_breakdown': [{'name': name, 'total': float(total)} for name, total in category_breakdown],
-        'daily_expenses': [{'date': date.isoformat(), 'total': float(total)} for date, total in daily_expenses]
+        'monthly_total': monthly_total,
+        'recent_total': recent_total,
+        'category_breakdown': [{'name': name, 'total': total} for name, total in category_breakdown],
+        'daily_expenses': [{'date': date.isoformat(), 'total': total} for date, total in daily_expenses]
     })
 
+@api_bp.route('/jobs')
+@login_required
+def list_jobs():
+    user_jobs = Job.query.filter_by(user_id=current_user.id)\
+        .order_by(Job.created_at.desc()).limit(50).all()
+    return jsonify({'jobs': [job_json(job) for job in user_jobs]})
+
+@api_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return jsonify(job_json(job))
+
+@api_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if not jobs.cancel(job.id, current_user.id):
+        return jsonify({'error': 'This job has already finished.', 'job': job_json(job)}), 409
+    db.session.refresh(job)
+    return jsonify(job_json(job)), 202
+
+@api_bp.route('/jobs/<int:job_id>/resume', methods=['POST'])
+@login_required
+def resume_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if not jobs.resume(job.id, current_user.id):
+        return jsonify({'error': 'This job cannot be resumed.', 'job': job_json(job)}), 409
+    db.session.refresh(job)
+    return jsonify(job_json(job)), 202
+
 @api_bp.route('/debug/expenses')
 def debug_expenses():
     # Debug endpoint without authentication to check data
@@ -72,7 +180,7 @@ def debug_expenses():
         
         return jsonify({
             'total_expenses': len(all_expenses),
-            'total_amount': float(total_amount),
+            'total_amount': total_amount,
             'date_range': {
                 'min': min_date.isoformat() if min_date else None,
                 'max': max_date.isoformat() if max_date else None
@@ -92,27 +200,31 @@ def debug_expenses():
 
 @api_bp.route('/expenses/test-data')
 @login_required
+@conditional_get
+@cached_response
 def test_data():
     # Simple test to see if we have any expenses
-    total_expenses = Expense.query.filter_by(user_id=current_user.id).count()
-    total_amount = db.session.query(func.sum(Expense.amount)).filter_by(user_id=current_user.id).scalar() or 0
+    total_expenses = db.session.query(func.sum(ExpenseRollup.count)).filter_by(user_id=current_user.id).scalar() or 0
+    total_amount = db.session.query(func.sum(ExpenseRollup.total)).filter_by(user_id=current_user.id).scalar() or 0
     
     return jsonify({
         'total_expenses': total_expenses,
-        'total_amount': float(total_amount),
+        'total_amount': total_amount,
         'message': f'Found {total_expenses} expenses totaling ₹{total_amount:.2f}'
     })
 
 @api_bp.route('/expenses/custom-range')
 @login_required
+@conditional_get
+@cached_response
 def custom_range():
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
     # If no date range, return grand total of all expenses
     if not date_from and not date_to:
-        total = db.session.query(func.sum(Expense.amount)).filter_by(user_id=current_user.id).scalar() or 0
-        return jsonify({'total': float(total)})
+        total = db.session.query(func.sum(ExpenseRollup.total)).filter_by(user_id=current_user.id).scalar() or 0
+        return jsonify({'total': total})
     
     if not date_from or not date_to:
         return jsonify({'total': 0})
@@ -124,48 +236,46 @@ def custom_range():
         return jsonify({'total': 0})
     
     # Get total expenses for custom date range
-    total = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= date_from_obj,
-        Expense.date <= date_to_obj
+    total = db.session.query(func.sum(ExpenseRollup.total)).filter(
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.day >= date_from_obj,
+        ExpenseRollup.day <= date_to_obj
     ).scalar() or 0
     
-    return jsonify({'total': float(total)})
+    return jsonify({'total': total})
 
 @api_bp.route('/expenses/monthly-trend')
 @login_required
+@conditional_get
+@cached_response
 def monthly_trend():
-    # Get last 12 months data
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)
+    # Get last 12 months data, including the current month
+    today = datetime.now().date()
+    first_month = month_bucket(add_months(today.replace(day=1), -11))
     
     monthly_data = db.session.query(
-        extract('year', Expense.date).label('year'),
-        extract('month', Expense.date).label('month'),
-        func.sum(Expense.amount).label('total')
+        ExpenseRollup.year_month,
+        func.sum(ExpenseRollup.total).label('total')
     ).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= start_date.date()
-    ).group_by(
-        extract('year', Expense.date),
-        extract('month', Expense.date)
-    ).order_by(
-        extract('year', Expense.date),
-        extract('month', Expense.date)
-    ).all()
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.year_month >= first_month
+    ).group_by(ExpenseRollup.year_month).order_by(ExpenseRollup.year_month).all()
     
     trend_data = []
-    for year, month, total in monthly_data:
-        month_name = calendar.month_name[int(month)]
+    for year_month, total in monthly_data:
+        year, month = divmod(year_month, 100)
+        month_name = calendar.month_name[month]
         trend_data.append({
-            'month': f'{month_name} {int(year)}',
-            'total': float(total)
+            'month': f'{month_name} {year}',
+            'total': total
         })
     
     return jsonify(trend_data)
 
 @api_bp.route('/expenses/category-comparison')
 @login_required
+@conditional_get
+@cached_response
 def category_comparison():
     # Compare categories across last 3 months
     current_date = datetime.now()
@@ -173,15 +283,16 @@ def category_comparison():
     
     comparison_data = db.session.query(
         Category.name,
-        func.sum(Expense.amount).label('total'),
-        func.count(Expense.id).label('count')
-    ).join(Expense).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= three_months_ago.date()
-    ).group_by(Category.name).order_by(func.sum(Expense.amount).desc()).all()
+        func.sum(ExpenseRollup.total).label('total'),
+        func.sum(ExpenseRollup.count).label('count')
+    ).join(ExpenseRollup, ExpenseRollup.category_id == Category.id).filter(
+        Category.user_id == current_user.id,
+        ExpenseRollup.user_id == current_user.id,
+        ExpenseRollup.day >= three_months_ago.date()
+    ).group_by(Category.name).order_by(func.sum(ExpenseRollup.total).desc()).all()
     
     return jsonify([{
         'name': name,
-        'total': float(total),
+        'total': total,
         'count': count
     } for name, total, count in comparison_data])
@@ -1,14 +1,15 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from app import db, login_manager
+from app import db, identity, login_manager
 from app.models import User
+from app.user_settings import create_default_settings
 from app.forms.auth import LoginForm, RegisterForm
 
 auth_bp = Blueprint('auth', __name__)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return identity.load_user(user_id)
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -44,6 +45,8 @@ def register():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
         db.session.add(user)
+        db.session.flush()
+        create_default_settings(user.id)
         db.session.commit()
         
         flash('Registration successful! Please log in.')
@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from app import db
-from app.models import Category, Subcategory, Expense
+from app import db, bulk, jobs, reports
+from app.data_version import conditional_get
+from app.models import Category, Subcategory
+from app.routes.jobs import submitted
+from app.user_settings import get_settings
 from app.forms.categories import CategoryForm, SubcategoryForm
 
 categories_bp = Blueprint('categories', __name__)
@@ -11,7 +14,10 @@ categories_bp = Blueprint('categories', __name__)
 def list_categories():
     categories = Category.query.filter_by(user_id=current_user.id)\
         .order_by(Category.name).all()
-    return render_template('categories/list.html', categories=categories)
+    # Counts and totals come from grouped queries instead of loading relationships
+    stats = reports.category_stats(current_user.id)
+    settings = get_settings()
+    return render_template('categories/list.html', categories=categories, stats=stats, settings=settings)
 
 @categories_bp.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -64,8 +70,10 @@ def list_subcategories(category_id):
     category = Category.query.filter_by(id=category_id, user_id=current_user.id).first_or_404()
     subcategories = Subcategory.query.filter_by(category_id=category_id)\
         .order_by(Subcategory.name).all()
+    stats = reports.subcategory_stats(current_user.id, category_id)
+    settings = get_settings()
     return render_template('categories/subcategories/list.html', 
-                         category=category, subcategories=subcategories)
+                         category=category, subcategories=subcategories, stats=stats, settings=settings)
 
 @categories_bp.route('/<int:category_id>/subcategories/add', methods=['GET', 'POST'])
 @login_required
@@ -114,13 +122,16 @@ def delete_subcategory(id):
         Category.user_id == current_user.id
     ).first_or_404()
     category_id = subcategory.category_id
-    db.session.delete(subcategory)
+    summary = bulk.delete_subcategory(current_user.id, subcategory)
     db.session.commit()
+    if bulk.wants_json():
+        return jsonify(summary)
     flash('Subcategory deleted successfully!')
     return redirect(url_for('categories.list_subcategories', category_id=category_id))
 
 @categories_bp.route('/<int:category_id>/subcategories/json')
 @login_required
+@conditional_get
 def get_subcategories_json(category_id):
     category = Category.query.filter_by(id=category_id, user_id=current_user.id).first_or_404()
     subcategories = Subcategory.query.filter_by(category_id=category_id)\
@@ -132,8 +143,8 @@ def get_subcategories_json(category_id):
 @login_required
 def merge_categories():
     if request.method == 'POST':
-        source_id = request.form.get('source_category')
-        target_id = request.form.get('target_category')
+        source_id = request.form.get('source_category', type=int)
+        target_id = request.form.get('target_category', type=int)
         
         if source_id == target_id:
             flash('Source and target categories must be different!')
@@ -142,41 +153,8 @@ def merge_categories():
         source_category = Category.query.filter_by(id=source_id, user_id=current_user.id).first_or_404()
         target_category = Category.query.filter_by(id=target_id, user_id=current_user.id).first_or_404()
         
-        # Update all expenses from source category to target category
-        Expense.query.filter_by(category_id=source_id, user_id=current_user.id).update({'category_id': target_id})
-        
-        # Update all subcategories from source category to target category with unique names
-        source_subcategories = Subcategory.query.filter_by(category_id=source_id).all()
-        for subcategory in source_subcategories:
-            # Make subcategory name unique by appending source category name
-            new_name = f"{subcategory.name} (from {source_category.name})"
-            # Check if this name already exists in target category
-            existing = Subcategory.query.filter_by(
-                name=new_name, 
-                category_id=target_id
-            ).first()
-            if existing:
-                # Add a number to make it unique
-                counter = 1
-                while existing:
-                    new_name = f"{subcategory.name} (from {source_category.name}) {counter}"
-                    existing = Subcategory.query.filter_by(
-                        name=new_name, 
-                        category_id=target_id
-                    ).first()
-                    counter += 1
-            
-            subcategory.name = new_name
-            subcategory.category_id = target_id
-        
-        db.session.commit()
-        
-        # Delete the source category
-        db.session.delete(source_category)
-        db.session.commit()
-        
-        flash(f'Successfully merged "{source_category.name}" into "{target_category.name}"!')
-        return redirect(url_for('categories.list_categories'))
+        return submitted(jobs.submit(current_user.id, 'merge_categories',
+                                     {'source_id': source_category.id, 'target_id': target_category.id}))
     
     categories = Category.query.filter_by(user_id=current_user.id).order_by(Category.name).all()
     return render_template('categories/merge.html', categories=categories)
@@ -187,8 +165,8 @@ def merge_subcategories(category_id):
     category = Category.query.filter_by(id=category_id, user_id=current_user.id).first_or_404()
     
     if request.method == 'POST':
-        source_id = request.form.get('source_subcategory')
-        target_id = request.form.get('target_subcategory')
+        source_id = request.form.get('source_subcategory', type=int)
+        target_id = request.form.get('target_subcategory', type=int)
         
         if source_id == target_id:
             flash('Source and target subcategories must be different!')
@@ -197,15 +175,9 @@ def merge_subcategories(category_id):
         source_subcategory = Subcategory.query.filter_by(id=source_id, category_id=category_id).first_or_404()
         target_subcategory = Subcategory.query.filter_by(id=target_id, category_id=category_id).first_or_404()
         
-        # Update all expenses from source subcategory to target subcategory
-        Expense.query.filter_by(subcategory_id=source_id, user_id=current_user.id).update({'subcategory_id': target_id})
-        
-        # Delete the source subcategory
-        db.session.delete(source_subcategory)
-        db.session.commit()
-        
-        flash(f'Successfully merged "{source_subcategory.name}" into "{target_subcategory.name}"!')
-        return redirect(url_for('categories.list_subcategories', category_id=category_id))
+        return submitted(jobs.submit(current_user.id, 'merge_subcategories',
+                                     {'category_id': category.id, 'source_id': source_subcategory.id,
+                                      'target_id': target_subcategory.id}))
     
     subcategories = Subcategory.query.filter_by(category_id=category_id).order_by(Subcategory.name).all()
     return render_template('categories/subcategories/merge.html', category=category, subcategories=subcategories)
@@ -1,64 +1,33 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, Response, stream_with_context
 from flask_login import login_required, current_user
-from app import db
-from app.models import Expense, Category, Subcategory, UserSettings
+from app import db, jobs, money
+from app.models import Expense, Category, Subcategory
 from app.forms.expenses import ExpenseForm
-from datetime import datetime
-import csv
-import pandas as pd
-from io import StringIO
+from app.importer import IMPORT_EXTENSIONS
+from app.exporter import generate_export, EXPORT_FORMATS
+from app.filters import ExpenseFilters
+from app.pagination import keyset_paginate
+from app.routes.jobs import submitted
+from app.user_settings import get_settings
+from sqlalchemy.orm import joinedload
 
 expenses_bp = Blueprint('expenses', __name__)
 
 @expenses_bp.route('/')
 @login_required
 def list_expenses():
-    page = request.args.get('page', 1, type=int)
-    category_id = request.args.get('category_id', type=int)
-    subcategory_id = request.args.get('subcategory_id', type=int)
-    amount_min = request.args.get('amount_min', type=float)
-    amount_max = request.args.get('amount_max', type=float)
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    description_search = request.args.get('description_search', '')
+    filters = ExpenseFilters(request.args)
+    category_id = filters.category_id
     
-    query = Expense.query.filter_by(user_id=current_user.id)
+    # Get user settings for currency and page size
+    user_settings = get_settings()
     
-    # Category filter
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-    
-    # Subcategory filter (within category)
-    if subcategory_id:
-        query = query.filter_by(subcategory_id=subcategory_id)
-    
-    # Amount filters
-    if amount_min is not None:
-        query = query.filter(Expense.amount >= amount_min)
-    if amount_max is not None:
-        query = query.filter(Expense.amount <= amount_max)
-    
-    # Date filters
-    if date_from:
-        try:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-            query = query.filter(Expense.date >= date_from_obj)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-            query = query.filter(Expense.date <= date_to_obj)
-        except ValueError:
-            pass
-    
-    # Description search
-    if description_search:
-        query = query.filter(Expense.description.ilike(f'%{description_search}%'))
-    
-    expenses = query.order_by(Expense.date.desc()).paginate(
-        page=page, per_page=20, error_out=False)
+    query = filters.apply(Expense.query.filter_by(user_id=current_user.id))\
+        .options(joinedload(Expense.category_obj), joinedload(Expense.subcategory_obj))
+    expenses = keyset_paginate(query, user_settings.items_per_page or 10,
+                               after=request.args.get('after'),
+                               before=request.args.get('before'),
+                               total=filters.total_count(current_user.id))
     
     categories = Category.query.filter_by(user_id=current_user.id).all()
     
@@ -67,23 +36,17 @@ def list_expenses():
     if category_id:
         subcategories = Subcategory.query.filter_by(category_id=category_id).order_by(Subcategory.name).all()
     
-    # Get user settings for currency
-    user_settings = UserSettings.query.filter_by(user_id=current_user.id).first()
-    if not user_settings:
-        user_settings = UserSettings(user_id=current_user.id)
-        db.session.add(user_settings)
-        db.session.commit()
-    
     return render_template('expenses/list.html', 
                          expenses=expenses, 
                          categories=categories,
                          selected_category=category_id,
-                         selected_subcategory=subcategory_id,
-                         amount_min=amount_min,
-                         amount_max=amount_max,
-                         date_from=date_from,
-                         date_to=date_to,
-                         description_search=description_search,
+                         selected_subcategory=filters.subcategory_id,
+                         amount_min=filters.amount_min,
+                         amount_max=filters.amount_max,
+                         date_from=filters.date_from,
+                         date_to=filters.date_to,
+                         description_search=filters.description_search,
+                         filter_args=filters.to_args(),
                          subcategories=subcategories,
                          settings=user_settings)
 
@@ -97,10 +60,12 @@ def add_expense():
         subcategories = Subcategory.query.filter_by(category_id=form.category_id.data).all()
         form.subcategory_id.choices = [(0, 'None')] + [(s.id, s.name) for s in subcategories]
     
+    user_settings = get_settings()
+    
     if form.validate_on_submit():
         expense = Expense(
             description=form.description.data,
-            amount=form.amount.data,
+            amount=money.round_to_places(form.amount.data, user_settings.decimal_places),
             date=form.date.data,
             category_id=form.category_id.data,
             subcategory_id=form.subcategory_id.data if form.subcategory_id.data != 0 else None,
@@ -112,13 +77,6 @@ def add_expense():
         flash('Expense added successfully!')
         return redirect(url_for('expenses.list_expenses'))
     
-    # Get user settings for currency
-    user_settings = UserSettings.query.filter_by(user_id=current_user.id).first()
-    if not user_settings:
-        user_settings = UserSettings(user_id=current_user.id)
-        db.session.add(user_settings)
-        db.session.commit()
-    
     return render_template('expenses/add.html', form=form, settings=user_settings)
 
 @expenses_bp.route('/edit/<int:id>', methods=['GET', 'POST'])
@@ -133,9 +91,11 @@ def edit_expense(id):
         subcategories = Subcategory.query.filter_by(category_id=form.category_id.data).all()
         form.subcategory_id.choices = [(0, 'None')] + [(s.id, s.name) for s in subcategories]
     
+    user_settings = get_settings()
+    
     if form.validate_on_submit():
         expense.description = form.description.data
-        expense.amount = form.amount.data
+        expense.amount = money.round_to_places(form.amount.data, user_settings.decimal_places)
         expense.date = form.date.data
         expense.category_id = form.category_id.data
         expense.subcategory_id = form.subcategory_id.data if form.subcategory_id.data != 0 else None
@@ -144,12 +104,9 @@ def edit_expense(id):
         flash('Expense updated successfully!')
         return redirect(url_for('expenses.list_expenses'))
     
-    # Get user settings for currency
-    user_settings = UserSettings.query.filter_by(user_id=current_user.id).first()
-    if not user_settings:
-        user_settings = UserSettings(user_id=current_user.id)
-        db.session.add(user_settings)
-        db.session.commit()
+    if request.method == 'GET':
+        # Show the stored amount at the user's precision rather than all four stored decimals
+        form.amount.data = money.round_to_places(expense.amount, user_settings.decimal_places)
     
     return render_template('expenses/edit.html', form=form, expense=expense, settings=user_settings)
 
@@ -165,13 +122,7 @@ def delete_expense(id):
 @expenses_bp.route('/delete-all')
 @login_required
 def delete_all_expenses():
-    expenses = Expense.query.filter_by(user_id=current_user.id).all()
-    count = len(expenses)
-    for expense in expenses:
-        db.session.delete(expense)
-    db.session.commit()
-    flash(f'Successfully deleted {count} expenses!')
-    return redirect(url_for('expenses.list_expenses'))
+    return submitted(jobs.submit(current_user.id, 'delete_all_expenses'))
 
 @expenses_bp.route('/import', methods=['GET', 'POST'])
 @login_required
@@ -186,59 +137,9 @@ def import_expenses():
             flash('No file selected')
             return redirect(request.url)
         
-        if file and file.filename.endswith(('.csv', '.xlsx')):
-            try:
-                if file.filename.endswith('.csv'):
-                    df = pd.read_csv(file)
-                else:
-                    df = pd.read_excel(file)
-                
-                required_columns = ['description', 'amount', 'date', 'category']
-                if not all(col in df.columns for col in required_columns):
-                    flash('File must contain columns: description, amount, date, category')
-                    return render_template('expenses/import.html')
-                
-                for _, row in df.iterrows():
-                    category = Category.query.filter_by(name=row['category'], user_id=current_user.id).first()
-                    if not category:
-                        category = Category(name=row['category'], user_id=current_user.id)
-                        db.session.add(category)
-                        db.session.flush()
-                    
-                    # Handle subcategory if present
-                    subcategory_id = None
-                    if 'subcategory' in row and pd.notna(row['subcategory']) and row['subcategory']:
-                        subcategory = Subcategory.query.filter_by(
-                            name=row['subcategory'], 
-                            category_id=category.id
-                        ).first()
-                        if not subcategory:
-                            subcategory = Subcategory(
-                                name=row['subcategory'],
-                                category_id=category.id
-                            )
-                            db.session.add(subcategory)
-                            db.session.flush()
-                        subcategory_id = subcategory.id
-                    
-                    expense = Expense(
-                        description=row['description'],
-                        amount=float(row['amount']),
-                        date=pd.to_datetime(row['date']).date(),
-                        category_id=category.id,
-                        subcategory_id=subcategory_id,
-                        user_id=current_user.id,
-                        notes=row.get('notes', '')
-                    )
-                    db.session.add(expense)
-                
-                db.session.commit()
-                flash(f'Successfully imported {len(df)} expenses!')
-                return redirect(url_for('expenses.list_expenses'))
-                
-            except Exception as e:
-                flash(f'Error importing file: {str(e)}')
-                return render_template('expenses/import.html')
+        if file and file.filename.endswith(IMPORT_EXTENSIONS):
+            # Parsed and inserted by a background job; see app.jobs
+            return submitted(jobs.submit(current_user.id, 'import', upload=file))
         else:
             flash('Invalid file format. Please upload CSV or Excel files.')
     
@@ -247,26 +148,27 @@ def import_expenses():
 @expenses_bp.route('/export')
 @login_required
 def export_expenses():
-    expenses = Expense.query.filter_by(user_id=current_user.id).all()
-    
-    data = []
-    for expense in expenses:
-        data.append({
-            'description': expense.description,
-            'amount': expense.amount,
-            'date': expense.date,
-            'category': expense.category_obj.name,
-            'subcategory': expense.subcategory_obj.name if expense.subcategory_obj else '',
-            'notes': expense.notes or ''
-        })
+    # Streams the file from this request; POST runs the export as a job instead
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        flash('Unsupported export format.')
+        return redirect(url_for('expenses.list_expenses'))
     
-    df = pd.DataFrame(data)
+    content_type, filename = EXPORT_FORMATS[export_format]
+    filters = ExpenseFilters(request.args)
     
-    output = StringIO()
-    df.to_csv(output, index=False)
-    output.seek(0)
+    return Response(stream_with_context(generate_export(current_user.id, export_format, filters)), 200, {
+        'Content-Type': content_type,
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+@expenses_bp.route('/export', methods=['POST'])
+@login_required
+def export_expenses_job():
+    export_format = request.form.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        flash('Unsupported export format.')
+        return redirect(url_for('expenses.list_expenses'))
     
-    return output.getvalue(), 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': 'attachment; filename=expenses.csv'
-    }
+    filters = {key: value for key, value in request.form.items() if key != 'format'}
+    return submitted(jobs.submit(current_user.id, 'export', {'export_format': export_format, 'filters': filters}))
@@ -0,0 +1,72 @@
+import os
+
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, send_file, abort
+from flask_login import login_required, current_user
+from app import jobs
+from app.bulk import wants_json
+from app.models import Job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+def job_json(job):
+    data = jobs.to_dict(job)
+    data['status_url'] = url_for('api.job_status', job_id=job.id)
+    data['cancel_url'] = url_for('api.cancel_job', job_id=job.id)
+    data['resume_url'] = url_for('api.resume_job', job_id=job.id) if jobs.is_resumable(job) else None
+    data['download_url'] = url_for('jobs.download_job', job_id=job.id) \
+        if job.status == jobs.SUCCEEDED and job.artifact else None
+    return data
+
+def submitted(job):
+    """Response for a view that just queued ``job``: 202 with its status as JSON, or its page."""
+    if wants_json():
+        response = jsonify(job_json(job))
+        response.status_code = 202
+        response.headers['Location'] = url_for('api.job_status', job_id=job.id)
+        return response
+    return redirect(url_for('jobs.show_job', job_id=job.id))
+
+@jobs_bp.route('/')
+@login_required
+def list_jobs():
+    user_jobs = Job.query.filter_by(user_id=current_user.id)\
+        .order_by(Job.created_at.desc()).limit(50).all()
+    return render_template('jobs/list.html', jobs=user_jobs)
+
+@jobs_bp.route('/<int:job_id>')
+@login_required
+def show_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    return render_template('jobs/show.html', job=job, job_data=job_json(job))
+
+@jobs_bp.route('/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if jobs.cancel(job.id, current_user.id):
+        flash('Cancellation requested.')
+    else:
+        flash('This job has already finished.')
+    return redirect(url_for('jobs.show_job', job_id=job_id))
+
+@jobs_bp.route('/<int:job_id>/resume', methods=['POST'])
+@login_required
+def resume_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if jobs.resume(job.id, current_user.id):
+        flash('Resuming from where the job stopped.')
+    else:
+        flash('This job cannot be resumed.')
+    return redirect(url_for('jobs.show_job', job_id=job_id))
+
+@jobs_bp.route('/<int:job_id>/download')
+@login_required
+def download_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if job.status != jobs.SUCCEEDED or not job.artifact:
+        abort(404)
+    path = jobs.artifact_path(job)
+    if not os.path.exists(path):
+        # Removed by "flask jobs purge"
+        abort(410)
+    return send_file(path, as_attachment=True, download_name=job.artifact)
@@ -1,10 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for
+from flask import Blueprint, render_template, redirect, url_for, flash
 from flask_login import login_required, current_user
-from app import db
-from app.models import Expense, Category, Subcategory, UserSettings
-from sqlalchemy import func, extract
-from datetime import datetime, timedelta
-import calendar
+from app import db, reports, response_cache
+from app.models import Expense, Category
+from app.user_settings import get_settings
+from sqlalchemy.orm import joinedload
 
 main_bp = Blueprint('main', __name__)
 
@@ -17,59 +16,24 @@ def index():
 @main_bp.route('/dashboard')
 @login_required
 def dashboard():
-    print(f"DEBUG: Dashboard route accessed by user {current_user.id}")
-    
     # Get user settings
-    user_settings = UserSettings.query.filter_by(user_id=current_user.id).first()
-    if not user_settings:
-        user_settings = UserSettings(
-            user_id=current_user.id,
-            currency_symbol='₹',
-            currency_code='INR',
-            theme='light',
-            primary_color='#007bff',
-            secondary_color='#6c757d',
-            chart_type='pie'
-        )
-        db.session.add(user_settings)
-        db.session.commit()
-    
-    # Get all-time data instead of current month
-    monthly_total = db.session.query(func.sum(Expense.amount)).filter_by(user_id=current_user.id).scalar() or 0
-    recent_total = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == current_user.id,
-        Expense.date >= (datetime.now().date() - timedelta(days=30))
-    ).scalar() or 0
+    user_settings = get_settings()
     
-    # Get category breakdown for all time
-    category_breakdown_raw = db.session.query(
-        Category.name,
-        func.sum(Expense.amount).label('total')
-    ).join(Expense).filter(
-        Expense.user_id == current_user.id
-    ).group_by(Category.name).all()
-    
-    # Convert to serializable format
-    category_breakdown = [{'name': name, 'total': float(total)} for name, total in category_breakdown_raw]
+    # All dashboard figures come from one grouped rollup query, cached until the user's data changes
+    summary = response_cache.remember('dashboard_summary', lambda: reports.dashboard_summary(current_user.id))
     
     # Get recent expenses
     recent_expenses = Expense.query.filter_by(user_id=current_user.id)\
+        .options(joinedload(Expense.category_obj))\
         .order_by(Expense.date.desc()).limit(5).all()
     
-    # Get total expenses count
-    total_expenses = Expense.query.filter_by(user_id=current_user.id).count()
-    
-    print(f"DEBUG: All-time monthly total: {monthly_total}")
-    print(f"DEBUG: Recent total: {recent_total}")
-    print(f"DEBUG: Category breakdown items: {len(category_breakdown)}")
-    print(f"DEBUG: User chart type: {user_settings.chart_type}")
-    
     return render_template('dashboard.html',
-                         monthly_total=monthly_total,
-                         recent_total=recent_total,
-                         category_breakdown=category_breakdown,
+                         monthly_total=summary['all_time_total'],
+                         recent_total=summary['recent_total'],
+                         category_breakdown=summary['category_breakdown'],
                          recent_expenses=recent_expenses,
-                         total_expenses=total_expenses,
+                         total_expenses=summary['expense_count'],
+                         summary=summary,
                          settings=user_settings)
 
 @main_bp.route('/create-sample-data')
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
 from app import db
 from app.models import UserSettings
+from app.user_settings import default_values, invalidate
 from app.forms.settings import SettingsForm
 
 settings_bp = Blueprint('settings', __name__)
@@ -9,19 +10,10 @@ settings_bp = Blueprint('settings', __name__)
 @settings_bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
-    # Get or create user settings
+    # Users registered before settings rows were created at sign-up get one when they save
     user_settings = UserSettings.query.filter_by(user_id=current_user.id).first()
     if not user_settings:
-        user_settings = UserSettings(
-            user_id=current_user.id,
-            currency_symbol='₹',
-            currency_code='INR',
-            theme='light',
-            primary_color='#007bff',
-            secondary_color='#6c757d'
-        )
-        db.session.add(user_settings)
-        db.session.commit()
+        user_settings = UserSettings(user_id=current_user.id, **default_values())
     
     form = SettingsForm(obj=user_settings)
     
@@ -52,7 +44,10 @@ def settings():
         user_settings.items_per_page = int(form.items_per_page.data)
         user_settings.date_format = form.date_format.data
         
+        if user_settings.id is None:
+            db.session.add(user_settings)
         db.session.commit()
+        invalidate(current_user.id)
         flash('Settings updated successfully!', 'success')
         return redirect(url_for('settings.settings'))
     
@@ -64,20 +59,11 @@ def reset_settings():
     # Reset to default settings
     user_settings = UserSettings.query.filter_by(user_id=current_user.id).first()
     if user_settings:
-        user_settings.currency_symbol = '₹'
-        user_settings.currency_code = 'INR'
-        user_settings.decimal_places = 2
-        user_settings.theme = 'light'
-        user_settings.primary_color = '#007bff'
-        user_settings.secondary_color = '#6c757d'
-        user_settings.default_date_range = 'all_time'
-        user_settings.chart_type = 'pie'
-        user_settings.email_notifications = True
-        user_settings.monthly_reports = True
-        user_settings.items_per_page = 10
-        user_settings.date_format = '%Y-%m-%d'
+        for name, value in default_values().items():
+            setattr(user_settings, name, value)
         
         db.session.commit()
+        invalidate(current_user.id)
         flash('Settings reset to defaults!', 'info')
     
     return redirect(url_for('settings.settings'))
@@ -0,0 +1,109 @@
+"""Synthetic expense data for the query audit and benchmarks."""
+import random
+from datetime import date, timedelta
+
+from app import data_version, db, rollups
+from app.models import User, Category, Subcategory, Expense
+from app.user_settings import create_default_settings
+
+CATEGORY_NAMES = [
+    'Groceries', 'Dining Out', 'Commute', 'Utilities', 'Rent', 'Healthcare',
+    'Shopping', 'Travel', 'Education', 'Insurance', 'Gifts', 'Personal Care'
+]
+
+DESCRIPTIONS = [
+    'Coffee shop', 'Grocery store', 'Gas station', 'Netflix subscription', 'Electricity bill',
+    'Pharmacy', 'Book store', 'Train ticket', 'Restaurant dinner', 'Movie tickets',
+    'Taxi ride', 'Internet bill', 'Gym membership', 'Hardware store', 'Bakery'
+]
+
+# Rows per executemany batch
+CHUNK_SIZE = 5000
+
+
+def create_user(username, password='password', email=None):
+    user = User(username=username, email=email or f'{username}@example.com')
+    user.set_password(password)
+    db.session.add(user)
+    db.session.flush()
+    create_default_settings(user.id)
+    return user
+
+
+def create_categories(user_id, categories=8, subcategories=3):
+    """Create categories with subcategories and return {category_id: [subcategory_id, ...]}."""
+    names = [CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + (f' {i // len(CATEGORY_NAMES)}' if i >= len(CATEGORY_NAMES) else '')
+             for i in range(categories)]
+    created = [Category(name=name, user_id=user_id) for name in names]
+    db.session.add_all(created)
+    db.session.flush()
+
+    children = [Subcategory(name=f'{category.name} - {n + 1}', category_id=category.id)
+                for category in created for n in range(subcategories)]
+    db.session.add_all(children)
+    db.session.flush()
+
+    tree = {category.id: [] for category in created}
+    for subcategory in children:
+        tree[subcategory.category_id].append(subcategory.id)
+    return tree
+
+
+def generate_expenses(user_id, tree, count, days=730, end=None, seed=0, skew=1.0):
+    """Yield expense row dicts spread over ``days`` days ending at ``end``.
+
+    Category popularity follows a Zipf distribution with exponent ``skew``:
+    0 spreads expenses evenly, larger values concentrate them in the first
+    few categories.
+    """
+    rng = random.Random(seed)
+    end = end or date.today()
+    category_ids = list(tree)
+    # Earlier categories get more expenses, like real spending
+    weights = [1.0 / (rank + 1) ** skew for rank in range(len(category_ids))]
+
+    for _ in range(count):
+        category_id = rng.choices(category_ids, weights)[0]
+        subcategory_ids = tree[category_id]
+        yield {
+            'description': rng.choice(DESCRIPTIONS),
+            'amount': round(rng.lognormvariate(3, 1), 2),
+            'date': end - timedelta(days=rng.randrange(days)),
+            'category_id': category_id,
+            'subcategory_id': rng.choice(subcategory_ids) if subcategory_ids and rng.random() < 0.7 else None,
+            'user_id': user_id,
+            'notes': rng.choice(['', 'paid by card', 'shared with friends', 'monthly']),
+        }
+
+
+def seed_user(user_id, expenses=1000, categories=8, subcategories=3, days=730, end=None, seed=0, skew=1.0):
+    """Bulk insert a synthetic history for ``user_id`` and refresh its rollups."""
+    tree = create_categories(user_id, categories, subcategories)
+
+    batch = []
+    for row in generate_expenses(user_id, tree, expenses, days=days, end=end, seed=seed, skew=skew):
+        batch.append(row)
+        if len(batch) == CHUNK_SIZE:
+            db.session.execute(Expense.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Expense.__table__.insert(), batch)
+
+    rollups.rebuild(db.session.connection(), user_id=user_id)
+    data_version.bump(user_id)
+    return tree
+
+
+def seed_dataset(users=1, prefix='user', **options):
+    """Create ``users`` users named ``<prefix>0``, ``<prefix>1``, ... each with a synthetic history.
+
+    ``options`` are passed to ``seed_user``; every user gets a different
+    random seed. Commits after each user and returns ``[(user_id, tree), ...]``.
+    """
+    seed = options.pop('seed', 0)
+    seeded = []
+    for n in range(users):
+        user = create_user(f'{prefix}{n}')
+        seeded.append((user.id, seed_user(user.id, seed=seed + n, **options)))
+        db.session.commit()
+    return seeded
@@ -0,0 +1,147 @@
+"""Full-text search over expense descriptions and notes.
+
+On SQLite builds with FTS5 an external-content ``expense_fts`` table indexes
+``expense.description`` and ``expense.notes``. Triggers on the expense table
+keep it in sync, so ORM writes, bulk Core inserts and raw SQL all update the
+index. Where FTS5 is not available, searches fall back to ILIKE.
+"""
+import re
+
+from markupsafe import escape
+from sqlalchemy import or_, select, text
+
+from app import db
+from app.models import Expense
+from app.money import from_minor
+
+FTS_TABLE = 'expense_fts'
+SNIPPET_TOKENS = 12
+
+# Placeholders for the highlight markers, swapped for <mark> after escaping
+_OPEN, _CLOSE = '\x02', '\x03'
+
+_CREATE_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        description, notes,
+        content='expense', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description, notes)
+        VALUES (new.id, new.description, new.notes);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes)
+        VALUES ('delete', old.id, old.description, old.notes);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF description, notes ON expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description, notes)
+        VALUES ('delete', old.id, old.description, old.notes);
+        INSERT INTO {FTS_TABLE}(rowid, description, notes)
+        VALUES (new.id, new.description, new.notes);
+    END""",
+]
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+_fts_available = {}
+
+
+def fts_available(connection):
+    engine = connection.engine
+    if engine not in _fts_available:
+        _fts_available[engine] = connection.dialect.name == 'sqlite' and bool(
+            connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar()
+        )
+    return _fts_available[engine]
+
+
+def install(connection):
+    """Create the FTS table and triggers if missing, indexing existing expenses."""
+    if not fts_available(connection):
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    ).scalar()
+    if not exists:
+        for statement in _CREATE_STATEMENTS:
+            connection.exec_driver_sql(statement)
+        rebuild(connection)
+    return True
+
+
+def rebuild(connection):
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(term):
+    """FTS5 query matching every word of ``term`` as a prefix, or None if it has no words."""
+    words = _WORD.findall(term or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def filter_expenses(query, term):
+    """Restrict an Expense query to rows whose description or notes match ``term``."""
+    connection = db.session.connection()
+    if not fts_available(connection):
+        pattern = f'%{term}%'
+        return query.filter(or_(Expense.description.ilike(pattern), Expense.notes.ilike(pattern)))
+
+    expression = match_expression(term)
+    if expression is None:
+        return query
+    matches = select(text('rowid')).select_from(text(FTS_TABLE)).where(
+        text(f'{FTS_TABLE} MATCH :fts_query').bindparams(fts_query=expression)
+    )
+    return query.filter(Expense.id.in_(matches))
+
+
+def _highlight(snippet):
+    return str(escape(snippet)).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(user_id, term, limit=20):
+    """Best matches for ``term`` as dicts with HTML-safe highlighted snippets."""
+    connection = db.session.connection()
+    if not fts_available(connection):
+        expenses = filter_expenses(Expense.query.filter_by(user_id=user_id), term)\
+            .order_by(Expense.date.desc(), Expense.id.desc()).limit(limit).all()
+        return [{
+            'id': expense.id,
+            'description': expense.description,
+            'notes': expense.notes,
+            'amount': expense.amount,
+            'date': expense.date.isoformat(),
+            'rank': None,
+            'description_snippet': str(escape(expense.description)),
+            'notes_snippet': str(escape(expense.notes or '')),
+        } for expense in expenses]
+
+    expression = match_expression(term)
+    if expression is None:
+        return []
+    rows = connection.execute(text(f"""
+        SELECT expense.id, expense.description, expense.notes, expense.amount, expense.date,
+               bm25({FTS_TABLE}) AS rank,
+               snippet({FTS_TABLE}, 0, :open, :close, '…', :tokens),
+               snippet({FTS_TABLE}, 1, :open, :close, '…', :tokens)
+        FROM {FTS_TABLE} JOIN expense ON expense.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :fts_query AND expense.user_id = :user_id
+        ORDER BY rank
+        LIMIT :limit
+    """), {
+        'open': _OPEN, 'close': _CLOSE, 'tokens': SNIPPET_TOKENS,
+        'fts_query': expression, 'user_id': user_id, 'limit': limit,
+    }).all()
+    return [{
+        'id': expense_id,
+        'description': description,
+        'notes': notes,
+        'amount': from_minor(amount),  # raw SQL, so the Money type isn't applied
+        'date': str(day),
+        'rank': rank,
+        'description_snippet': _highlight(description_snippet or ''),
+        'notes_snippet': _highlight(notes_snippet or ''),
+    } for expense_id, description, notes, amount, day, rank, description_snippet, notes_snippet in rows]
@@ -0,0 +1,70 @@
+"""Read access to UserSettings without a query (or a write) on every page.
+
+Views that only display settings call ``get_settings()``, which returns a
+read-only snapshot loaded at most once per request and kept in a bounded
+process cache. Views that change settings load the row themselves and call
+``invalidate()`` after committing.
+"""
+from types import SimpleNamespace
+
+from flask import g
+from flask_login import current_user
+
+from app import db
+from app.cache import TTLCache
+from app.models import UserSettings
+
+CACHE_SIZE = 1024
+CACHE_TTL = 60
+
+_cache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+
+def default_values():
+    """Column defaults of UserSettings, i.e. what a freshly inserted row contains."""
+    return {column.name: column.default.arg
+            for column in UserSettings.__table__.columns
+            if column.default is not None and column.default.is_scalar}
+
+
+def create_default_settings(user_id):
+    """Add a settings row with the defaults to the session; the caller commits."""
+    user_settings = UserSettings(user_id=user_id, **default_values())
+    db.session.add(user_settings)
+    return user_settings
+
+
+def _snapshot(user_id):
+    values = default_values()
+    row = UserSettings.query.filter_by(user_id=user_id).first()
+    if row is not None:
+        values.update({column.name: getattr(row, column.name) for column in UserSettings.__table__.columns})
+    values['user_id'] = user_id
+    return SimpleNamespace(**values)
+
+
+def get_settings(user_id=None):
+    """Read-only settings for ``user_id`` (the current user by default)."""
+    if user_id is None:
+        user_id = current_user.id
+
+    per_request = g.setdefault('user_settings', {})
+    if user_id in per_request:
+        return per_request[user_id]
+
+    snapshot = _cache.get(user_id)
+    if snapshot is None:
+        # Users without a row (created before rows were made at registration) see defaults
+        snapshot = _snapshot(user_id)
+        _cache.set(user_id, snapshot)
+    per_request[user_id] = snapshot
+    return snapshot
+
+
+def invalidate(user_id):
+    _cache.invalidate(user_id)
+    g.get('user_settings', {}).pop(user_id, None)
+
+
+def cache_stats():
+    return _cache.stats()
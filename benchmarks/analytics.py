@@ -0,0 +1,147 @@
+"""SQL-per-chart endpoints vs the in-memory analytics engine.
+
+Times the dashboard's chart endpoints, which run one or more SQL queries
+each, against ``GET /api/analytics`` requests that return the same figures
+from the user's cached expense arrays. The in-memory side is measured warm
+(frame cached) and cold (frame reloaded for every request), and both sides
+also answer two ad hoc breakdowns that no existing endpoint serves.
+
+    python -m benchmarks.analytics --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import extract, func
+
+from app import analytics, create_app, db
+from app.models import Category, Expense, ExpenseRollup
+from app.rollups import add_months
+from app.sampledata import create_user, seed_user
+
+CHART_ENDPOINTS = [
+    '/api/dashboard/stats',
+    '/api/expenses/monthly-trend',
+    '/api/expenses/category-comparison',
+]
+
+
+def analytics_chart_queries(today):
+    """``/api/analytics`` requests answering what CHART_ENDPOINTS return."""
+    month_start = today.replace(day=1).isoformat()
+    trend_start = add_months(today.replace(day=1), -11).isoformat()
+    recent_start = (today - timedelta(days=30)).isoformat()
+    comparison_start = (today - timedelta(days=90)).isoformat()
+    return [
+        f'/api/analytics?date_from={month_start}',
+        f'/api/analytics?group_by=day&date_from={recent_start}',
+        f'/api/analytics?group_by=category&date_from={month_start}',
+        f'/api/analytics?group_by=month&date_from={trend_start}',
+        f'/api/analytics?group_by=category&date_from={comparison_start}',
+    ]
+
+
+AD_HOC_QUERIES = [
+    '/api/analytics?group_by=category,month',
+    '/api/analytics?group_by=weekday,category&metrics=total,count,average',
+]
+
+
+def sql_category_month(user_id):
+    db.session.query(
+        Category.name, ExpenseRollup.year_month, func.sum(ExpenseRollup.total), func.sum(ExpenseRollup.count)
+    ).join(Category, ExpenseRollup.category_id == Category.id).filter(
+        ExpenseRollup.user_id == user_id
+    ).group_by(Category.name, ExpenseRollup.year_month).all()
+
+
+def sql_weekday_category(user_id):
+    # Weekdays aren't in the rollups, so this reads the expense table
+    weekday = extract('dow', Expense.date)
+    db.session.query(
+        weekday, Category.name, func.sum(Expense.amount), func.count(Expense.id), func.avg(Expense.amount)
+    ).join(Category, Expense.category_id == Category.id).filter(
+        Expense.user_id == user_id
+    ).group_by(weekday, Category.name).all()
+
+
+def measure(fn, repeat):
+    fn()  # warm the page cache
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run(size, repeat, workdir):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'bench_{size}.db'),
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SCHEMA_AUTO_UPGRADE': True,
+    })
+    with app.app_context():
+        user = create_user('bench')
+        seed_user(user.id, expenses=size, days=3650)
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        user_id = user.id
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'bench', 'password': 'password'})
+
+    def requests(urls, cold=False):
+        def call():
+            for url in urls:
+                if cold:
+                    with app.app_context():
+                        analytics.invalidate(user_id)
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+        return call
+
+    chart_queries = analytics_chart_queries(datetime.now().date())
+    results = [
+        ('charts: SQL endpoints', measure(requests(CHART_ENDPOINTS), repeat)),
+        ('charts: analytics (warm)', measure(requests(chart_queries), repeat)),
+        ('charts: analytics (cold)', measure(requests(chart_queries, cold=True), repeat)),
+    ]
+    with app.app_context():
+        results.append(('category x month: SQL', measure(lambda: sql_category_month(user_id), repeat)))
+        results.append(('weekday x category: SQL', measure(lambda: sql_weekday_category(user_id), repeat)))
+    results.append(('category x month: analytics', measure(requests(AD_HOC_QUERIES[:1]), repeat)))
+    results.append(('weekday x category: analytics', measure(requests(AD_HOC_QUERIES[1:]), repeat)))
+
+    with app.app_context():
+        frame_bytes = analytics.get_frame(user_id).nbytes
+    return results, frame_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='Comma separated expense counts per user')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-analytics-')
+    try:
+        print(f'{"expenses":>10}  {"query":<34} {"median ms":>10} {"p95 ms":>10}')
+        for size in (int(value) for value in args.sizes.split(',')):
+            results, frame_bytes = run(size, args.repeat, workdir)
+            for label, (median, p95) in results:
+                print(f'{size:>10}  {label:<34} {median:>10.2f} {p95:>10.2f}')
+            print(f'{size:>10}  cached frame: {frame_bytes / 1e6:.1f} MB')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Requests/sec for the dashboard and expense list under concurrent load.
+
+Seeds a throwaway SQLite database, then serves it two ways and drives the
+same load against each:
+
+- ``dev``: the Werkzeug development server (what ``python app.py`` runs) with
+  SQLite's default rollback journal and ``synchronous=FULL``
+- ``gunicorn``: ``gunicorn -c gunicorn.conf.py wsgi:app`` with WAL journaling
+  and ``synchronous=NORMAL``
+
+Every client logs in as its own session and alternates between the
+dashboard and the expense list. Every ``--write-every``th request instead
+adds an expense, so readers contend with a writer.
+
+    python -m benchmarks.load --expenses 50000 --clients 16 --duration 20
+"""
+import argparse
+import http.client
+import os
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from app import create_app, db
+from app.sampledata import create_user, seed_user
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+PAGES = ('/dashboard', '/expenses/')
+SERVERS = ('dev', 'gunicorn')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    """Keep-alive HTTP client holding one logged-in session."""
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, form=None):
+        headers = {'Cookie': '; '.join(f'{k}={v}' for k, v in self.cookies.items())}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            cookie = SimpleCookie(header)
+            self.cookies.update({key: morsel.value for key, morsel in cookie.items()})
+        return response.status, data.decode('utf-8', 'replace')
+
+    def csrf_token(self, path):
+        status, body = self.request('GET', path)
+        match = CSRF_PATTERN.search(body)
+        return match.group(1) if match else ''
+
+    def login(self, username, password):
+        token = self.csrf_token('/auth/login')
+        status, _ = self.request('POST', '/auth/login',
+                                 {'csrf_token': token, 'username': username, 'password': password})
+        assert status == 302, f'login failed with {status}'
+
+
+def seed(path, expenses):
+    # Rollback journal, so the file is complete when copied for each server
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'SQLITE_JOURNAL_MODE': 'DELETE',
+                      'SCHEMA_AUTO_UPGRADE': True})
+    with app.app_context():
+        user = create_user('loadtest')
+        tree = seed_user(user.id, expenses=expenses)
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        db.engine.dispose()
+        return sorted(tree)[0]
+
+
+def start_server(kind, db_path, port, workers, threads):
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL='sqlite:///' + db_path)
+    if kind == 'dev':
+        env.update(SQLITE_JOURNAL_MODE='DELETE', SQLITE_SYNCHRONOUS='FULL')
+        command = [sys.executable, '-c',
+                   f'from app import create_app; create_app().run(host="127.0.0.1", port={port})']
+    else:
+        env.update(BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers),
+                   GUNICORN_THREADS=str(threads), GUNICORN_ACCESS_LOG='')
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), 'wsgi:app']
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{kind} server did not start')
+
+
+def drive(port, clients, duration, write_every, category_id):
+    latencies = {page: [] for page in PAGES}
+    latencies['POST /expenses/add'] = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(clients + 1)
+
+    def worker(number):
+        client = Client(port)
+        client.login('loadtest', 'password')
+        token = client.csrf_token('/expenses/add')
+        form = {'csrf_token': token, 'description': 'Load test', 'amount': '9.99',
+                'date': date.today().isoformat(), 'category_id': str(category_id),
+                'subcategory_id': '0', 'notes': ''}
+        local = {key: [] for key in latencies}
+        failures = 0
+        start.wait()
+        deadline = time.monotonic() + duration
+        count = number
+        while time.monotonic() < deadline:
+            count += 1
+            if write_every and count % write_every == 0:
+                key, method, path, data = 'POST /expenses/add', 'POST', '/expenses/add', form
+            else:
+                key = path = PAGES[count % len(PAGES)]
+                method, data = 'GET', None
+            started = time.perf_counter()
+            status, _ = client.request(method, path, data)
+            elapsed = (time.perf_counter() - started) * 1000
+            if status >= 400:
+                failures += 1
+            local[key].append(elapsed)
+        with lock:
+            for key, values in local.items():
+                latencies[key].extend(values)
+            errors.append(failures)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--expenses', type=int, default=50000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load per server')
+    parser.add_argument('--write-every', type=int, default=10, help='Every Nth request adds an expense (0: reads only)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--servers', default=','.join(SERVERS))
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-load-')
+    try:
+        template = os.path.join(workdir, 'template.db')
+        category_id = seed(template, args.expenses)
+        print(f'{"server":<10} {"request":<20} {"req/s":>8} {"median ms":>10} {"p95 ms":>10}')
+        for kind in args.servers.split(','):
+            db_path = os.path.join(workdir, f'{kind}.db')
+            shutil.copy(template, db_path)
+            port = free_port()
+            process = start_server(kind, db_path, port, args.workers, args.threads)
+            try:
+                latencies, errors = drive(port, args.clients, args.duration, args.write_every, category_id)
+            finally:
+                process.terminate()
+                process.wait()
+            total = sum(len(values) for values in latencies.values())
+            for key, values in latencies.items():
+                if not values:
+                    continue
+                values.sort()
+                print(f'{kind:<10} {key:<20} {len(values) / args.duration:>8.1f} '
+                      f'{statistics.median(values):>10.1f} {values[int(len(values) * 0.95) - 1]:>10.1f}')
+            print(f'{kind:<10} {"all":<20} {total / args.duration:>8.1f}   ({errors} errors)')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
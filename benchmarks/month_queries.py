@@ -0,0 +1,128 @@
+"""Latency of month-scoped dashboard queries at different history sizes.
+
+Compares the original extract('month')/extract('year') queries over the raw
+expense table with the current endpoints, which read half-open ranges and
+``year_month`` buckets from the rollup table.
+
+    python -m benchmarks.month_queries --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, extract
+
+from app import create_app, db
+from app.models import Expense, Category
+from app.sampledata import create_user, seed_user
+
+
+def legacy_dashboard_stats(user_id):
+    current_month = datetime.now().month
+    current_year = datetime.now().year
+    db.session.query(func.sum(Expense.amount)).filter(
+        Expense.user_id == user_id,
+        extract('month', Expense.date) == current_month,
+        extract('year', Expense.date) == current_year
+    ).scalar()
+    thirty_days_ago = datetime.now().date() - timedelta(days=30)
+    db.session.query(func.sum(Expense.amount)).filter(
+        Expense.user_id == user_id,
+        Expense.date >= thirty_days_ago
+    ).scalar()
+    db.session.query(Category.name, func.sum(Expense.amount)).join(Expense).filter(
+        Expense.user_id == user_id,
+        extract('month', Expense.date) == current_month,
+        extract('year', Expense.date) == current_year
+    ).group_by(Category.name).all()
+    db.session.query(Expense.date, func.sum(Expense.amount)).filter(
+        Expense.user_id == user_id,
+        Expense.date >= thirty_days_ago
+    ).group_by(Expense.date).order_by(Expense.date).all()
+
+
+def legacy_monthly_trend(user_id):
+    start_date = datetime.now() - timedelta(days=365)
+    db.session.query(
+        extract('year', Expense.date),
+        extract('month', Expense.date),
+        func.sum(Expense.amount)
+    ).filter(
+        Expense.user_id == user_id,
+        Expense.date >= start_date.date()
+    ).group_by(
+        extract('year', Expense.date),
+        extract('month', Expense.date)
+    ).order_by(
+        extract('year', Expense.date),
+        extract('month', Expense.date)
+    ).all()
+
+
+def measure(fn, repeat):
+    fn()  # warm the page cache
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def run(size, repeat, workdir):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'bench_{size}.db'),
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SCHEMA_AUTO_UPGRADE': True,
+    })
+    with app.app_context():
+        user = create_user('bench')
+        # Ten years of history, so month-scoped queries touch a small slice
+        seed_user(user.id, expenses=size, days=3650)
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        user_id = user.id
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'bench', 'password': 'password'})
+
+    def endpoint(url):
+        def call():
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+        return call
+
+    results = []
+    with app.app_context():
+        results.append(('dashboard stats (extract)', measure(lambda: legacy_dashboard_stats(user_id), repeat)))
+        results.append(('monthly trend (extract)', measure(lambda: legacy_monthly_trend(user_id), repeat)))
+    results.append(('GET /api/dashboard/stats', measure(endpoint('/api/dashboard/stats'), repeat)))
+    results.append(('GET /api/expenses/monthly-trend', measure(endpoint('/api/expenses/monthly-trend'), repeat)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='Comma separated expense counts per user')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-months-')
+    try:
+        print(f'{"expenses":>10}  {"query":<34} {"median ms":>10} {"p95 ms":>10}')
+        for size in (int(value) for value in args.sizes.split(',')):
+            for label, (median, p95) in run(size, args.repeat, workdir):
+                print(f'{size:>10}  {label:<34} {median:>10.2f} {p95:>10.2f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
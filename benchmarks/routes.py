@@ -0,0 +1,498 @@
+"""Latency, SQL statements and memory of every route on a synthetic dataset.
+
+Seeds a throwaway database with ``--users`` users, each with ``--expenses``
+expenses spread over ``--days`` days, then drives every route through the
+Flask test client as the first of them: one untimed request to compile
+templates and fill caches, then ``--repeat`` timed ones. Routes that change
+data get a fresh target for every request (a new expense to delete, a new
+category to merge away, a new user to register, ...), created outside the
+timed part. Deleting all expenses needs a fully seeded scratch user each
+time, so it only runs ``--heavy-repeat`` times. Jobs run inside the request
+(``JOBS_EAGER``), so imports, exports and merges are timed with their work.
+
+For each route the report records p50/p95/p99 latency, the SQL statements
+issued by a request and the peak Python heap allocated while one extra,
+untimed request is handled. It is JSON with sorted keys, so two runs diff
+cleanly, and ``--baseline`` compares this run with an earlier report and
+exits with status 1 when a route got more than ``--threshold`` times slower
+at p95 or hungrier for memory, or issues more statements than before.
+
+    python -m benchmarks.routes --expenses 36500 --output before.json
+    python -m benchmarks.routes --expenses 36500 --output after.json --baseline before.json
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import date, datetime, timezone
+
+from app import create_app, db, jobs
+from app.instrumentation import count_queries
+from app.models import Category, Expense, Subcategory
+from app.pagination import encode_cursor
+from app.sampledata import create_user, generate_expenses, seed_dataset, seed_user
+
+REPORT_VERSION = 1
+USERNAME = 'bench0'
+METRICS_TOKEN = 'bench'
+# Rows in the file uploaded by each import request
+IMPORT_ROWS = 500
+# Expenses moved by each merge and subcategory delete
+FIXTURE_EXPENSES = 100
+# Changes smaller than these are noise, whatever the ratio
+MIN_DELTA_MS = 1.0
+MIN_DELTA_KIB = 64
+
+SETTINGS_FORM = {
+    'currency_symbol': '$', 'currency_code': 'USD', 'decimal_places': '2', 'theme': 'light',
+    'primary_color': '#007bff', 'secondary_color': '#6c757d', 'default_date_range': 'all_time',
+    'chart_type': 'pie', 'items_per_page': '25', 'date_format': '%Y-%m-%d',
+}
+
+# ``prepare()`` returns ``(client, method, url, data)`` for one request
+Route = namedtuple('Route', 'name prepare heavy', defaults=(False,))
+
+
+class Bench:
+    """The seeded app, the benchmark user's data and fixtures for routes that consume them."""
+
+    def __init__(self, app, user_id, tree, dataset):
+        self.app = app
+        self.user_id = user_id
+        self.dataset = dataset
+        # Categories are ordered by popularity, so this one holds the most expenses
+        self.category_id = next(iter(tree))
+        self.subcategory_id = tree[self.category_id][0]
+        self._counter = itertools.count()
+
+        with app.app_context():
+            expense = Expense.query.filter_by(user_id=user_id, category_id=self.category_id).first()
+            self.expense_id = expense.id
+            self.cursor = encode_cursor(expense)
+            self.job_id = jobs.submit(user_id, 'export', {'export_format': 'csv', 'filters': {}}).id
+            self.upload = self._import_file(tree)
+
+        self.client = self.login(USERNAME)
+        self.guest = app.test_client()
+        self.scraper = app.test_client()
+        self.scraper.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {METRICS_TOKEN}'
+
+    def _import_file(self, tree):
+        names = dict(db.session.query(Category.id, Category.name).filter(Category.id.in_(tree)))
+        subcategory_names = dict(db.session.query(Subcategory.id, Subcategory.name)
+                                 .filter(Subcategory.category_id.in_(tree)))
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['description', 'amount', 'date', 'category', 'subcategory', 'notes'])
+        for row in generate_expenses(self.user_id, tree, IMPORT_ROWS, days=self.dataset['days'], seed=-1):
+            writer.writerow([row['description'], row['amount'], row['date'].isoformat(), names[row['category_id']],
+                             subcategory_names.get(row['subcategory_id'], ''), row['notes']])
+        return output.getvalue().encode()
+
+    def unique(self, prefix):
+        return f'{prefix}{next(self._counter)}'
+
+    def login(self, username):
+        client = self.app.test_client()
+        response = client.post('/auth/login', data={'username': username, 'password': 'password'})
+        assert response.status_code == 302, f'login as {username} failed with {response.status_code}'
+        return client
+
+    def scratch_client(self, expenses=0):
+        """A client logged in as a new user with ``expenses`` expenses of their own."""
+        username = self.unique('scratch')
+        with self.app.app_context():
+            user = create_user(username)
+            if expenses:
+                seed_user(user.id, expenses=expenses, categories=self.dataset['categories'],
+                          subcategories=self.dataset['subcategories'], days=self.dataset['days'],
+                          skew=self.dataset['skew'])
+            db.session.commit()
+        return self.login(username)
+
+    def _add_expenses(self, tree, count):
+        # Through the ORM, so the flush hooks keep rollups and data versions current
+        rows = generate_expenses(self.user_id, tree, count, days=self.dataset['days'], seed=next(self._counter))
+        db.session.add_all(Expense(**row) for row in rows)
+
+    def expense(self):
+        with self.app.app_context():
+            expense = Expense(description='Bench expense', amount='9.99', date=date.today(),
+                              category_id=self.category_id, user_id=self.user_id)
+            db.session.add(expense)
+            db.session.commit()
+            return expense.id
+
+    def category(self, expenses=0, subcategories=0):
+        """Create a category, optionally with subcategories and expenses; return its id."""
+        with self.app.app_context():
+            category = Category(name=self.unique('Bench category '), user_id=self.user_id)
+            db.session.add(category)
+            db.session.flush()
+            children = [Subcategory(name=f'{category.name} - {n + 1}', category_id=category.id)
+                        for n in range(subcategories)]
+            db.session.add_all(children)
+            db.session.flush()
+            if expenses:
+                self._add_expenses({category.id: [child.id for child in children]}, expenses)
+            db.session.commit()
+            return category.id
+
+    def subcategory(self, expenses=0):
+        """Create a subcategory of the main category, optionally with expenses; return its id."""
+        with self.app.app_context():
+            subcategory = Subcategory(name=self.unique('Bench subcategory '), category_id=self.category_id)
+            db.session.add(subcategory)
+            db.session.flush()
+            if expenses:
+                self._add_expenses({self.category_id: [subcategory.id]}, expenses)
+            db.session.commit()
+            return subcategory.id
+
+
+def routes(bench):
+    """Every route, with the requests that exercise it."""
+    today = date.today().isoformat()
+    category_id, subcategory_id = bench.category_id, bench.subcategory_id
+    expense_id, cursor, job_id = bench.expense_id, bench.cursor, bench.job_id
+    edited_category_id = bench.category()
+    edited_subcategory_id = bench.subcategory()
+    expense_form = {
+        'description': 'Bench expense', 'amount': '12.50', 'date': today,
+        'category_id': str(category_id), 'subcategory_id': str(subcategory_id), 'notes': 'bench',
+    }
+
+    def get(url):
+        return lambda: (bench.client, 'GET', url, None)
+
+    def post(url, data):
+        return lambda: (bench.client, 'POST', url, data)
+
+    def register():
+        username = bench.unique('newuser')
+        return (bench.app.test_client(), 'POST', '/auth/register', {
+            'username': username, 'email': f'{username}@example.com', 'password': 'password', 'password2': 'password',
+        })
+
+    return [
+        # auth
+        Route('GET /auth/login', lambda: (bench.guest, 'GET', '/auth/login', None)),
+        Route('POST /auth/login', lambda: (bench.app.test_client(), 'POST', '/auth/login',
+                                           {'username': USERNAME, 'password': 'password'})),
+        Route('GET /auth/register', lambda: (bench.guest, 'GET', '/auth/register', None)),
+        Route('POST /auth/register', register),
+        Route('GET /auth/logout', lambda: (bench.login(USERNAME), 'GET', '/auth/logout', None)),
+        # main
+        Route('GET /', lambda: (bench.guest, 'GET', '/', None)),
+        Route('GET /dashboard', get('/dashboard')),
+        Route('GET /create-sample-data', lambda: (bench.scratch_client(), 'GET', '/create-sample-data', None)),
+        # expenses
+        Route('GET /expenses/', get('/expenses/')),
+        Route('GET /expenses/?after=<cursor>&category_id&subcategory_id',
+              get(f'/expenses/?after={cursor}&category_id={category_id}&subcategory_id={subcategory_id}')),
+        Route('GET /expenses/?before=<cursor>', get(f'/expenses/?before={cursor}')),
+        Route('GET /expenses/?amount_min&amount_max&date_from&date_to&description_search',
+              get('/expenses/?amount_min=5&amount_max=50&date_from=2024-01-01&date_to=2024-12-31'
+                  '&description_search=coffee')),
+        Route('GET /expenses/add', get('/expenses/add')),
+        Route('POST /expenses/add', post('/expenses/add', expense_form)),
+        Route('GET /expenses/edit/<id>', get(f'/expenses/edit/{expense_id}')),
+        Route('POST /expenses/edit/<id>', post(f'/expenses/edit/{expense_id}', dict(expense_form, amount='15.00'))),
+        Route('GET /expenses/delete/<id>', lambda: (bench.client, 'GET', f'/expenses/delete/{bench.expense()}', None)),
+        Route('GET /expenses/delete-all',
+              lambda: (bench.scratch_client(bench.dataset['expenses']), 'GET', '/expenses/delete-all', None),
+              heavy=True),
+        Route('GET /expenses/import', get('/expenses/import')),
+        Route('POST /expenses/import',
+              lambda: (bench.client, 'POST', '/expenses/import', {'file': (io.BytesIO(bench.upload), 'bench.csv')})),
+        Route('GET /expenses/export', get('/expenses/export')),
+        Route('GET /expenses/export?format=csv.gz&category_id',
+              get(f'/expenses/export?format=csv.gz&category_id={category_id}')),
+        Route('GET /expenses/export?format=xlsx', get('/expenses/export?format=xlsx')),
+        Route('POST /expenses/export', post('/expenses/export', {'format': 'csv.gz'})),
+        # jobs
+        Route('GET /jobs/', get('/jobs/')),
+        Route('GET /jobs/<id>', get(f'/jobs/{job_id}')),
+        Route('GET /jobs/<id>/download', get(f'/jobs/{job_id}/download')),
+        Route('POST /jobs/<id>/cancel', post(f'/jobs/{job_id}/cancel', None)),
+        Route('POST /jobs/<id>/resume', post(f'/jobs/{job_id}/resume', None)),
+        # categories
+        Route('GET /categories/', get('/categories/')),
+        Route('GET /categories/add', get('/categories/add')),
+        Route('POST /categories/add', lambda: (bench.client, 'POST', '/categories/add',
+                                               {'name': bench.unique('Added category '), 'description': ''})),
+        Route('GET /categories/edit/<id>', get(f'/categories/edit/{edited_category_id}')),
+        Route('POST /categories/edit/<id>', lambda: (bench.client, 'POST', f'/categories/edit/{edited_category_id}',
+                                                     {'name': bench.unique('Renamed category '), 'description': ''})),
+        Route('GET /categories/delete/<id>',
+              lambda: (bench.client, 'GET', f'/categories/delete/{bench.category()}', None)),
+        Route('GET /categories/<id>/subcategories', get(f'/categories/{category_id}/subcategories')),
+        Route('GET /categories/<id>/subcategories/add', get(f'/categories/{category_id}/subcategories/add')),
+        Route('POST /categories/<id>/subcategories/add',
+              lambda: (bench.client, 'POST', f'/categories/{category_id}/subcategories/add',
+                       {'name': bench.unique('Added subcategory ')})),
+        Route('GET /categories/subcategories/edit/<id>', get(f'/categories/subcategories/edit/{edited_subcategory_id}')),
+        Route('POST /categories/subcategories/edit/<id>',
+              lambda: (bench.client, 'POST', f'/categories/subcategories/edit/{edited_subcategory_id}',
+                       {'name': bench.unique('Renamed subcategory ')})),
+        Route('GET /categories/subcategories/delete/<id>',
+              lambda: (bench.client, 'GET',
+                       f'/categories/subcategories/delete/{bench.subcategory(FIXTURE_EXPENSES)}', None)),
+        Route('GET /categories/<id>/subcategories/json', get(f'/categories/{category_id}/subcategories/json')),
+        Route('GET /categories/merge', get('/categories/merge')),
+        Route('POST /categories/merge',
+              lambda: (bench.client, 'POST', '/categories/merge', {
+                  'source_category': str(bench.category(FIXTURE_EXPENSES, subcategories=2)),
+                  'target_category': str(category_id),
+              })),
+        Route('GET /categories/subcategories/merge/<id>', get(f'/categories/subcategories/merge/{category_id}')),
+        Route('POST /categories/subcategories/merge/<id>',
+              lambda: (bench.client, 'POST', f'/categories/subcategories/merge/{category_id}', {
+                  'source_subcategory': str(bench.subcategory(FIXTURE_EXPENSES)),
+                  'target_subcategory': str(subcategory_id),
+              })),
+        # api
+        Route('GET /api/dashboard/summary', get('/api/dashboard/summary')),
+        Route('GET /api/dashboard/stats', get('/api/dashboard/stats')),
+        Route('GET /api/expenses?after=<cursor>&per_page=50', get(f'/api/expenses?after={cursor}&per_page=50')),
+        Route('GET /api/expenses?description_search&with_total',
+              get('/api/expenses?description_search=coffee&with_total=1')),
+        Route('GET /api/expenses/search?q', get('/api/expenses/search?q=coff')),
+        Route('GET /api/analytics?group_by=category,subcategory,month',
+              get('/api/analytics?group_by=category,subcategory,month&metrics=total,count,average')),
+        Route('GET /api/analytics?group_by=week&category_id&date_from&order',
+              get(f'/api/analytics?group_by=week&category_id={category_id}&date_from=2024-01-01&order=-total')),
+        Route('GET /api/expenses/test-data', get('/api/expenses/test-data')),
+        Route('GET /api/expenses/custom-range', get('/api/expenses/custom-range')),
+        Route('GET /api/expenses/custom-range?date_from&date_to',
+              get('/api/expenses/custom-range?date_from=2024-01-01&date_to=2024-06-30')),
+        Route('GET /api/expenses/monthly-trend', get('/api/expenses/monthly-trend')),
+        Route('GET /api/expenses/category-comparison', get('/api/expenses/category-comparison')),
+        Route('GET /api/debug/expenses', get('/api/debug/expenses')),
+        Route('GET /api/jobs', get('/api/jobs')),
+        Route('GET /api/jobs/<id>', get(f'/api/jobs/{job_id}')),
+        Route('POST /api/jobs/<id>/cancel', post(f'/api/jobs/{job_id}/cancel', None)),
+        Route('POST /api/jobs/<id>/resume', post(f'/api/jobs/{job_id}/resume', None)),
+        # settings
+        Route('GET /settings/settings', get('/settings/settings')),
+        Route('POST /settings/settings', post('/settings/settings', SETTINGS_FORM)),
+        Route('GET /settings/settings/reset', get('/settings/settings/reset')),
+        Route('GET /settings/settings/preview-theme', get('/settings/settings/preview-theme?theme=dark')),
+        # instrumentation
+        Route('GET /metrics', lambda: (bench.scraper, 'GET', '/metrics', None)),
+    ]
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of ``samples``."""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def request(client, method, url, data):
+    response = client.open(url, method=method, data=data)
+    response.get_data()
+    response.close()
+    return response
+
+
+def measure(route, repeat):
+    if not route.heavy:
+        request(*route.prepare())  # compile templates, fill caches
+
+    samples = []
+    queries = []
+    statuses = set()
+    for _ in range(repeat):
+        prepared = route.prepare()
+        # Counted around the whole request, so statements of streamed responses are included
+        with count_queries() as counter:
+            started = time.perf_counter()
+            response = request(*prepared)
+            samples.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+        statuses.add(response.status_code)
+
+    # tracemalloc slows every allocation down, so memory gets a request of its own
+    prepared = route.prepare()
+    tracemalloc.start()
+    try:
+        request(*prepared)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'samples': len(samples),
+        'status': sorted(statuses),
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'mean_ms': round(sum(samples) / len(samples), 3),
+        'max_ms': round(max(samples), 3),
+        'queries': max(queries),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def environment(engine):
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': engine.dialect.name,
+        'created': datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+    }
+    if engine.dialect.name == 'sqlite':
+        info['sqlite'] = sqlite3.sqlite_version
+    return info
+
+
+def run(dataset, repeat, heavy_repeat, response_cache=True, database_url=None, echo=print):
+    """Seed ``dataset``, measure every route and return the report."""
+    workdir = tempfile.mkdtemp(prefix='bench-routes-')
+    try:
+        config = {
+            'SQLALCHEMY_DATABASE_URI': database_url or 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+            'UPLOAD_FOLDER': workdir,
+            'TESTING': True,
+            'PROPAGATE_EXCEPTIONS': False,
+            'WTF_CSRF_ENABLED': False,
+            'JOBS_EAGER': True,
+            'METRICS_TOKEN': METRICS_TOKEN,
+            'SCHEMA_AUTO_UPGRADE': True,
+        }
+        if not response_cache:
+            config['RESPONSE_CACHE_MAX_BYTES'] = 0
+        app = create_app(config)
+
+        started = time.perf_counter()
+        with app.app_context():
+            options = {key: dataset[key] for key in ('expenses', 'categories', 'subcategories', 'days', 'skew')}
+            (user_id, tree), *_ = seed_dataset(dataset['users'], prefix='bench', seed=dataset['seed'], **options)
+            if db.engine.dialect.name == 'sqlite':
+                db.session.execute(db.text('ANALYZE'))
+                db.session.commit()
+            engine = db.engine
+        seed_seconds = time.perf_counter() - started
+        echo(f'Seeded {dataset["users"]} users x {dataset["expenses"]} expenses in {seed_seconds:.1f}s')
+
+        bench = Bench(app, user_id, tree, dataset)
+        adapter = app.url_map.bind('localhost')
+        results = {}
+        exercised = set()
+        for route in routes(bench):
+            method, path = route.name.split(' ', 1)
+            endpoint, _ = adapter.match(path.split('?')[0].replace('<id>', '1').replace('<cursor>', ''),
+                                        method=method)
+            exercised.add(endpoint)
+            results[route.name] = dict(measure(route, heavy_repeat if route.heavy else repeat), endpoint=endpoint)
+            echo(f'  {route.name}: p95 {results[route.name]["p95_ms"]:.1f} ms')
+
+        endpoints = {rule.endpoint for rule in app.url_map.iter_rules()} - {'static'}
+        return {
+            'version': REPORT_VERSION,
+            'dataset': dataset,
+            'options': {'repeat': repeat, 'heavy_repeat': heavy_repeat, 'response_cache': response_cache},
+            'environment': environment(engine),
+            'seed_seconds': round(seed_seconds, 1),
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'not_exercised': sorted(endpoints - exercised),
+            'routes': results,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(baseline, report, threshold):
+    """Regressions of ``report`` against ``baseline``, as printable lines."""
+    regressions = []
+    for name, current in sorted(report['routes'].items()):
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        if (current['p95_ms'] > previous['p95_ms'] * threshold
+                and current['p95_ms'] - previous['p95_ms'] > MIN_DELTA_MS):
+            regressions.append(f'{name}: p95 {previous["p95_ms"]:.2f} -> {current["p95_ms"]:.2f} ms')
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: {previous["queries"]} -> {current["queries"]} statements')
+        if (current['peak_kib'] > previous['peak_kib'] * threshold
+                and current['peak_kib'] - previous['peak_kib'] > MIN_DELTA_KIB):
+            regressions.append(f'{name}: peak memory {previous["peak_kib"]:.0f} -> {current["peak_kib"]:.0f} KiB')
+        if any(status >= 500 for status in current['status']) and not any(
+                status >= 500 for status in previous['status']):
+            regressions.append(f'{name}: status {current["status"]}')
+    return regressions
+
+
+def print_table(report):
+    print(f'{"route":<72} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KiB":>9}')
+    for name, result in report['routes'].items():
+        print(f'{name:<72} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+              f'{result["queries"]:>8} {result["peak_kib"]:>9.1f}')
+        if any(status >= 500 for status in result['status']):
+            print(f'warning: {name} failed with status {result["status"]}')
+    for endpoint in report['not_exercised']:
+        print(f'warning: {endpoint} was not exercised')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=3, help='Users to seed; the first one is benchmarked')
+    parser.add_argument('--expenses', type=int, default=20000, help='Expenses per user')
+    parser.add_argument('--categories', type=int, default=12, help='Categories per user')
+    parser.add_argument('--subcategories', type=int, default=4, help='Subcategories per category')
+    parser.add_argument('--days', type=int, default=3650, help='Days of history the expenses are spread over')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Zipf exponent of category popularity (0 spreads expenses evenly)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help='Timed requests per route')
+    parser.add_argument('--heavy-repeat', type=int, default=3,
+                        help='Timed requests for routes that need a fully seeded scratch user each time')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='Disable the response cache, so aggregate endpoints run their queries every time')
+    parser.add_argument('--database-url', help='Empty, throwaway database to use instead of a temporary SQLite file')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare this run with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slowdown (or memory growth) ratio at p95 reported as a regression')
+    args = parser.parse_args()
+
+    dataset = {
+        'users': args.users, 'expenses': args.expenses, 'categories': args.categories,
+        'subcategories': args.subcategories, 'days': args.days, 'skew': args.skew, 'seed': args.seed,
+    }
+    report = run(dataset, args.repeat, args.heavy_repeat, response_cache=not args.no_response_cache,
+                 database_url=args.database_url)
+    print_table(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['dataset'] != report['dataset']:
+            print('warning: the baseline was recorded on a different dataset')
+        regressions = compare(baseline, report, args.threshold)
+        for line in regressions:
+            print(f'regression: {line}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions against the baseline.')
+
+
+if __name__ == '__main__':
+    main()
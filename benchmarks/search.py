@@ -0,0 +1,103 @@
+"""Latency of expense text search with ILIKE and with the FTS5 index.
+
+For a common term and a rare one, times counting every match and fetching
+the first page of matches (newest first, as the expense list does) with the
+original ILIKE filter and with the full-text index, plus the ranked search
+endpoint.
+
+    python -m benchmarks.search --sizes 100000,1000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from datetime import date
+
+from sqlalchemy import or_
+
+from app import create_app, db, search
+from app.models import Expense
+from app.sampledata import create_user, seed_user
+from benchmarks.month_queries import measure
+
+RARE_DESCRIPTION = 'Zanzibar spice market'
+RARE_COUNT = 50
+TERMS = ('coffee', 'zanzibar')
+PAGE_SIZE = 20
+
+
+def ilike_query(user_id, term):
+    pattern = f'%{term}%'
+    return Expense.query.filter(
+        Expense.user_id == user_id,
+        or_(Expense.description.ilike(pattern), Expense.notes.ilike(pattern))
+    )
+
+
+def fts_query(user_id, term):
+    return search.filter_expenses(Expense.query.filter(Expense.user_id == user_id), term)
+
+
+def first_page(query):
+    return query.order_by(Expense.date.desc(), Expense.id.desc()).limit(PAGE_SIZE).all()
+
+
+def run(size, repeat, workdir):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'bench_{size}.db'),
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SCHEMA_AUTO_UPGRADE': True,
+    })
+    with app.app_context():
+        user = create_user('bench')
+        tree = seed_user(user.id, expenses=size, days=3650)
+        category_id = sorted(tree)[0]
+        db.session.execute(Expense.__table__.insert(), [{
+            'description': RARE_DESCRIPTION, 'amount': 10.0, 'date': date(2020, 1, 1 + n % 28),
+            'category_id': category_id, 'subcategory_id': None, 'user_id': user.id, 'notes': '',
+        } for n in range(RARE_COUNT)])
+        db.session.commit()
+        db.session.execute(db.text('ANALYZE'))
+        user_id = user.id
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'bench', 'password': 'password'})
+
+    results = []
+    with app.app_context():
+        for term in TERMS:
+            db.session.expunge_all()
+            assert ilike_query(user_id, term).count() == fts_query(user_id, term).count()
+            results.append((f'count "{term}" (ILIKE)', measure(lambda: ilike_query(user_id, term).count(), repeat)))
+            results.append((f'count "{term}" (FTS)', measure(lambda: fts_query(user_id, term).count(), repeat)))
+            results.append((f'first page "{term}" (ILIKE)', measure(lambda: first_page(ilike_query(user_id, term)), repeat)))
+            results.append((f'first page "{term}" (FTS)', measure(lambda: first_page(fts_query(user_id, term)), repeat)))
+
+    for term in TERMS:
+        def call(url=f'/api/expenses/search?q={term[:4]}'):
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+        results.append((f'GET /api/expenses/search?q={term[:4]}', measure(call, repeat)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100000,1000000',
+                        help='Comma separated expense counts per user')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-search-')
+    try:
+        print(f'{"expenses":>10}  {"query":<36} {"median ms":>10} {"p95 ms":>10}')
+        for size in (int(value) for value in args.sizes.split(',')):
+            for label, (median, p95) in run(size, args.repeat, workdir):
+                print(f'{size:>10}  {label:<36} {median:>10.2f} {p95:>10.2f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
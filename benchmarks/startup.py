@@ -0,0 +1,120 @@
+"""Worker startup time and where it goes.
+
+Each measurement runs in a fresh interpreter against a throwaway SQLite
+database whose schema is already up to date, as a newly started worker
+would: ``from app import create_app`` and ``create_app()`` are timed
+separately, and ``-X importtime`` attributes the import time to packages
+(and to the app's own modules). The boot is also timed with
+``SCHEMA_AUTO_UPGRADE=1`` to show the per-boot cost of schema work, and the
+optional heavy dependencies are imported afterwards to show what the first
+import, export or analytics request pays instead.
+
+    python -m benchmarks.startup --repeat 5 --top 15
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'loaded': [name for name in ('pandas', 'numpy', 'openpyxl') if name in sys.modules]}))
+'''
+
+# Imported in this order, so each figure excludes what the previous ones loaded
+DEFERRED = [
+    ('numpy', 'analytics queries'),
+    ('pandas', 'imports'),
+    ('openpyxl', 'xlsx imports and exports'),
+]
+
+FIRST_USE = '''
+import json, time
+from app import create_app
+create_app()
+timings = {}
+for name in %r:
+    started = time.perf_counter()
+    __import__(name)
+    timings[name] = time.perf_counter() - started
+print(json.dumps(timings))
+''' % ([name for name, _ in DEFERRED],)
+
+
+def run_child(code, database_url, importtime=False, **env):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=database_url, **env))
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def import_times(stderr):
+    """Self import time in seconds per package (per module for the app's own modules)."""
+    totals = Counter()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        group = name if name.split('.')[0] == 'app' else name.split('.')[0]
+        totals[group] += int(self_us) / 1e6
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Interpreters started per measurement')
+    parser.add_argument('--top', type=int, default=15, help='Packages and modules listed by import time')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-startup-')
+    database_url = 'sqlite:///' + os.path.join(workdir, 'startup.db')
+    try:
+        # Create the schema once, as `flask db upgrade` does before workers start
+        run_child('from app import create_app; create_app(); print("null")', database_url, SCHEMA_AUTO_UPGRADE='1')
+
+        boots, upgraded, first_use = [], [], []
+        totals = Counter()
+        for _ in range(args.repeat):
+            boot, stderr = run_child(BOOT, database_url, importtime=True)
+            boots.append(boot)
+            totals.update(import_times(stderr))
+            upgraded.append(run_child(BOOT, database_url, SCHEMA_AUTO_UPGRADE='1')[0])
+            first_use.append(run_child(FIRST_USE, database_url)[0])
+
+        def median(runs, key):
+            return statistics.median(run[key] for run in runs) * 1000
+
+        print(f'{"boot (median of " + str(args.repeat) + ")":<44} {"ms":>8}')
+        print(f'{"  from app import create_app":<44} {median(boots, "import"):>8.1f}')
+        print(f'{"  create_app()":<44} {median(boots, "create_app"):>8.1f}')
+        print(f'{"  create_app() with SCHEMA_AUTO_UPGRADE=1":<44} {median(upgraded, "create_app"):>8.1f}')
+        loaded = boots[-1]['loaded']
+        print(f'  heavy dependencies loaded at boot: {", ".join(loaded) if loaded else "none"}')
+
+        print(f'\n{"import time by package (self, mean)":<44} {"ms":>8}')
+        for name, seconds in totals.most_common(args.top):
+            print(f'{"  " + name:<44} {seconds / args.repeat * 1000:>8.1f}')
+
+        print(f'\n{"deferred to first use (median)":<44} {"ms":>8}')
+        for name, used_by in DEFERRED:
+            print(f'{"  " + name + " (" + used_by + ")":<44} {median(first_use, name):>8.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
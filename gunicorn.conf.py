@@ -0,0 +1,28 @@
+"""Gunicorn settings, overridable through environment variables.
+
+The app is loaded once in the master (``preload_app``) so workers share its
+imports, then each forked worker drops the master's pooled database
+connections and opens its own. The schema is upgraded before gunicorn starts
+(``flask db upgrade``), not by the app.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))  # imports and exports can be slow
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None  # empty disables it
+
+
+def post_fork(server, worker):
+    from app import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)